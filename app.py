@@ -3,11 +3,27 @@ import pandas as pd
 import gspread
 from google.oauth2.service_account import Credentials
 from datetime import datetime
+from collections import Counter
+import os
 import time
 import re
+from fake_gspread import FakeClient
+from local_store import LocalStore, SyncEngine
+from quota import QuotaClient
+from profiler import RerunProfile, to_jsonl
+from depgraph import DataGraph
+from forecast import fixed_flows, merge_rules, model_lines, month_axis, project, purchase_flows, rule_amount, shop_purchases, simulate, spend_stats, ym_label
+from workbook import SNAPSHOT_SHEETS, JOURNAL, get_worksheets, load_snapshot, load_journal_months, invalidate_snapshot, records_frame, journal_frame, journal_months, snapshot_cell, asset_registry, SheetBatch, write_cell_if_changed, cell_write_state, pending_cell, journal_rollup, carry_rollup, recurring_rules, rule_index, archive_due, archive_journal, archive_manifest, archived_frame, month_spend, settle_snapshot, fetch_report, missing_ids, assign_row_ids, start_write_queue, writes_pending, sheet_balances, derived_balances, record_balances, adjust_balance, reset_balances, rebuild_balances, load_checkpoint
+from ledger import FILTER_RULES, ID_COLUMN, IMPORT_ALIASES, LIQUID_ACCOUNTS, LOG_COLUMNS, SELF_INSTALLMENT, SHOP_NEW, SHOP_NUMBERS, SHOP_SHEET, TWD, GAP, BALANCE_ACCOUNTS, MonthRollup, Transaction, category_of, due_rules, grid_changes, number_column, liquid_gap, manual_entry, month_budget, balance_effect, journal_deltas, balance_drift, guess_columns, journal_keys, plan_import, read_statement
 
 # --- 設定頁面資訊 ---
 st.set_page_config(page_title="宇毛的財務中控台", page_icon="💰", layout="wide")
+if "flash" in st.session_state: st.toast(st.session_state.pop("flash"))
+
+# --- 效能分析模式 (側邊欄開關)：記錄每次 rerun 各階段耗時、API 呼叫與資料表大小 ---
+# FINANCE_PROFILE_LOG: 另外把每次 rerun 的紀錄附加到此 JSONL 檔
+PROFILE_KEEP = 200
+prof = RerunProfile(st.session_state.get("profile_on", False))
 
 # --- CSS 極致美化 (v31.0 Delete & Rollback) ---
 st.markdown("""
@@ -129,24 +145,96 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 連接 Google Sheets ---
+# FINANCE_FAKE_WORKBOOK: 以 JSON 檔假工作簿取代 Google Sheets (離線開發)
+# FINANCE_LOCAL_DB: 讀寫本地 SQLite 鏡像，背景與 Sheets 雙向同步
+# FINANCE_FAKE_429: 假工作簿每次 API 呼叫回 429 的機率
+# 所有 API 呼叫都經過 QuotaClient (限流 + 退避重試)
+def open_workbook():
+    if os.environ.get("FINANCE_FAKE_WORKBOOK"):
+        client = FakeClient(os.environ["FINANCE_FAKE_WORKBOOK"], fail_rate=float(os.environ.get("FINANCE_FAKE_429", 0)))
+    else:
+        scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+        if "gcp_service_account" in st.secrets:
+            creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scope)
+        else:
+            creds = Credentials.from_service_account_file("credentials.json", scopes=scope)
+        client = gspread.authorize(creds)
+    return QuotaClient(client.open("宇毛的財務追蹤表_2026"))
+
 @st.cache_resource
 def connect_to_gsheet():
-    scope = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-    if "gcp_service_account" in st.secrets:
-        creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scope)
-    else:
-        creds = Credentials.from_service_account_file("credentials.json", scopes=scope)
-    return gspread.authorize(creds).open("宇毛的財務追蹤表_2026")
+    return open_workbook()
 
-try: sh = connect_to_gsheet()
-except: st.stop()
+@st.cache_resource
+def open_local_mirror(path):
+    store = LocalStore(path)
+    engine = SyncEngine(store, open_workbook, SNAPSHOT_SHEETS)
+    if not store.tables: engine.sync()
+    return store, engine.start()
+
+prof.mark("連線")
+sync_engine = None
+if os.environ.get("FINANCE_LOCAL_DB"):
+    sh, sync_engine = open_local_mirror(os.environ["FINANCE_LOCAL_DB"])
+else:
+    try: sh = connect_to_gsheet()
+    except: st.stop()
 
-# --- 讀取資料 ---
-def get_data(ws_name, head=1):
-    try:
-        ws = sh.worksheet(ws_name)
-        return pd.DataFrame(ws.get_all_records(head=head)), ws
-    except: return pd.DataFrame(), None
+api = sync_engine.sh if sync_engine else sh
+prof_key = st.session_state.setdefault("profile_key", os.urandom(4).hex())
+if isinstance(api, QuotaClient):
+    if prof.enabled: api.listeners[prof_key] = prof.api_call
+    else: api.listeners.pop(prof_key, None)
+
+# 寫入佇列：寫入先記到本地日誌、背景送出；上次沒送完的命令在這裡開始重送 (載入快照前會等送完)
+writes = start_write_queue(sh) if sync_engine is None else None
+
+# --- 讀取資料 (批次快照，rerun 不重抓；日記帳只載入本月) ---
+prof.mark("快照")
+try:
+    worksheets = get_worksheets(sh)
+    snapshot = load_snapshot(sh, getattr(sh, "version", 0), [(datetime.now().year, datetime.now().month)])
+except: worksheets, snapshot = {}, {"version": 0, "values": {}}
+
+# 自動封存：日記帳有超過保留期的月份就搬到年份分頁 (本地鏡像只同步固定分頁，不封存；失敗則本 session 不再嘗試)
+# 封存與補上列 ID 都直接搬動列，寫入佇列還有命令時延到送完之後
+if sync_engine is None and not writes_pending() and "archive_error" not in st.session_state and archive_due(snapshot, datetime.now().date()):
+    prof.mark("封存舊帳")
+    try: moved = archive_journal(sh, datetime.now().date())
+    except Exception as e: moved, st.session_state["archive_error"] = 0, str(e)
+    if moved:
+        st.session_state["flash"] = f"🧊 已封存 {moved} 筆舊帳到年份分頁"
+        st.rerun()
+
+# 列 ID：日記帳 / 購物冷靜清單還沒有 ID 欄 (或有列缺 ID) 就補上，之後的列操作以 ID 指定 (每個 session 只試一次)
+if "ids_result" not in st.session_state and not writes_pending() and missing_ids(snapshot):
+    prof.mark("補上列 ID")
+    try: st.session_state["ids_result"] = assign_row_ids(sh, snapshot)
+    except Exception as e: st.session_state["ids_result"] = str(e)
+    if isinstance(st.session_state["ids_result"], int): st.rerun()
+
+prof.mark(None)
+
+def save_profile(label):
+    # 存下本次 rerun 的紀錄 (頁面結尾，或寫入後 st.rerun 之前)
+    prof.finish()
+    if isinstance(api, QuotaClient): api.listeners.pop(prof_key, None)
+    rec = prof.record(page=label, snapshot_version=snapshot["version"], nodes=data.computed())
+    prof_log = st.session_state.setdefault("profile_log", [])
+    prof_log.append(rec); del prof_log[:-PROFILE_KEEP]
+    if os.environ.get("FINANCE_PROFILE_LOG"):
+        with open(os.environ["FINANCE_PROFILE_LOG"], "a", encoding="utf-8") as f: f.write(to_jsonl([rec]))
+    return rec
+
+def get_data(ws_name, head=1, months=None):
+    with prof.phase(f"get_data {ws_name}"):
+        try:
+            # 日記帳：已載入的月份，或其中的 months (含 Date / Year / Month)
+            df = journal_frame(snapshot, months) if ws_name == JOURNAL else records_frame(snapshot["values"][ws_name], head=head)
+            ws = worksheets[ws_name]
+        except: df, ws = pd.DataFrame(), None
+    prof.frame(ws_name, df)
+    return df, ws
 
 # --- UI 元件 ---
 def make_card(title, value, note, color="gray", progress=None):
@@ -168,253 +256,327 @@ current_month = now_dt.month
 current_day = now_dt.day
 current_year = now_dt.year
 
-df_log, ws_log = get_data("流動支出日記帳", head=4)
-df_assets, ws_assets = get_data("資產總覽表")
-df_status, ws_status = get_data("現況資金檢核")
-df_future, _ = get_data("未來四個月推估")
+ws_log = worksheets.get(JOURNAL)
+ws_assets = worksheets.get("資產總覽表")
+ws_status = worksheets.get("現況資金檢核")
 
-if not df_log.empty and '已入帳' not in df_log.columns: df_log['已入帳'] = '已入帳'
+# 各資料集與衍生值登記成節點，頁面 (PAGE_NEEDS) 與側邊欄只算自己用到的；同一次 rerun 內每個節點只算一次
+data = DataGraph(prof.phase)
 
-# 1. 取得資產與目標
-current_twd_balance = 0
-current_lpm_balance = 0 
-current_post_balance = 0
-current_jpy_balance = 0
-current_month_target = 0
+# 日記帳只取本月：歷史 / 匯入 / 推估頁補抓的其他月份不必跟著每次 rerun 轉換
+@data.node("journal")
+def journal_data():
+    df, _ = get_data(JOURNAL, months=[(current_year, current_month)])
+    if not df.empty and '已入帳' not in df.columns: df['已入帳'] = '已入帳'
+    return df
 
-twd_row_idx = -1
-lpm_row_idx = -1
-post_row_idx = -1
-jpy_row_idx = -1
+for node_name, sheet in [("future", "未來四個月推估"), ("shop", "購物冷靜清單"), ("model", "每月收支模型")]:
+    data.node(node_name)(lambda sheet=sheet: get_data(sheet)[0])
 
-try:
-    if not df_assets.empty:
-        df_assets['CleanName'] = df_assets['資產項目'].astype(str).str.strip()
-        
-        row = df_assets[df_assets['CleanName'] == '台幣活存']
-        if not row.empty:
-            current_twd_balance = int(str(row.iloc[0]['目前價值']).replace(',', ''))
-            twd_row_idx = row.index[0] + 2
-        
-        row_lpm = df_assets[df_assets['CleanName'].str.lower() == 'line pay money']
-        if not row_lpm.empty:
-            current_lpm_balance = int(str(row_lpm.iloc[0]['目前價值']).replace(',', ''))
-            lpm_row_idx = row_lpm.index[0] + 2
-        else:
-            current_lpm_balance = 0 
-            lpm_row_idx = -1
+# 1. 取得資產與目標 (資產登錄表：每份快照建一次)
+@data.node("assets", label="資產 / 缺口")
+def assets_data():
+    return asset_registry(snapshot)
 
-        row_post = df_assets[df_assets['CleanName'] == '郵局']
-        if not row_post.empty:
-            current_post_balance = int(str(row_post.iloc[0]['目前價值']).replace(',', ''))
-            post_row_idx = row_post.index[0] + 2
-        else:
-            current_post_balance = 0
-            post_row_idx = -1
-
-        row_j = df_assets[df_assets['CleanName'] == '日幣帳戶']
-        if not row_j.empty:
-            current_jpy_balance = int(str(row_j.iloc[0]['目前價值']).replace(',', ''))
-            jpy_row_idx = row_j.index[0] + 2
-
-    if not df_future.empty:
-        target_row = df_future[df_future['月份 (A)'].astype(str).str.contains(f"{current_month}月")]
-        if not target_row.empty:
-            current_month_target = int(str(target_row.iloc[0]['目標應有餘額 (E)']).replace(',', ''))
-except: pass
-
-# 2. 計算即時缺口
-current_total_liquid = current_twd_balance + current_lpm_balance
-
-if current_month_target != 0:
-    current_gap = current_total_liquid - current_month_target
-    if ws_status:
-        try: ws_status.update_cell(9, 2, current_gap)
-        except: pass
-else:
+@data.node("target", "future", label="資產 / 缺口")
+def month_target(df_future):
     try:
-        if ws_status: current_gap = int(str(ws_status.cell(9, 2).value).replace(',', ''))
-        else: current_gap = -9999
-    except: current_gap = -9999
-
-# 3. 計算本月數據
-total_variable_expenses = 0
-pending_debt = 0 
-real_self_expenses = 0
-pending_revenue = 0
-pending_reimburse = 0
-current_month_logs = pd.DataFrame()
-
-if not df_log.empty:
-    def robust_month_parser(x):
-        try: return pd.to_datetime(str(x), format='%m/%d').month
-        except:
-            try: return pd.to_datetime(str(x)).month
-            except: return current_month 
-
-    df_log['Month'] = df_log['日期'].apply(robust_month_parser)
-    current_month_logs = df_log[df_log['Month'] == current_month].copy()
-    
-    current_month_logs['實際消耗'] = pd.to_numeric(current_month_logs['實際消耗'], errors='coerce').fillna(0)
-    current_month_logs['金額'] = pd.to_numeric(current_month_logs['金額'], errors='coerce').fillna(0)
-    current_month_logs['項目'] = current_month_logs['項目'].astype(str)
-    current_month_logs['是否報帳'] = current_month_logs['是否報帳'].astype(str)
-    current_month_logs['已入帳'] = current_month_logs['已入帳'].astype(str).str.strip()
-
-    v_mask = (current_month_logs['實際消耗'] > 0) & (current_month_logs['是否報帳'] != '固定')
-    total_variable_expenses = int(current_month_logs[v_mask]['實際消耗'].sum())
-    
-    mask_rev = (current_month_logs['是否報帳'] == '收入') & (current_month_logs['已入帳'] == '未入帳')
-    pending_revenue = int(current_month_logs[mask_rev]['金額'].sum())
-    
-    mask_reim = (current_month_logs['是否報帳'] == '是') & (current_month_logs['已入帳'] == '未入帳')
-    pending_reimburse = int(current_month_logs[mask_reim]['金額'].sum())
-    
-    pending_debt = pending_revenue + pending_reimburse
-
-    reimburse_pending_cost = current_month_logs[mask_reim]['實際消耗'].sum()
-    real_self_expenses = total_variable_expenses - int(reimburse_pending_cost)
+        if not df_future.empty:
+            target_row = df_future[df_future['月份 (A)'].astype(str).str.contains(f"{current_month}月")]
+            if not target_row.empty: return int(str(target_row.iloc[0]['目標應有餘額 (E)']).replace(',', ''))
+    except: pass
+    return 0
 
-base_budget = 97 if current_month == 2 else 2207
-surplus_from_gap = max(0, current_gap)
-remaining = (base_budget + surplus_from_gap) - total_variable_expenses
-potential_available = remaining + pending_debt
+# 2. 計算即時缺口 (有目標時順便同步到資金檢核 B9)
+@data.node("gap", "assets", "target", label="資產 / 缺口")
+def month_gap(assets, target):
+    if target != 0:
+        gap = liquid_gap(assets, target)
+        if ws_status:
+            # API 錯誤 (已由 QuotaClient 重試過) / 連線中斷 / 寫入日誌寫不進去：與批次寫入一樣顯示出來，下次 rerun 再同步
+            try: written = write_cell_if_changed(ws_status, snapshot, 9, 2, gap, queue=writes)
+            except (gspread.exceptions.APIError, OSError) as e: st.error(f"❌ 缺口同步失敗 (資金檢核 B9)：{e}")
+            else:
+                # 有目標時 B9 由流動帳戶算出 (不是日記帳事件)：B9 真的寫出去才把檢查點的缺口跟著平移
+                # (延後的值還沒到試算表，先平移會被當成餘額不一致；其他 rerun 也不必推算餘額)
+                balances = data["balances"] if written else {}
+                if balances.get(GAP, gap) != gap:
+                    adjust_balance(sh, GAP, gap, balances[GAP])
+                    balances[GAP] = gap
+        return gap
+    try: return int(str(snapshot_cell(snapshot, "現況資金檢核", 9, 2)).replace(',', '')) if ws_status else -9999
+    except: return -9999
 
-# 同步函式
-def sync_update(amount_change, account_name='台幣活存'):
-    if not ws_assets or not ws_status: return
+# 3. 計算本月數據
+@data.node("month_logs", "journal", label="本月篩選 + KPI")
+def month_logs(df_log):
+    if df_log.empty: return pd.DataFrame()
+    logs = df_log[(df_log['Year'] == current_year) & (df_log['Month'] == current_month)].copy()
+    logs['實際消耗'] = pd.to_numeric(logs['實際消耗'], errors='coerce').fillna(0)
+    logs['金額'] = pd.to_numeric(logs['金額'], errors='coerce').fillna(0)
+    logs['項目'] = logs['項目'].astype(str)
+    logs['是否報帳'] = logs['是否報帳'].astype(str)
+    logs['已入帳'] = logs['已入帳'].astype(str).str.strip()
+    prof.frame("本月明細", logs)
+    return logs
+
+@data.node("kpi", "journal", label="本月篩選 + KPI")
+def month_kpi(df_log):
+    # KPI 直接查每月彙總 (增量維護，不隨日記帳長度變慢)
+    if df_log.empty: return {"variable": 0, "pending_revenue": 0, "pending_reimburse": 0, "real_self": 0}
+    return journal_rollup(df_log, snapshot["version"]).month_kpis(current_year, current_month)
+
+@data.node("budget", "gap", "kpi")
+def budget_data(gap, kpi):
+    return month_budget(current_month, gap, kpi)
+
+# 未來推估：固定收支各項 (每月收支模型 + 固定收支規則的起訖月份)、最近幾個完整月份的變動支出
+SPEND_HISTORY = 6
+
+@data.node("cash_lines", "model", "rules")
+def cash_lines(df_model, rules):
+    lines = model_lines(df_model['項目 (A)'], df_model['金額 (B)']) if '金額 (B)' in df_model.columns else []
+    return merge_rules(lines, rules[0])
+
+@data.node("spend_history", label="變動支出歷史")
+def spend_history():
+    months = [m for m in journal_months(snapshot) if m < (current_year, current_month)][-SPEND_HISTORY:]
+    try: return month_spend(sh, snapshot, months)
+    except Exception: return {}
+
+# 各頁用到的節點：進入頁面前先算好 (分開計時)，沒列到的資料這一頁完全不碰
+PAGE_NEEDS = {
+    "💸 隨手記帳 (本月)": ("assets", "target", "gap", "kpi", "budget", "month_logs"),
+    "📥 匯入對帳單": (),
+    "🛍️ 購物冷靜清單": ("shop",),
+    "📊 資產與收支": ("assets", "balances", "model"),
+    "📅 未來推估": ("future", "assets", "kpi", "rules", "logged_rules", "shop", "cash_lines", "spend_history"),
+    "🗓️ 歷史帳本回顧": (),
+}
+
+# 同步函式 (批次寫入：所有變更收集後一次送出)
+def new_batch():
+    return SheetBatch(sh, worksheets, snapshot, writes)
+
+def commit_batch(batch, journal_changes=()):
+    # journal_changes: [(年, 月, 列, ±1)]：日記帳的事件，餘額由事件推出後一起寫入；寫入成功後增量更新每月彙總
+    if journal_changes: apply_deltas(batch, journal_deltas(journal_changes, data["transfers"]))
     try:
-        all_assets = ws_assets.get_all_records()
-        target_row = -1
-        current_val = 0
-        
-        for i, r in enumerate(all_assets):
-            item_name = str(r.get('資產項目', '')).strip().lower()
-            target_key = account_name.strip().lower()
-            if item_name == target_key:
-                target_row = i + 2
-                current_val = int(str(r.get('目前價值', 0)).replace(',', ''))
-                break
-        
-        if target_row != -1:
-            ws_assets.update_cell(target_row, 2, current_val + amount_change)
-            if account_name == '台幣活存':
-                ws_status.update_cell(6, 2, current_val + amount_change)
-        
-        if account_name in ['台幣活存', 'Line Pay Money']:
-            current_gap_val = int(str(ws_status.cell(9, 2).value).replace(',', ''))
-            ws_status.update_cell(9, 2, current_gap_val + amount_change)
-        
-    except: pass
+        batch.commit()
+    except Exception as e:
+        st.error(f"❌ 寫入失敗，未變更任何資料：{e}")
+        return False
+    if journal_changes:
+        carry_rollup(journal_changes)
+        record_balances(sh, journal_changes, data["rules"][1], data["transfers"])
+    return True
+
+def done(msg):
+    # 寫入已套用到記憶體快照：不等待、不重抓，訊息留到 rerun 後再顯示
+    st.session_state["flash"] = msg
+    if prof.enabled: save_profile(f"寫入 {msg}")
+    st.rerun()
+
+def apply_deltas(batch, deltas):
+    # deltas 由 ledger.journal_deltas 算好：寫入「推算餘額 + 變動」(台幣活存同步到資金檢核 B6)，缺口寫到 B9
+    if not ws_status: return
+    base = data["balances"]
+    # 要寫的項目在試算表上被直接改過 (與推算值不符)：不覆蓋，整批放棄並請使用者先核對
+    names = {a for a, _ in deltas["assets"]} | ({GAP} if deltas["gap"] else set())
+    drift = {k: v for k, v in balance_drift(sheet_balances(snapshot), base).items() if k in names}
+    if drift:
+        batch.errors.append("、".join(f"{k} (試算表 {s} / 日記帳推算 {d})" for k, (s, d) in drift.items()) +
+                            " 與日記帳推算不一致，請先到「📊 資產與收支」的餘額核對選擇以試算表為準或以日記帳重算")
+        return
+    for account, change in deltas["assets"] if ws_assets else ():
+        if account in base and batch.set_asset(account, base[account] + change) and account == TWD:
+            batch.set("現況資金檢核", 6, 2, base[account] + change)
+    if deltas["gap"] and GAP in base: batch.set("現況資金檢核", 9, 2, base[GAP] + deltas["gap"])
 
 # --- 刪除交易函式 (含餘額回補) ---
 def delete_transaction(row_idx, row_data):
     if not ws_log: return
+    txn = Transaction.from_row(row_data)
+    changes = [(row_data['Year'], row_data['Month'], txn, -1)]
+    back = "、".join(f"{a} {c:+,}" for a, c in journal_deltas(changes, data["transfers"])["assets"]) or "餘額不變"
+
+    # 回補與刪除 (同一批次，回補金額由這一列的影響推出)；有 ID 時以 ID 找列，送出前核對
+    batch = new_batch()
+    batch.delete_row("流動支出日記帳", batch.locate(JOURNAL, row_data.get(ID_COLUMN), row_idx))
+    if not commit_batch(batch, changes): return
+    done(f"🗑️ 已刪除並回補：{back}")
+
+ACCOUNT_CHOICES = {
+    "🇹🇼 台幣活存 (Richart)": "台幣活存", 
+    "🟩 Line Pay Money": "Line Pay Money",
+    "📮 郵局 (金庫)": "郵局"
+}
+
+# --- 交易列表 (分頁 + 單一編輯區) ---
+PAGE_SIZE = 30
+
+def txn_style(row):
+    cls = category_of(row['是否報帳'])
+    sta = str(row.get('已入帳', '已入帳')).strip() or "已入帳"
     
-    # 1. 辨識帳戶
-    item_name = str(row_data['項目'])
-    if "(LPM)" in item_name: t_acct = "Line Pay Money"
-    elif "(郵局)" in item_name: t_acct = "郵局"
-    else: t_acct = "台幣活存"
-    
-    # 2. 判斷交易類型與回補金額
-    amt = int(row_data['金額'])
-    is_rev = False # 是否需要回補
-    reverse_amt = 0
-    
-    type_code = str(row_data['是否報帳'])
-    status = str(row_data['已入帳']).strip()
-    
-    if type_code in ['收入', '固定收入']:
-        # 如果是收入且已入帳，刪除時要扣回來
-        if status == '已入帳':
-            reverse_amt = -amt
-            is_rev = True
-    else:
-        # 如果是支出 (包含代墊)，刪除時要加回來
-        # 注意：代墊在記帳當下就已經扣款(現金流出)，所以刪除要加回
-        reverse_amt = amt
-        is_rev = True
-        
-    # 3. 執行回補與刪除
-    if is_rev and reverse_amt != 0:
-        sync_update(reverse_amt, t_acct)
-    
-    ws_log.delete_rows(row_idx)
-    st.toast(f"🗑️ 已刪除並回補 {t_acct} ${reverse_amt}")
-    time.sleep(1)
-    st.rerun()
+    b_clr, t_clr, pfx = "gray", "var(--text-color)", "$"
+    if cls == "收入": b_clr, t_clr, pfx = "green" if sta=="已入帳" else "gray", "#34d399" if sta=="已入帳" else "var(--text-color)", "+$"
+    elif cls == "報帳/代墊": b_clr, t_clr = "purple" if sta=="未入帳" else "gray", "#a78bfa" if sta=="未入帳" else "var(--text-color)"
+    elif cls == "固定收支": b_clr, t_clr = "blue", "#60a5fa"
+    else: t_clr, pfx = "#f87171", "-$"
+    return cls, sta, b_clr, t_clr, pfx
+
+def month_row_html(row):
+    cls, sta, b_clr, t_clr, pfx = txn_style(row)
+    return f"""<div class="list-row"><div class="list-left"><span style="font-size:0.85em; opacity:0.6;">{row['日期']}</span><span style="font-weight:700; font-size:1.05em;">{row['項目']}</span><div>{make_badge(sta, b_clr)} <span style="font-size:0.8em; opacity:0.5;">{cls}</span></div></div><div class="list-right"><span class="list-amt" style="color:{t_clr};">{pfx}{row['金額']}</span></div></div>"""
+
+def hist_row_html(row):
+    c = "#34d399" if row['實際消耗'] < 0 else "#f87171"
+    return f"""<div class="list-row"><div><span style="font-size:0.8em;opacity:0.6;">{row['日期']}</span> <b>{row['項目']}</b></div><div style="color:{c};font-weight:bold;">${row['金額']}</div></div>"""
+
+def toggle_settled(row, real_idx, on):
+    txn = Transaction.from_row(row)
+    new_txn = txn.settled(on)
+    batch = new_batch()
+    real_idx = batch.locate(JOURNAL, row.get(ID_COLUMN), real_idx)
+    batch.set("流動支出日記帳", real_idx, 5, new_txn.spent)
+    batch.set("流動支出日記帳", real_idx, 6, new_txn.status)
+    if commit_batch(batch, [(row['Year'], row['Month'], txn, -1), (row['Year'], row['Month'], new_txn, 1)]):
+        done("已更新")
+
+def render_txn_list(df, key, row_html, settle=False, editable=True):
+    # 只渲染游標以內的列 (一個 HTML 區塊)，列操作集中在單一選取 + 編輯區，不再每列一組元件；封存的列唯讀
+    limit = st.session_state.setdefault(f"{key}_limit", PAGE_SIZE)
+    shown = df.iloc[:limit]
+    st.markdown("".join(row_html(r) for _, r in shown.iterrows()), unsafe_allow_html=True)
+    if len(df) > limit:
+        if st.button(f"⬇️ 載入更多 (已顯示 {limit} / {len(df)} 筆)", key=f"{key}_more", use_container_width=True):
+            st.session_state[f"{key}_limit"] = limit + PAGE_SIZE; st.rerun()
+    if shown.empty or not editable: return
+
+    st.markdown("**✏️ 編輯交易**")
+    c_sel, c_act, c_del = st.columns([6, 1, 0.5])
+    idx = c_sel.selectbox("選擇交易", shown.index, key=f"{key}_sel", label_visibility="collapsed",
+                          format_func=lambda i: f"{shown.at[i, '日期']}  {shown.at[i, '項目']}  ${shown.at[i, '金額']}")
+    row = shown.loc[idx]
+    real_idx = idx + 5 # df_log 的 index = 試算表列號 - 5 (只載入部分月份時也一樣)；有 ID 欄時寫入改以 ID 找列
+    cls, sta = txn_style(row)[:2]
+    # toggle 的 key 帶上列內容：刪除 / 切換後列號位移，不會沿用別列殘留的狀態
+    with c_act:
+        if settle and cls in ["報帳/代墊", "收入"]:
+            is_clr = (sta == "已入帳")
+            lbl = "已結清" if "報帳" in cls else "已入帳"
+            if st.toggle(lbl, value=is_clr, key=f"{key}_tg_{idx}_{row['項目']}_{sta}") != is_clr:
+                toggle_settled(row, real_idx, not is_clr)
+    with c_del:
+        with st.popover("🗑️"):
+            st.markdown("確認刪除此筆資料？")
+            if st.button("確認", key=f"{key}_del_{idx}", type="primary"):
+                delete_transaction(real_idx, row)
 
 # ==========================================
 # 側邊欄
 # ==========================================
+prof.mark("側邊欄")
 st.sidebar.title("🚀 功能選單")
+# 個別分頁讀取失敗時其他分頁照常顯示，這裡提示是哪幾個
+unread = [t for t in SNAPSHOT_SHEETS if t in worksheets and t not in snapshot["values"]]
+if unread: st.sidebar.warning(f"⚠️ 暫時無法讀取：{'、'.join(unread)}")
 
-def check_logged(keyword):
-    if current_month_logs.empty: return False
-    return current_month_logs['項目'].astype(str).str.contains(keyword, case=False).any()
+# 固定收支規則 (側邊欄待辦)：FINANCE_RULES 可指定其他規則檔
+RULES_PATH = os.environ.get("FINANCE_RULES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "recurring_rules.json"))
 
-def execute_auto_entry(name, amount, type_code="固定", is_transfer=False):
+def execute_auto_entry(rule):
     if not ws_log: return
-    date_str = now_dt.strftime("%m/%d")
-    
-    if name == "自我分期(還債)":
-        ws_log.append_row([date_str, name, amount, "固定", 0, "固定扣款"])
-        if ws_status:
-            try: 
-                cg = int(str(ws_status.cell(9, 2).value).replace(',', ''))
-                ws_status.update_cell(9, 2, cg + amount)
-            except: pass
-        st.toast(f"✅ {name} 已執行！"); time.sleep(1); st.rerun(); return
-
-    if is_transfer:
-        try:
-            all = ws_assets.get_all_records()
-            twd_r, fix_r, twd_v, fix_v = -1, -1, 0, 0
-            for i, r in enumerate(all):
-                if r.get('資產項目') == '台幣活存': twd_r=i+2; twd_v=int(str(r.get('目前價值',0)).replace(',',''))
-                if r.get('資產項目') == '定存累計': fix_r=i+2; fix_v=int(str(r.get('目前價值',0)).replace(',',''))
-            if twd_r!=-1:
-                ws_assets.update_cell(twd_r, 2, twd_v - amount)
-                ws_assets.update_cell(fix_r, 2, fix_v + amount)
-                if ws_status: ws_status.update_cell(6, 2, twd_v - amount)
-                ws_log.append_row([date_str, name, amount, "固定", 0, "固定扣款"])
-                st.toast("✅ 定存轉帳完成"); time.sleep(1); st.rerun()
-        except: pass
-        return
-
-    final_type = "固定收入" if type_code == "固定收入" else "固定"
-    is_inc = (type_code == "固定收入")
-    change = amount if is_inc else -amount
-    ws_log.append_row([date_str, name, amount, final_type, 0, "固定扣款" if not is_inc else "已入帳"])
-    sync_update(change, '台幣活存')
-    st.toast("✅ 已記錄"); time.sleep(1); st.rerun()
-
-pending_tasks = []
-if current_day >= 5 and not check_logged("固定收入"): pending_tasks.append({"name": "📥 入帳薪水 ($3900)", "type": "fixed_in", "amt": 3900, "desc": "固定收入 (薪水)"})
-if current_day >= 10 and not check_logged("定存扣款"): pending_tasks.append({"name": "🏦 轉存定存 ($1000)", "type": "transfer", "amt": 1000, "desc": "定存扣款"})
-if current_day >= 10 and not check_logged("電信費"): pending_tasks.append({"name": "📱 繳電信費 ($499)", "type": "fixed_out", "amt": 499, "desc": "電信費"})
-if current_day >= 22 and not check_logged("YT Premium"): pending_tasks.append({"name": "▶️ 繳 YT Premium ($119)", "type": "fixed_out", "amt": 119, "desc": "YT Premium"})
-if (current_year < 2026 or (current_year == 2026 and current_month < 7)) and current_day >= 6 and not check_logged("小雪"): pending_tasks.append({"name": "❄️ 繳小雪會員 ($75)", "type": "fixed_out", "amt": 75, "desc": "YT會員(小雪)"})
-if (current_year < 2026 or (current_year == 2026 and current_month <= 7)) and current_day >= 5 and not check_logged("自我分期"): pending_tasks.append({"name": "💳 自我分期還債 ($2110)", "type": "fixed_out", "amt": 2110, "desc": "自我分期(還債)"})
+    txn = rule.entry(now_dt.strftime("%m/%d"))
+    is_transfer = rule.kind == "transfer"
+    # 定存轉帳需要兩個帳戶都存在
+    if is_transfer and not all(account in data["assets"] for account, _ in balance_effect(txn, data["transfers"])["assets"]): return
+    batch = new_batch()
+    batch.append(JOURNAL, txn.values(), (current_year, current_month))
+    msg = f"✅ {rule.item} 已執行！" if rule.item == SELF_INSTALLMENT else "✅ 定存轉帳完成" if is_transfer else "✅ 已記錄"
+    if commit_batch(batch, [(current_year, current_month, txn, 1)]): done(msg)
+
+@data.node("rules")
+def rules_data():
+    if not os.path.exists(RULES_PATH): return [], None
+    rules_key = (RULES_PATH, os.path.getmtime(RULES_PATH))
+    try: return recurring_rules(*rules_key), rules_key
+    except (ValueError, TypeError, KeyError) as e: st.sidebar.error(f"❌ 規則檔有誤：{e}")
+    return [], rules_key
+
+@data.node("due_rules", "rules")
+def due_today(rules):
+    return [r for r in rules[0] if r.due(now_dt.date())]
+
+# 各月已記錄的規則 id 每份快照算一次；判斷待辦只是集合查詢
+@data.node("logged_rules", "rules")
+def logged_rules(rules):
+    return rule_index(snapshot, snapshot["version"], rules[1], rules[0], [(current_year, current_month)]) if rules[0] else {}
+
+# 定存轉帳規則：日記帳的轉帳列只能由項目比對出來
+@data.node("transfers", "rules")
+def transfer_rules(rules):
+    return [r for r in rules[0] if r.kind == "transfer"]
+
+# 帳戶餘額的推算值 (檢查點 + 日記帳事件)：寫入時以此為基準，資產頁拿來與試算表核對
+@data.node("balances", "rules", "transfers", label="資產 / 缺口")
+def balances_data(rules, transfers):
+    return derived_balances(sh, snapshot, rules[1], transfers)
+
+# 今天沒有到期的規則就不必解析日記帳
+pending_tasks = due_rules(data["due_rules"], now_dt.date(), data["logged_rules"]) if data["due_rules"] else []
 
 if pending_tasks:
     st.sidebar.info(f"🔔 待辦事項 ({len(pending_tasks)})")
-    for t in pending_tasks:
-        if st.sidebar.button(t["name"], key=t["desc"]):
-            typ = "固定收入" if t["type"]=="fixed_in" else "固定支出"
-            is_tr = (t["type"]=="transfer")
-            execute_auto_entry(t["desc"], t["amt"], typ, is_tr)
+    for rule in pending_tasks:
+        if st.sidebar.button(rule.label(), key=f"rule_{rule.id}"):
+            execute_auto_entry(rule)
     st.sidebar.markdown("---")
 
-page = st.sidebar.radio("請選擇功能", ["💸 隨手記帳 (本月)", "🛍️ 購物冷靜清單", "📊 資產與收支", "📅 未來推估", "🗓️ 歷史帳本回顧"])
+page = st.sidebar.radio("請選擇功能", list(PAGE_NEEDS))
 st.sidebar.markdown("---")
+if st.sidebar.button("🔄 重新整理資料"):
+    invalidate_snapshot(); st.rerun()
+st.sidebar.toggle("⏱️ 效能分析模式", key="profile_on")
 st.sidebar.caption("宇毛的記帳本 v31.0 (Delete & Rollback)")
+gap_writes = cell_write_state()
+st.sidebar.caption(f"缺口同步：寫入 {gap_writes['written']} 次 / 略過 {gap_writes['skipped']} 次")
+if isinstance(api, QuotaClient):
+    api_t = api.totals()
+    st.sidebar.caption(f"API：呼叫 {api_t['calls']} 次 / 重試 {api_t['retries']} 次 / 合併 {api_t['coalesced']} 次 / 限流等待 {api_t['throttled']:.1f} 秒")
+if sync_engine:
+    sync_st = sync_engine.status()
+    sync_ago = f"{int(time.time() - sync_st['last_sync'])} 秒前" if sync_st['last_sync'] else "尚未同步"
+    st.sidebar.caption(f"本地鏡像：待推送 {sync_st['pending']} 筆 / 衝突 {sync_st['conflicts']} 筆 / 上次同步 {sync_ago}")
+    if sync_st['last_error']: st.sidebar.warning(f"⚠️ 離線中：{sync_st['last_error']}")
+if writes:
+    queue_st = writes.status()
+    st.sidebar.caption(f"寫入佇列：待送出 {queue_st['depth']} 筆 / 延遲 {queue_st['lag']:.1f} 秒 / 已送出 {queue_st['sent']} 筆")
+    if queue_st['last_error']: st.sidebar.warning(f"⚠️ 寫入暫停，稍後重試：{queue_st['last_error']}")
+    if queue_st['failed']:
+        with st.sidebar.expander(f"⚠️ 未寫入的操作 {len(queue_st['failed'])} 筆"):
+            for item in queue_st['failed'][::-1]:
+                st.caption(f"{datetime.fromtimestamp(item['at']).strftime('%m/%d %H:%M')} {item['label']}：{item['reason']}")
+            if st.button("清除紀錄", key="clear_failed_writes"):
+                writes.clear_failed()
+                st.rerun()
+
+prof.mark("資料準備")
+# 缺口 B9 上次因 debounce 延後：這頁用不到缺口也重算一次，過了視窗就補寫
+if ws_status and "gap" not in PAGE_NEEDS[page] and pending_cell(ws_status.title, 9, 2) is not None: data["gap"]
+data.need(*PAGE_NEEDS[page])
+prof.mark(f"頁面 {page}")
 
 # ==========================================
 # 🏠 頁面 1：隨手記帳
 # ==========================================
 if page == "💸 隨手記帳 (本月)":
+    assets, current_month_target, current_gap, current_month_logs = data.need("assets", "target", "gap", "month_logs")
+    kpi, budget = data.need("kpi", "budget")
+    current_total_liquid = assets.value('台幣活存') + assets.value('Line Pay Money')
+    pending_revenue, pending_reimburse, real_self_expenses = kpi["pending_revenue"], kpi["pending_reimburse"], kpi["real_self"]
+    base_budget, pending_debt, remaining, potential_available = budget["base_budget"], budget["pending_debt"], budget["remaining"], budget["potential_available"]
     st.subheader(f"{current_month} 月財務面板")
     
     c1, c2, c3, c4, c5 = st.columns(5)
@@ -452,33 +614,18 @@ if page == "💸 隨手記帳 (本月)":
         else:
             c3_2.caption("ℹ️ 收入預設 **未入帳**")
             
-        acct_map = {
-            "🇹🇼 台幣活存 (Richart)": "台幣活存", 
-            "🟩 Line Pay Money": "Line Pay Money",
-            "📮 郵局 (金庫)": "郵局"
-        }
-        acct_select = c3_3.selectbox("支付/入帳帳戶", list(acct_map.keys()))
-        target_acct = acct_map[acct_select]
+        acct_select = c3_3.selectbox("支付/入帳帳戶", list(ACCOUNT_CHOICES.keys()))
+        target_acct = ACCOUNT_CHOICES[acct_select]
             
         if st.form_submit_button("確認記帳", use_container_width=True, type="primary") and ws_log:
             if n_in and a_in > 0:
-                d_str = d_in.strftime("%m/%d")
-                final_name = n_in 
-                if target_acct == "Line Pay Money":
-                    final_name += " (LPM)"
-                elif target_acct == "郵局":
-                    final_name += " (郵局)"
-                
-                if "支出" in txn_type:
-                    act = a_in
-                    sta = "未入帳" if is_reim == "是" else "已入帳"
-                    ws_log.append_row([d_str, final_name, a_in, is_reim, act, sta])
-                    sync_update(-a_in, target_acct)
-                    st.toast(f"💸 支出已記：${a_in} ({target_acct})")
-                else:
-                    ws_log.append_row([d_str, final_name, a_in, "收入", 0, "未入帳"])
-                    st.toast(f"💰 收入已記 (未入帳)：${a_in}")
-                time.sleep(1); st.rerun()
+                is_expense = "支出" in txn_type
+                txn = manual_entry(d_in.strftime("%m/%d"), n_in, a_in, is_expense, is_reim, target_acct)
+                batch = new_batch()
+                batch.append(JOURNAL, txn.values(), (d_in.year, d_in.month))
+                msg = f"💸 支出已記：${a_in} ({target_acct})" if is_expense else f"💰 收入已記 (未入帳)：${a_in}"
+                if commit_batch(batch, [(d_in.year, d_in.month, txn, 1)]):
+                    done(msg)
 
     if not current_month_logs.empty:
         st.markdown("### 📜 本月明細")
@@ -493,88 +640,67 @@ if page == "💸 隨手記帳 (本月)":
         
         if filter_opts:
             mask = pd.Series([False] * len(display_df), index=display_df.index)
-            if "一般消費" in filter_opts:
-                mask |= (display_df['是否報帳'] == '否')
-            if "報帳(未入)" in filter_opts:
-                mask |= ((display_df['是否報帳'] == '是') & (display_df['已入帳'] == '未入帳'))
-            if "報帳(已入)" in filter_opts:
-                mask |= ((display_df['是否報帳'] == '是') & (display_df['已入帳'] == '已入帳'))
-            if "收入(未入)" in filter_opts:
-                mask |= ((display_df['是否報帳'] == '收入') & (display_df['已入帳'] == '未入帳'))
-            if "收入(已入)" in filter_opts:
-                mask |= ((display_df['是否報帳'] == '收入') & (display_df['已入帳'] == '已入帳'))
-            if "固定收支" in filter_opts:
-                mask |= (display_df['是否報帳'].isin(['固定', '固定收入']))
+            for f in filter_opts:
+                mask |= FILTER_RULES[f](display_df['是否報帳'], display_df['已入帳'])
             
             display_df = display_df[mask]
 
-        for i, (idx, row) in enumerate(display_df.iterrows()):
-            real_idx = idx + 5 
-            cls = "一般"
-            if row['是否報帳'] == "是": cls = "報帳/代墊"
-            elif row['是否報帳'] == "收入": cls = "收入"
-            elif row['是否報帳'] in ["固定", "固定收入"]: cls = "固定收支"
-            
-            sta = str(row.get('已入帳', '已入帳')).strip() or "已入帳"
-            
-            b_clr, t_clr, pfx = "gray", "var(--text-color)", "$"
-            if cls == "收入": b_clr, t_clr, pfx = "green" if sta=="已入帳" else "gray", "#34d399" if sta=="已入帳" else "var(--text-color)", "+$"
-            elif cls == "報帳/代墊": b_clr, t_clr = "purple" if sta=="未入帳" else "gray", "#a78bfa" if sta=="未入帳" else "var(--text-color)"
-            elif cls == "固定收支": b_clr, t_clr = "blue", "#60a5fa"
-            else: t_clr, pfx = "#f87171", "-$"
-
-            with st.container():
-                c_row, c_act, c_del = st.columns([6, 1, 0.5])
-                with c_row:
-                    st.markdown(f"""
-                    <div class="list-row">
-                        <div class="list-left">
-                            <span style="font-size:0.85em; opacity:0.6;">{row['日期']}</span>
-                            <span style="font-weight:700; font-size:1.05em;">{row['項目']}</span>
-                            <div>{make_badge(sta, b_clr)} <span style="font-size:0.8em; opacity:0.5;">{cls}</span></div>
-                        </div>
-                        <div class="list-right">
-                            <span class="list-amt" style="color:{t_clr};">{pfx}{row['金額']}</span>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with c_act:
-                    st.write("") 
-                    if cls in ["報帳/代墊", "收入"]:
-                        is_clr = (sta == "已入帳")
-                        lbl = "已結清" if "報帳" in cls else "已入帳"
-                        if st.toggle(lbl, value=is_clr, key=f"tg_{idx}") != is_clr:
-                            new_state = not is_clr
-                            new_s = "已入帳" if new_state else "未入帳"
-                            new_act, chg = 0, 0
-                            
-                            item_name = str(row['項目'])
-                            if "(LPM)" in item_name: t_acct = "Line Pay Money"
-                            elif "(郵局)" in item_name: t_acct = "郵局"
-                            else: t_acct = "台幣活存"
-
-                            if "報帳" in cls:
-                                new_act = 0 if new_state else row['金額']
-                                chg = row['金額'] if new_state else -row['金額']
-                            elif cls == "收入":
-                                new_act = -row['金額'] if new_state else 0
-                                chg = row['金額'] if new_state else -row['金額']
-                            
-                            if chg != 0: sync_update(chg, t_acct)
-                            ws_log.update_cell(real_idx, 5, new_act)
-                            ws_log.update_cell(real_idx, 6, new_s)
-                            st.success(f"已更新"); time.sleep(0.5); st.rerun()
-                
-                # 刪除按鈕
-                with c_del:
-                    st.write("")
-                    with st.popover("🗑️"):
-                        st.markdown("確認刪除此筆資料？")
-                        if st.button("確認", key=f"del_txn_{idx}", type="primary"):
-                            delete_transaction(real_idx, row)
+        render_txn_list(display_df, "month", month_row_html, settle=True)
         st.markdown("---")
 
+# ==========================================
+# 📥 匯入對帳單 (CSV / 網銀匯出)
+# ==========================================
+elif page == "📥 匯入對帳單":
+    st.subheader("📥 匯入對帳單")
+    st.caption("欄位對應到 日期 / 項目 / 金額 (或 支出、存入兩欄)；與日記帳重複 (同日、同項目、同金額) 的列會略過，各帳戶餘額只寫入一次淨額")
+    up = st.file_uploader("選擇 CSV 檔", type=["csv", "txt"])
+    if up is not None and ws_log:
+        try: header, rows = read_statement(up.getvalue())
+        except ValueError as e:
+            st.error(f"❌ {e}"); header = []
+        if header:
+            guess = guess_columns(header)
+            opts = ["(不使用)"] + header
+            columns = {}
+            col_boxes = st.columns(4)
+            for i, field in enumerate(IMPORT_ALIASES):
+                pick = col_boxes[i % 4].selectbox(field, opts, index=opts.index(guess[field]) if field in guess else 0, key=f"imp_col_{field}")
+                if pick != "(不使用)": columns[field] = pick
+            acct_select = st.selectbox("預設帳戶 (項目沒有 (LPM) / (郵局) 後綴時)", list(ACCOUNT_CHOICES.keys()), key="imp_acct")
+
+            if not (columns.get("日期") and columns.get("項目") and (columns.get("金額") or columns.get("支出") or columns.get("存入"))):
+                st.warning("⚠️ 請至少對應 日期、項目，以及 金額 (或 支出 / 存入)")
+            else:
+                with prof.phase("匯入 解析 + 比對重複"):
+                    # 先解析一次得知涵蓋的月份，只載入這些月份的日記帳 (含已封存的) 來比對重複
+                    rows = list(rows)
+                    months = {(y, m) for y, m, _ in plan_import(rows, columns, (), ACCOUNT_CHOICES[acct_select], now_dt.date())["entries"]}
+                    # 比對用的月份讀不到 (API 錯誤已由 QuotaClient 重試過 / 連線中斷)：無法比對重複就不匯入
+                    try: frames = [journal_frame(load_journal_months(sh, months), months), archived_frame(sh, snapshot, months)]
+                    except (gspread.exceptions.APIError, OSError) as e:
+                        plan = None; st.error(f"❌ 無法載入比對重複用的日記帳，請稍後再試：{e}")
+                    else: plan = plan_import(rows, columns, sum((journal_keys(f) for f in frames if not f.empty), Counter()), ACCOUNT_CHOICES[acct_select], now_dt.date())
+                if plan is not None:
+                    entries = plan["entries"]
+                    m1, m2, m3 = st.columns(3)
+                    m1.metric("新增", len(entries))
+                    m2.metric("重複略過", plan["duplicates"])
+                    m3.metric("無法解析", len(plan["errors"]))
+                    if plan["errors"]:
+                        with st.expander(f"⚠️ {len(plan['errors'])} 列無法解析"):
+                            st.dataframe(pd.DataFrame(plan["errors"], columns=["列", "原因"]), hide_index=True)
+                    if entries:
+                        st.dataframe(pd.DataFrame([t.values() for _, _, t in entries[:PAGE_SIZE * 10]], columns=LOG_COLUMNS), hide_index=True)
+                        deltas = journal_deltas([(y, m, t, 1) for y, m, t in entries], data["transfers"])
+                        net = "、".join(f"{a} {c:+,}" for a, c in deltas["assets"]) or "無"
+                        st.caption(f"餘額變動 (合併為一次寫入)：{net}；總透支缺口 {deltas['gap']:+,}")
+                        if st.button(f"📥 匯入 {len(entries)} 筆", type="primary", use_container_width=True):
+                            batch = new_batch()
+                            batch.append_rows(JOURNAL, [t.values() for _, _, t in entries], [(y, m) for y, m, _ in entries])
+                            if commit_batch(batch, [(y, m, t, 1) for y, m, t in entries]):
+                                done(f"📥 已匯入 {len(entries)} 筆 (略過重複 {plan['duplicates']} 筆)")
+
 # ==========================================
 # 🛍️ 頁面 2：購物冷靜清單
 # ==========================================
@@ -588,11 +714,12 @@ elif page == "🛍️ 購物冷靜清單":
             ["新增順序", "想要程度 (高→低)", "價格 (高→低)", "價格 (低→高)"]
         )
 
-    df_shop, ws_shop = get_data("購物冷靜清單")
+    df_shop, ws_shop = data["shop"], worksheets.get(SHOP_SHEET)
     
     if not df_shop.empty:
-        df_shop['SortPrice'] = df_shop['預估價格'].astype(str).str.replace(',', '').apply(lambda x: int(x) if x.isdigit() else 0)
-        df_shop['SortDesire'] = df_shop['想要程度'].apply(lambda x: int(str(x)) if str(x).isdigit() else 0)
+        # 整欄一次轉換 (去千分位、非數字為 0)；列 = 試算表列號，排序後仍對得回原列
+        df_shop['SortPrice'], df_shop['SortDesire'] = number_column(df_shop['預估價格']), number_column(df_shop['想要程度'])
+        df_shop['列'] = df_shop.index + 2
 
         if sort_order == "想要程度 (高→低)":
             df_shop = df_shop.sort_values('SortDesire', ascending=False)
@@ -601,7 +728,7 @@ elif page == "🛍️ 購物冷靜清單":
         elif sort_order == "價格 (低→高)":
             df_shop = df_shop.sort_values('SortPrice', ascending=True)
 
-    tot = sum([int(str(r.get('預估價格',0)).replace(',','')) for i,r in df_shop.iterrows()]) if not df_shop.empty else 0
+    tot = int(df_shop['SortPrice'].sum()) if not df_shop.empty else 0
     
     c1, c2 = st.columns(2)
     with c1: st.markdown(make_card("清單總項數", f"{len(df_shop)} 項", "慾望清單", "blue"), unsafe_allow_html=True)
@@ -616,10 +743,39 @@ elif page == "🛍️ 購物冷靜清單":
             desire = c3.slider("想要指數", 1, 5, 3) 
             note = st.text_input("備註 (選填)")
             if st.form_submit_button("加入") and ws_shop:
-                ws_shop.append_row([datetime.now().strftime("%m/%d"), n, p, desire, "2026/07/01", "延後", note])
-                st.success("已加入"); time.sleep(1); st.rerun()
+                batch = new_batch()
+                batch.append(SHOP_SHEET, [datetime.now().strftime("%m/%d"), n, p, desire, SHOP_NEW["冷靜期限"], SHOP_NEW["最終決策"], note])
+                if commit_batch(batch): done("已加入")
     
-    if not df_shop.empty:
+    # 表格編輯：多列一起改 / 新增 / 刪除，與快照比對出有變動的儲存格，一次 batch_update 寫入；ID 欄不顯示、不可改
+    shop_cols = (snapshot["values"].get(SHOP_SHEET) or [[]])[0]
+    shop_header = [c for c in shop_cols if c and c != ID_COLUMN]
+    if ws_shop and shop_header and st.toggle("🧮 表格編輯 (多筆一起改，一次寫入)", key="shop_grid"):
+        view = df_shop.assign(預估價格=df_shop['SortPrice'], 想要程度=df_shop['SortDesire'])[['列'] + shop_header] if not df_shop.empty else pd.DataFrame(columns=['列'] + shop_header)
+        # 儲存後換一個 key，編輯器不會把已寫入的變更再套一次
+        rev = st.session_state.setdefault("shop_grid_rev", 0)
+        edited = st.data_editor(view, key=f"shop_grid_{rev}", num_rows="dynamic", hide_index=True, column_config={
+            "列": None,
+            "預估價格": st.column_config.NumberColumn(min_value=0, step=1),
+            "想要程度": st.column_config.NumberColumn(min_value=1, max_value=5, step=1)})
+        changes = grid_changes(view, edited, '列', shop_header, SHOP_NUMBERS)
+        # 新增的空白列 (沒填物品名稱) 不寫入；沒填的欄位用新增願望的預設值
+        today_str = datetime.now().strftime("%m/%d")
+        appends = [[r[c] if r[c] not in ("", 0) else SHOP_NEW.get(c, today_str if c == "日期" else r[c]) for c in shop_header]
+                   for r in changes["appends"] if str(r.get("物品名稱", "")).strip()]
+        n_changes = len(changes["cells"]) + len(appends) + len(changes["deletes"])
+        if n_changes:
+            st.caption(f"修改 {len(changes['cells'])} 格 / 新增 {len(appends)} 項 / 刪除 {len(changes['deletes'])} 項")
+            if st.button(f"💾 儲存 {n_changes} 項變更", type="primary", use_container_width=True):
+                batch = new_batch()
+                row_id = dict(zip(df_shop['列'], df_shop[ID_COLUMN])) if ID_COLUMN in df_shop.columns else {}
+                for row, col, value in changes["cells"]: batch.set(SHOP_SHEET, batch.locate(SHOP_SHEET, row_id.get(row), row), shop_cols.index(col) + 1, value)
+                batch.append_rows(SHOP_SHEET, appends)
+                for row in changes["deletes"]: batch.delete_row(SHOP_SHEET, batch.locate(SHOP_SHEET, row_id.get(row), row))
+                if commit_batch(batch):
+                    st.session_state["shop_grid_rev"] = rev + 1
+                    done(f"已儲存 {n_changes} 項變更")
+    elif not df_shop.empty:
         st.markdown("### 📦 明細 (可編輯)")
         for idx, row in df_shop.iterrows():
             desire_val = row.get('想要程度', 3)
@@ -629,24 +785,25 @@ elif page == "🛍️ 購物冷靜清單":
                 with st.form(key=f"edit_shop_{idx}"):
                     c_edit_1, c_edit_2, c_edit_3 = st.columns([2, 1, 1])
                     new_name = c_edit_1.text_input("名稱", value=row.get('物品名稱', ''))
-                    new_price = c_edit_2.number_input("價格", value=int(str(row.get('預估價格', 0)).replace(',','')), min_value=0)
+                    new_price = c_edit_2.number_input("價格", value=int(row['SortPrice']), min_value=0)
                     new_desire = c_edit_3.slider("想要指數", 1, 5, int(str(desire_val)) if str(desire_val).isdigit() else 3)
                     
                     new_note = st.text_input("備註", value=row.get('備註', ''))
                     
                     c_btn_1, c_btn_2 = st.columns(2)
                     if c_btn_1.form_submit_button("💾 保存修改"):
-                        real_row = idx + 2
-                        ws_shop.update_cell(real_row, 2, new_name)
-                        ws_shop.update_cell(real_row, 3, new_price)
-                        ws_shop.update_cell(real_row, 4, new_desire)
-                        ws_shop.update_cell(real_row, 7, new_note)
-                        st.success("已保存"); time.sleep(1.0); st.rerun()
+                        batch = new_batch()
+                        real_row = batch.locate(SHOP_SHEET, row.get(ID_COLUMN), idx + 2)
+                        batch.set(SHOP_SHEET, real_row, 2, new_name)
+                        batch.set(SHOP_SHEET, real_row, 3, new_price)
+                        batch.set(SHOP_SHEET, real_row, 4, new_desire)
+                        batch.set(SHOP_SHEET, real_row, 7, new_note)
+                        if commit_batch(batch): done("已保存")
                         
                     if c_btn_2.form_submit_button("🗑️ 刪除項目", type="primary"):
-                        real_row = idx + 2
-                        ws_shop.delete_rows(real_row)
-                        st.success("已刪除"); time.sleep(0.5); st.rerun()
+                        batch = new_batch()
+                        batch.delete_row(SHOP_SHEET, batch.locate(SHOP_SHEET, row.get(ID_COLUMN), idx + 2))
+                        if commit_batch(batch): done("已刪除")
                 
                 d = row.get('最終決策', '考慮')
                 st.markdown(f"""
@@ -661,13 +818,21 @@ elif page == "🛍️ 購物冷靜清單":
 # ==========================================
 elif page == "📊 資產與收支":
     st.subheader("💰 資產狀況")
+    assets = data["assets"]
+    current_twd_balance, current_lpm_balance = assets.value('台幣活存'), assets.value('Line Pay Money')
+    current_post_balance, current_jpy_balance = assets.value('郵局'), assets.value('日幣帳戶')
     
-    def update_asset(row_idx, new_val):
-        if row_idx != -1 and ws_assets:
-            ws_assets.update_cell(row_idx, 2, new_val)
-            st.toast("資產已更新"); time.sleep(1); st.rerun()
-
-    tot = int(str(df_assets[df_assets['資產項目'] == '總資產'].iloc[0]['目前價值']).replace(',','')) if not df_assets.empty else 0
+    def update_asset(name, new_val):
+        # 手動修改餘額是日記帳以外的變動：寫入後檢查點跟著平移
+        if name in assets and ws_assets:
+            before = data["balances"].get(name) if name in BALANCE_ACCOUNTS else None
+            batch = new_batch()
+            batch.set_asset(name, new_val)
+            if commit_batch(batch):
+                if before is not None: adjust_balance(sh, name, new_val, before)
+                done("資產已更新")
+
+    tot = assets.value('總資產')
     st.markdown(make_card("目前總身價", f"${tot:,}", "含所有資產", "blue"), unsafe_allow_html=True)
     
     # Row 1: 流動錢包
@@ -678,21 +843,21 @@ elif page == "📊 資產與收支":
         st.markdown(f"""<div class="asset-box"><div class="asset-num">${current_twd_balance}</div><div class="asset-desc">🇹🇼 Richart (台幣)</div></div>""", unsafe_allow_html=True)
         with st.popover("✏️ 編輯 Richart"):
             new_twd = st.number_input("新金額", value=current_twd_balance, step=100)
-            if st.button("更新 Richart"): update_asset(twd_row_idx, new_twd)
+            if st.button("更新 Richart"): update_asset('台幣活存', new_twd)
 
     with c2: 
         st.markdown(f"""<div class="asset-box"><div class="asset-num">${current_lpm_balance}</div><div class="asset-desc">🟩 Line Pay Money</div></div>""", unsafe_allow_html=True)
         with st.popover("✏️ 編輯 LPM"):
-            if lpm_row_idx == -1: st.error("❌ 未連結")
+            if 'Line Pay Money' not in assets: st.error("❌ 未連結")
             else:
                 new_lpm = st.number_input("新金額", value=current_lpm_balance, step=100)
-                if st.button("更新 LPM"): update_asset(lpm_row_idx, new_lpm)
+                if st.button("更新 LPM"): update_asset('Line Pay Money', new_lpm)
 
     with c3: 
         st.markdown(f"""<div class="asset-box"><div class="asset-num">¥{current_jpy_balance}</div><div class="asset-desc">🇯🇵 日幣帳戶</div></div>""", unsafe_allow_html=True)
         with st.popover("✏️ 編輯日幣"):
             new_jpy = st.number_input("新金額", value=current_jpy_balance, step=100)
-            if st.button("更新日幣"): update_asset(jpy_row_idx, new_jpy)
+            if st.button("更新日幣"): update_asset('日幣帳戶', new_jpy)
 
     # Row 2: 儲蓄金庫
     st.markdown("**🔒 儲蓄金庫**")
@@ -701,18 +866,42 @@ elif page == "📊 資產與收支":
     with c4: 
         st.markdown(f"""<div class="asset-box"><div class="asset-num">${current_post_balance}</div><div class="asset-desc">📮 郵局 (金庫)</div></div>""", unsafe_allow_html=True)
         with st.popover("✏️ 編輯郵局"):
-            if post_row_idx == -1: st.error("❌ 未連結！請在表單新增 '郵局'")
+            if '郵局' not in assets: st.error("❌ 未連結！請在表單新增 '郵局'")
             else:
                 new_post = st.number_input("新金額", value=current_post_balance, step=1000)
-                if st.button("更新郵局"): update_asset(post_row_idx, new_post)
+                if st.button("更新郵局"): update_asset('郵局', new_post)
 
     with c5: 
-        fixed_dep = int(str(df_assets[df_assets['資產項目']=='定存累計'].iloc[0]['目前價值']).replace(',','')) if not df_assets.empty else 0
+        fixed_dep = assets.value('定存累計')
         st.markdown(f"""<div class="asset-box"><div class="asset-num">${fixed_dep}</div><div class="asset-desc">🏦 Richart 定存</div></div>""", unsafe_allow_html=True)
 
+    # 餘額核對：試算表上的值 vs 檢查點 + 日記帳推算；不一致時以日記帳重算寫回，或以試算表為準重設檢查點
+    sheet_vals, derived = sheet_balances(snapshot), data["balances"]
+    drift = balance_drift(sheet_vals, derived)
+    with st.expander(f"🧮 餘額核對{'：⚠️ ' + str(len(drift)) + ' 項不一致' if drift else '：✅ 與日記帳一致'}", expanded=bool(drift)):
+        st.dataframe(pd.DataFrame([(k, sheet_vals[k], v, None if sheet_vals[k] is None else sheet_vals[k] - v) for k, v in derived.items() if k in sheet_vals],
+                                  columns=["項目", "試算表", "日記帳推算", "差額"]), hide_index=True, use_container_width=True)
+        cp = load_checkpoint(sh)
+        if cp: st.caption(f"檢查點：{datetime.fromtimestamp(cp.at).strftime('%Y/%m/%d %H:%M')}，之後的變動由日記帳重播")
+        b1, b2 = st.columns(2)
+        if b1.button("🔁 以日記帳重算並寫回", use_container_width=True, disabled=not (ws_assets and ws_status)):
+            rules = data["rules"]
+            full, derived = rebuild_balances(sh, snapshot, rules[1], data["transfers"])
+            fix = balance_drift(sheet_balances(full), derived)
+            batch = new_batch()
+            for k, (_, v) in fix.items():
+                if k == GAP: batch.set("現況資金檢核", 9, 2, v)
+                elif batch.set_asset(k, v) and k == TWD: batch.set("現況資金檢核", 6, 2, v)
+            if not fix: done("✅ 重算完成，餘額與日記帳一致")
+            elif commit_batch(batch): done(f"🔁 已依日記帳寫回 {len(fix)} 項餘額")
+        if b2.button("📌 以試算表為準", use_container_width=True):
+            rules = data["rules"]
+            reset_balances(sh, snapshot, rules[1], data["transfers"])
+            done("📌 已以試算表目前的餘額重設檢查點")
+
     st.markdown("---")
     st.subheader("📉 每月固定收支")
-    df_model, _ = get_data("每月收支模型")
+    df_model = data["model"]
     if not df_model.empty:
         incomes = df_model[df_model['金額 (B)'].astype(str).str.contains("-") == False]
         expenses = df_model[df_model['金額 (B)'].astype(str).str.contains("-") == True]
@@ -749,6 +938,7 @@ elif page == "📊 資產與收支":
 # ==========================================
 elif page == "📅 未來推估":
     st.subheader("🔮 財務預測")
+    df_future = data["future"]
     if not df_future.empty:
         valid_df = df_future[~df_future['月份 (A)'].astype(str).str.contains("初始")].copy()
         
@@ -770,47 +960,104 @@ elif page == "📅 未來推估":
             st.markdown(make_card(f"🎉 {last['月份 (A)']} 最終預估", f"${last['預估實際餘額 (D)']}", "財務自由起點", "purple"), unsafe_allow_html=True)
         except: pass
 
+    # --- 推估試算：固定收支 (模型 + 規則起訖) + 變動支出 Monte Carlo ---
+    st.markdown("---")
+    st.subheader("🧮 推估試算")
+    assets, kpi, (rules, _), cash, history, df_shop = data.need("assets", "kpi", "rules", "cash_lines", "spend_history", "shop")
+    logged = data["logged_rules"].get((current_year, current_month), ())
+    mean0, std0 = spend_stats(list(history.values()), month_budget(current_month, 0, kpi)["base_budget"])
+
+    c1, c2, c3, c4 = st.columns(4)
+    horizon = c1.slider("推估月數", 12, 60, 24, step=6)
+    spend_mean = c2.number_input("每月變動支出 (平均)", min_value=0, value=int(round(mean0)), step=100)
+    spend_std = c3.number_input("變動支出標準差", min_value=0, value=int(round(std0)), step=50)
+    runs = c4.select_slider("模擬情境數", [1000, 5000, 10000, 20000], value=5000)
+    extra = st.number_input("每月額外收支 (正數多存、負數多花)", value=0, step=100)
+    picks = []
+    if not df_shop.empty and '預估價格' in df_shop.columns:
+        shop = shop_purchases(df_shop['物品名稱'], df_shop['預估價格'], df_shop['冷靜期限'] if '冷靜期限' in df_shop.columns else [""] * len(df_shop))
+        chosen = st.multiselect("假設購買 (購物冷靜清單，於冷靜期限當月付款)", list(range(len(shop))), format_func=lambda i: f"{shop[i][0]} ${shop[i][1]:,.0f}")
+        picks = [(shop[i][1], shop[i][2]) for i in chosen]
+
+    with prof.phase("推估試算"):
+        # 起點 = 流動帳戶 + 本月還沒記錄的固定收支 + 應收帳款 - 本月剩下的變動支出，從下個月開始逐月推估
+        liquid = sum(assets.value(a) for a in LIQUID_ACCOUNTS)
+        month_rest = sum(rule_amount(r) for r in rules if r.active(current_year, current_month) and r.id not in logged)
+        receivable = kpi["pending_revenue"] + kpi["pending_reimburse"]
+        start = liquid + month_rest + receivable - max(0, spend_mean - kpi["variable"])
+        axis = month_axis(current_year + current_month // 12, current_month % 12 + 1, horizon)
+        flows = fixed_flows(cash, axis) + extra + purchase_flows(picks, axis)
+        base = project(start, flows, spend_mean)
+        sim = simulate(start, flows, spend_mean, spend_std, runs)
+    bands, end = sim["bands"], ym_label(axis[-1])
+
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric(f"{end} 中位數", f"${bands[50][-1]:,.0f}")
+    m2.metric(f"{end} 悲觀 (P5)", f"${bands[5][-1]:,.0f}")
+    m3.metric("期間內曾透支", f"{sim['ever_negative']:.0%}")
+    m4.metric("每月固定收支", f"${flows.mean():+,.0f}")
+    labels = [ym_label(k) for k in axis]
+    # 百分位帶：P5~P95、P25~P75 兩層區間 + 中位數線 (直接給 Vega-Lite 規格，不經 Altair 轉換)
+    band = {"x": {"field": "月份", "type": "ordinal", "sort": None}}
+    st.vega_lite_chart(pd.DataFrame({"月份": labels, **{f"P{p}": bands[p] for p in bands}}), {"layer": [
+        {"mark": {"type": "area", "opacity": 0.2, "color": "#a78bfa"}, "encoding": {**band, "y": {"field": "P5", "type": "quantitative", "title": "餘額"}, "y2": {"field": "P95"}}},
+        {"mark": {"type": "area", "opacity": 0.35, "color": "#a78bfa"}, "encoding": {**band, "y": {"field": "P25", "type": "quantitative"}, "y2": {"field": "P75"}}},
+        {"mark": {"type": "line", "color": "#a78bfa"}, "encoding": {**band, "y": {"field": "P50", "type": "quantitative"}}},
+    ]})
+    st.caption(f"起點 ${start:,.0f} = 流動 ${liquid:,} + 本月未記錄固定收支 ${month_rest:+,} + 應收 ${receivable:,} - 本月剩餘變動支出；"
+               f"變動支出預設值取自最近 {len(history)} 個完整月份" if history else f"起點 ${start:,.0f}；沒有完整月份的紀錄，變動支出預設為本月本金")
+    with st.expander("📋 逐月明細"):
+        st.dataframe(pd.DataFrame({"固定收支": flows.round(), "平均情境": base.round(), "P5": bands[5].round(), "中位數": bands[50].round(),
+                                   "P95": bands[95].round(), "透支機率": sim["p_negative"].round(3)}, index=labels))
+
 elif page == "🗓️ 歷史帳本回顧":
     st.subheader("🗓️ 歷史帳本")
-    if not df_log.empty:
-        ms = sorted([m for m in df_log['Month'].unique() if m > 0])
-        if ms:
-            sel = st.selectbox("月份", ms, index=len(ms)-1)
-            h = df_log[df_log['Month'] == sel].copy()
-            
-            hist_filter = st.multiselect(
-                "篩選類別:", 
-                ["一般消費", "報帳(未入)", "報帳(已入)", "收入(未入)", "收入(已入)", "固定收支"],
-                default=[], key="hist_filter"
-            )
-            
-            if hist_filter:
-                mask = pd.Series([False] * len(h), index=h.index)
-                if "一般消費" in hist_filter: mask |= (h['是否報帳'] == '否')
-                if "報帳(未入)" in hist_filter: mask |= ((h['是否報帳'] == '是') & (h['已入帳'] == '未入帳'))
-                if "報帳(已入)" in hist_filter: mask |= ((h['是否報帳'] == '是') & (h['已入帳'] == '已入帳'))
-                if "收入(未入)" in hist_filter: mask |= ((h['是否報帳'] == '收入') & (h['已入帳'] == '未入帳'))
-                if "收入(已入)" in hist_filter: mask |= ((h['是否報帳'] == '收入') & (h['已入帳'] == '已入帳'))
-                if "固定收支" in hist_filter: mask |= (h['是否報帳'].isin(['固定', '固定收入']))
-                h = h[mask]
-
-            st.markdown(make_card(f"{sel}月 淨支出", f"${int(h['實際消耗'].sum())}", "含收入抵銷後", "gray"), unsafe_allow_html=True)
-            
-            for i, r in h.iloc[::-1].iterrows():
-                # 這裡的 i 是過濾後的 index，r.name 才是原始 index
-                # 為了避免混淆，我們統一使用 r.name 作為識別
-                real_idx = r.name + 5 # 假設 df_log 的 index 是從 0 開始連續對應 row 5
-                
-                c = "#34d399" if r['實際消耗'] < 0 else "#f87171"
-                
-                with st.container():
-                    c_row, c_del = st.columns([7, 0.5])
-                    with c_row:
-                        st.markdown(f"""<div class="list-row"><div><span style="font-size:0.8em;opacity:0.6;">{r['日期']}</span> <b>{r['項目']}</b></div><div style="color:{c};font-weight:bold;">${r['金額']}</div></div>""", unsafe_allow_html=True)
-                    
-                    with c_del:
-                        st.write("")
-                        with st.popover("🗑️"):
-                            st.markdown("確認刪除？")
-                            if st.button("確認", key=f"hist_del_{real_idx}", type="primary"):
-                                delete_transaction(real_idx, r)
+    ms = journal_months(snapshot)
+    if ms:
+        sel_y, sel = st.selectbox("月份", ms, index=len(ms)-1, format_func=lambda p: f"{p[0]}/{p[1]:02d}")
+        # 只載入選到的月份；已封存的月份從年份分頁讀 (唯讀)，統計直接用封存清單的彙總
+        with prof.phase("載入月份"):
+            # 與封存分頁一樣：讀不到 (已由 QuotaClient 重試過) 就顯示出來，這個月份先只顯示封存的部分
+            try: h = journal_frame(load_journal_months(sh, [(sel_y, sel)]), [(sel_y, sel)])
+            except (gspread.exceptions.APIError, OSError) as e: h = pd.DataFrame(columns=LOG_COLUMNS); st.caption(f"⚠️ 無法讀取日記帳：{e}")
+            try: cold = archived_frame(sh, snapshot, [(sel_y, sel)])
+            except Exception: cold = pd.DataFrame(); st.caption("⚠️ 無法讀取封存分頁")
+        month_rollup = MonthRollup.from_journal(h)
+        archived = archive_manifest(snapshot).rollup
+        if not cold.empty: h = pd.concat([cold, h], ignore_index=True)
+        
+        hist_filter = st.multiselect(
+            "篩選類別:", 
+            ["一般消費", "報帳(未入)", "報帳(已入)", "收入(未入)", "收入(已入)", "固定收支"],
+            default=[], key="hist_filter"
+        )
+        
+        if hist_filter:
+            mask = pd.Series([False] * len(h), index=h.index)
+            for f in hist_filter: mask |= FILTER_RULES[f](h['是否報帳'].astype(str), h['已入帳'].astype(str).str.strip())
+            h = h[mask]
+
+        st.markdown(make_card(f"{sel_y}年{sel}月 淨支出", f"${int(month_rollup.net_spent(sel_y, sel, hist_filter) + archived.net_spent(sel_y, sel, hist_filter))}", "含收入抵銷後", "gray"), unsafe_allow_html=True)
+        
+        render_txn_list(h.iloc[::-1], "hist", hist_row_html, editable=cold.empty)
+
+# ==========================================
+# ⏱️ 效能分析面板
+# ==========================================
+if prof.enabled:
+    rec = save_profile(page)
+    prof_log = st.session_state["profile_log"]
+    with st.sidebar.expander(f"⏱️ 本次 rerun：{rec['total_ms']:.0f} ms"):
+        st.markdown("**各階段耗時 (ms)**")
+        st.dataframe(pd.DataFrame(rec["phases"]), hide_index=True)
+        st.markdown("**API 呼叫**")
+        if rec["api"]: st.dataframe(pd.DataFrame(rec["api"]).T)
+        else: st.caption("本次 rerun 沒有 API 呼叫")
+        st.markdown("**資料表大小**")
+        st.dataframe(pd.DataFrame(rec["frames"]).T)
+        st.markdown("**分頁讀取 (各分頁最近一次)**")
+        st.dataframe(pd.DataFrame(fetch_report()).T.drop(columns="at", errors="ignore"))
+        st.download_button(f"⬇️ 匯出 JSONL ({len(prof_log)} 次 rerun)", to_jsonl(prof_log), file_name="rerun_profile.jsonl", mime="application/json")
+
+# 以本地快照檔啟動：畫面已先渲染，等背景對帳完成，試算表有新資料就重跑一次
+if settle_snapshot(snapshot): st.rerun()
@@ -0,0 +1,41 @@
+# 日期解析效能比較：舊的逐列 robust_month_parser vs 向量化 parse_log_dates
+#   python bench/bench_dates.py [列數]
+import os
+import sys
+import time
+from datetime import date, timedelta
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from ledger import parse_log_dates
+
+def robust_month_parser(x, current_month=10):
+    try: return pd.to_datetime(str(x), format='%m/%d').month
+    except:
+        try: return pd.to_datetime(str(x)).month
+        except: return current_month
+
+def make_dates(n, end=date(2026, 10, 17)):
+    # 依時間順序的 MM/DD，約每天 3 筆，夾雜少量含年份與無法解析的值
+    days = [end - timedelta(days=(n - i) // 3) for i in range(n)]
+    out = [d.strftime("%m/%d") for d in days]
+    for i in range(0, n, 997): out[i] = days[i].strftime("%Y/%m/%d")
+    for i in range(5, n, 4999): out[i] = "?"
+    return pd.Series(out)
+
+def timed(fn):
+    t0 = time.perf_counter(); out = fn()
+    return out, time.perf_counter() - t0
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    today = date(2026, 10, 17)
+    dates = make_dates(n, today)
+    old, t_old = timed(lambda: dates.apply(robust_month_parser))
+    new, t_new = timed(lambda: parse_log_dates(dates, today))
+    expected_years = pd.Series([(today - timedelta(days=(n - i) // 3)).year for i in range(n)])
+    print(f"rows={n}")
+    print(f"robust_month_parser (apply): {t_old * 1000:9.1f} ms")
+    print(f"parse_log_dates (vectorized): {t_new * 1000:8.1f} ms  ({t_old / t_new:.0f}x)")
+    print(f"month agrees with old parser: {(old == new['Month']).mean():.4%}")
+    print(f"year correct: {(expected_years == new['Year']).mean():.4%}")
@@ -0,0 +1,39 @@
+# 頁面渲染效能：以假工作簿跑 app.py (Streamlit AppTest)，量測各頁首次渲染與 rerun 時間
+#   python bench/bench_render.py 1000 10000
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+from fake_gspread import FakeSpreadsheet
+from synthetic import make_workbook
+
+PAGES = ["💸 隨手記帳 (本月)", "🗓️ 歷史帳本回顧"]
+
+def bench(n_log):
+    path = os.path.join(tempfile.mkdtemp(), "workbook.json")
+    # 全部放在今天：最忙的一個月 = 列表最長的情況
+    FakeSpreadsheet.create(path, make_workbook(n_log, date.today(), months=0))
+    os.environ["FINANCE_FAKE_WORKBOOK"] = path
+    st.cache_data.clear(); st.cache_resource.clear()
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=600)
+    out = {}
+    for page in PAGES:
+        t0 = time.perf_counter()
+        if page == PAGES[0]: at.run()
+        else: at.sidebar.radio[0].set_value(page).run()
+        first = time.perf_counter() - t0
+        t0 = time.perf_counter(); at.run(); rerun = time.perf_counter() - t0
+        out[page] = (first, rerun, len(at.main.markdown), len(at.main.button) + len(at.main.toggle))
+    return out
+
+if __name__ == "__main__":
+    for n in [int(a) for a in sys.argv[1:]] or [1000, 10000]:
+        for page, (first, rerun, md, widgets) in bench(n).items():
+            print(f"rows={n:>6} {page:<14} first={first * 1000:8.0f} ms  rerun={rerun * 1000:8.0f} ms  markdown={md:>6}  buttons/toggles={widgets:>6}")
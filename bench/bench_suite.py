@@ -0,0 +1,195 @@
+# 效能基準：合成工作簿 (日記帳 1k / 10k / 100k / 1M 筆) + 記憶體假工作簿，與 baselines.json 比較
+#   python bench/bench_suite.py                     # 1k 10k 100k
+#   python bench/bench_suite.py 1000 1000000        # 指定筆數
+#   python bench/bench_suite.py --update            # 以本次結果更新基準
+# 退步 (比基準慢 TOLERANCE 倍以上且差距超過 MIN_MS，或 API 呼叫變多) 時以 exit code 1 結束
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import date
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+import tempfile
+import numpy as np
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+from fake_gspread import MEMORY_BOOKS, FakeSpreadsheet
+from forecast import simulate
+from ledger import FILTER_RULES, MonthRollup, parse_log_dates
+from synthetic import make_workbook
+import workbook
+from workbook import records_frame, snapshot_state
+
+BASELINES = os.path.join(HERE, "baselines.json")
+DEFAULT_SIZES = [1000, 10000, 100000]
+TOLERANCE = 1.5
+MIN_MS = 5.0
+PAGES = ["🛍️ 購物冷靜清單", "📊 資產與收支", "📅 未來推估", "🗓️ 歷史帳本回顧", "💸 隨手記帳 (本月)"]
+DATA_PREP = ("快照", "get_data", "資產 / 缺口", "日期解析", "本月篩選 + KPI")
+# 日記帳列範圍索引與本地快照檔另存一份，不動到平常使用的檔案
+workbook.JOURNAL_INDEX_PATH = os.path.join(tempfile.gettempdir(), "finance_bench_journal_index.json")
+workbook.SNAPSHOT_FILE = os.path.join(tempfile.gettempdir(), "finance_bench_snapshot.parquet")
+workbook.WRITE_JOURNAL = os.path.join(tempfile.gettempdir(), "finance_bench_write_journal.jsonl")
+workbook.BALANCE_CHECKPOINT_PATH = os.path.join(tempfile.gettempdir(), "finance_bench_balance_checkpoint.json")
+
+def median_ms(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); times.append((time.perf_counter() - t) * 1000)
+    return round(statistics.median(times), 2)
+
+def headless(tables, repeat=3):
+    # 不經 Streamlit：資料準備的各個步驟與篩選遮罩
+    today = date.today()
+    log = tables["流動支出日記帳"]
+    df = records_frame(log, 4)
+    dates = parse_log_dates(df['日期'], today)
+    df[['Date', 'Year', 'Month']] = dates
+    t, s = df['是否報帳'].astype(str), df['已入帳'].astype(str).str.strip()
+    rollup = MonthRollup.from_journal(df)
+    return {
+        "records_frame": median_ms(lambda: records_frame(log, 4), repeat),
+        "parse_log_dates": median_ms(lambda: parse_log_dates(df['日期'], today), repeat),
+        "month_filter": median_ms(lambda: df[(df['Year'] == today.year) & (df['Month'] == today.month)], repeat),
+        "filter_masks": median_ms(lambda: [FILTER_RULES[f](t, s) for f in FILTER_RULES], repeat),
+        "rollup_build": median_ms(lambda: MonthRollup.from_journal(df), repeat),
+        "month_kpis": median_ms(lambda: rollup.month_kpis(today.year, today.month), repeat),
+        # 未來推估：5000 組情境 × 60 個月
+        "monte_carlo": median_ms(lambda: simulate(10000, np.full(60, 1000.0), 2000, 500, 5000), repeat),
+    }
+
+def wait_reconcile(timeout=60):
+    # 寫入佇列的背景送出與之後的對帳也算在該動作的 API 呼叫內
+    end = time.time() + timeout
+    while (not workbook.write_queue(workbook.WRITE_JOURNAL).idle() or snapshot_state()["reconciling"]) and time.time() < end: time.sleep(0.01)
+
+def select_row(at, pred):
+    sel = next(x for x in at.selectbox if x.key == "month_sel")
+    for i, label in enumerate(sel.options):
+        if pred(label): return sel.select_index(i).run()
+    raise LookupError("找不到符合的交易")
+
+def app_actions(n, tables):
+    # 透過 AppTest 跑 app.py (效能分析模式開啟)，每個動作記錄耗時、各階段與 API 呼叫次數
+    path = f"memory:bench-{n}"
+    MEMORY_BOOKS.pop(path, None)
+    FakeSpreadsheet.create(path, tables)
+    os.environ["FINANCE_FAKE_WORKBOOK"] = path
+    st.cache_data.clear(); st.cache_resource.clear()
+    for f in (workbook.JOURNAL_INDEX_PATH, workbook.SNAPSHOT_FILE, workbook.WRITE_JOURNAL, workbook.BALANCE_CHECKPOINT_PATH):
+        if os.path.exists(f): os.remove(f)
+    calls = MEMORY_BOOKS[path]["calls"]
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=3600)
+    at.session_state["profile_on"] = True
+    out = {}
+
+    def action(name, fn):
+        log = at.session_state["profile_log"] if "profile_log" in at.session_state else []
+        seen, before = len(log), Counter(calls)
+        t = time.perf_counter(); fn(); ms = (time.perf_counter() - t) * 1000
+        wait_reconcile()
+        if at.exception: raise RuntimeError(f"{name}: {at.exception[0].value}")
+        recs = at.session_state["profile_log"][seen:]
+        phases = Counter()
+        for r in recs:
+            for p in r["phases"]: phases[p["phase"].split(" ")[0] if p["phase"].startswith("get_data") else p["phase"]] += p["ms"]
+        out[name] = {"ms": round(ms, 2), "data_prep_ms": round(sum(v for k, v in phases.items() if k in DATA_PREP), 2),
+                     "render_ms": round(sum(v for k, v in phases.items() if k.startswith("頁面")), 2), "api": dict(calls - before)}
+
+    action("cold", at.run)
+    action("rerun", at.run)
+
+    # 程序重啟 (快照清空)：沿用存下來的日記帳索引，只抓本月
+    def cold_indexed():
+        snapshot_state()["snapshot"] = None
+        at.run()
+    action("cold_indexed", cold_indexed)
+
+    # 程序重啟 (快照與來源都清空)：先用本地快照檔渲染，背景對帳 (計時含等待對帳)
+    def cold_disk():
+        snapshot_state().update(snapshot=None, source=None)
+        at.run()
+    action("cold_disk", cold_disk)
+    for page in PAGES: action(f"page {page}", lambda: at.sidebar.radio[0].set_value(page).run())
+
+    def add_expense():
+        at.text_input[0].input("基準測試"); at.number_input[0].set_value(123)
+        next(b for b in at.button if b.key == "FormSubmitter:add_txn-確認記帳").click().run()
+    action("add_expense", add_expense)
+
+    def settle_toggle():
+        return next((t for t in at.toggle if (t.key or "").startswith("month_tg")), None)
+
+    # 選取交易本身不計時：先選到第一筆可切換入帳的報帳 / 收入
+    for i in range(len(next(x for x in at.selectbox if x.key == "month_sel").options)):
+        next(x for x in at.selectbox if x.key == "month_sel").select_index(i).run()
+        if settle_toggle(): break
+    tg = settle_toggle()
+    action("toggle", lambda: tg.set_value(not tg.value).run())
+
+    select_row(at, lambda label: "基準測試" in label)
+    action("delete", lambda: next(b for b in at.button if (b.key or "").startswith("month_del_")).click().run())
+    return out
+
+def flatten(n, head, acts):
+    m = {f"{n}/headless/{k}": v for k, v in head.items()}
+    for name, a in acts.items():
+        m[f"{n}/{name}/ms"] = a["ms"]
+        if a["data_prep_ms"]: m[f"{n}/{name}/data_prep_ms"] = a["data_prep_ms"]
+        if a["render_ms"]: m[f"{n}/{name}/render_ms"] = a["render_ms"]
+        for method, c in a["api"].items(): m[f"{n}/{name}/api/{method}"] = c
+    return m
+
+def compare(metrics, baseline):
+    regressions = []
+    for k, v in metrics.items():
+        if k not in baseline: continue
+        b = baseline[k]
+        if "/api/" in k:
+            if v > b: regressions.append(f"{k}: {b} → {v} 次")
+        elif v > b * TOLERANCE and v - b > MIN_MS:
+            regressions.append(f"{k}: {b:.1f} → {v:.1f} ms ({v / b:.1f}x)")
+    # 基準沒有呼叫、這次卻有呼叫的 API 也算退步
+    regressions += [f"{k}: 0 → {v} 次" for k, v in metrics.items() if "/api/" in k and k not in baseline
+                    and any(b.startswith(k.rsplit("/api/", 1)[0]) for b in baseline)]
+    return regressions
+
+def report(n, head, acts):
+    print(f"\n## 日記帳 {n:,} 筆")
+    print("  " + "  ".join(f"{k}={v:.1f}ms" for k, v in head.items()))
+    for name, a in acts.items():
+        api = ", ".join(f"{m}×{c}" for m, c in sorted(a["api"].items())) or "-"
+        print(f"  {name:<28} {a['ms']:>9.1f} ms  資料準備 {a['data_prep_ms']:>8.1f} ms  渲染 {a['render_ms']:>8.1f} ms  API: {api}")
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    update = "--update" in sys.argv
+    sizes = [int(a) for a in args] or DEFAULT_SIZES
+    stored = json.load(open(BASELINES, encoding="utf-8")) if os.path.exists(BASELINES) else {"metrics": {}}
+    metrics = {}
+    for n in sizes:
+        tables = make_workbook(n)
+        # 1M 筆單次就要數十秒，只量一次
+        head, acts = headless(tables, 3 if n < 1000000 else 1), app_actions(n, tables)
+        report(n, head, acts)
+        metrics.update(flatten(n, head, acts))
+    if update:
+        stored["metrics"].update(metrics)
+        stored["env"] = {"python": platform.python_version(), "machine": platform.machine(), "date": date.today().isoformat()}
+        with open(BASELINES, "w", encoding="utf-8") as f: json.dump(stored, f, ensure_ascii=False, indent=1, sort_keys=True)
+        print(f"\n已更新基準：{BASELINES}")
+        sys.exit(0)
+    regressions = compare(metrics, stored["metrics"])
+    if not stored["metrics"]: print("\n尚無基準，先以 --update 建立")
+    elif regressions:
+        print("\n⚠️ 效能退步：")
+        for r in regressions: print("  " + r)
+        sys.exit(1)
+    else: print("\n與基準相比沒有退步")
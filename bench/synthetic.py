@@ -0,0 +1,39 @@
+# 合成工作簿：欄位與分頁結構同正式的財務追蹤表，用於效能測試
+import random
+from datetime import date, timedelta
+
+LOG_HEADER = [["宇毛的流動支出日記帳"], [""], [""], ["日期", "項目", "金額", "是否報帳", "實際消耗", "已入帳", "ID"]]
+
+def make_log_rows(n, today, months=12, seed=0):
+    # n 筆依時間排序的交易，平均分散在最近 months 個月 (不含年份的 MM/DD，與 app 寫入格式相同)；ID 依序編號
+    rng = random.Random(seed)
+    span = max(months * 30 - 1, 0)
+    rows = []
+    for i in range(n):
+        d = today - timedelta(days=span - span * i // max(n - 1, 1))
+        kind = rng.choices(["否", "是", "收入", "固定", "固定收入"], [70, 12, 8, 8, 2])[0]
+        amt = rng.randint(20, 800) if kind in ("否", "是") else rng.choice([499, 119, 3900, 1000])
+        suffix = rng.choices(["", " (LPM)", " (郵局)"], [80, 15, 5])[0]
+        status = {"否": "已入帳", "固定": "固定扣款", "固定收入": "已入帳"}.get(kind) or rng.choice(["已入帳", "未入帳"])
+        spent = {"否": amt, "是": amt if status == "未入帳" else 0, "收入": -amt if status == "已入帳" else 0}.get(kind, 0)
+        rows.append([d.strftime("%m/%d"), f"品項{i}{suffix}", str(amt), kind, str(spent), status, f"r{seed:03x}{i:08x}"])
+    return rows
+
+def make_workbook(n_log, today=None, months=12, seed=0):
+    today = today or date.today()
+    m = today.month
+    future = [["月份 (A)", "期數 (B)", "C", "預估實際餘額 (D)", "目標應有餘額 (E)"], ["初始", "0", "", "0", "0"]]
+    for k in range(4):
+        mm = (m - 1 + k) % 12 + 1
+        future.append([f"{mm}月", f"第{k + 1}期", "", f"{13000 + 1000 * k:,}", f"{12000 + 1000 * k:,}"])
+    return {
+        "流動支出日記帳": LOG_HEADER + make_log_rows(n_log, today, months, seed),
+        "資產總覽表": [["資產項目", "目前價值"], ["台幣活存", "12,000"], ["Line Pay Money", "500"], ["郵局", "30,000"],
+                   ["日幣帳戶", "8,000"], ["定存累計", "5,000"], ["總資產", "55,500"]],
+        "現況資金檢核": [["項目", "數值"], ["", ""], ["", ""], ["", ""], ["", ""], ["台幣活存", "12,000"], ["", ""], ["", ""], ["總透支缺口", "0"]],
+        "未來四個月推估": future,
+        "購物冷靜清單": [["日期", "物品名稱", "預估價格", "想要程度", "冷靜期限", "最終決策", "備註", "ID"]] +
+                   [[f"{(i % 12) + 1:02d}/01", f"願望{i}", f"{(i * 37) % 5000 + 100:,}", str(i % 5 + 1), "2026/07/01", "延後", "", f"s{i:011x}"] for i in range(20)],
+        "每月收支模型": [["項目 (A)", "金額 (B)"], ["薪水", "3900"], ["電信費", "-499"], ["YT Premium", "-119"], ["自我分期", "-2110"],
+                   ["支出總計", "-2728"], ["每月淨剩餘", "1172"]],
+    }
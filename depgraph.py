@@ -0,0 +1,38 @@
+from contextlib import nullcontext
+
+# --- 單次 rerun 的資料依賴圖 ---
+# node(名稱, *依賴)：登記計算函式 (參數依序為各依賴的值)，get / [名稱] 時才遞迴算出依賴再算自己，
+# 結果記住到這次 rerun 結束 (每次 rerun 重新建一張圖)；頁面與側邊欄只取自己用到的節點
+# phase：包住每個節點本身計算的 context manager (效能分析)，依賴會在進入之前先算好，不重複計時
+class DataGraph:
+    def __init__(self, phase=None):
+        self.nodes, self.values, self.active = {}, {}, []
+        self.phase = phase
+
+    def node(self, name, *needs, label=None):
+        def register(fn):
+            self.nodes[name] = (fn, needs, label)
+            return fn
+        return register
+
+    def __contains__(self, name):
+        return name in self.values
+
+    def __getitem__(self, name):
+        if name in self.values: return self.values[name]
+        if name in self.active: raise RuntimeError(f"資料依賴循環：{' → '.join(self.active + [name])}")
+        fn, needs, label = self.nodes[name]
+        self.active.append(name)
+        try:
+            args = [self[n] for n in needs]
+            with self.phase(label) if self.phase and label else nullcontext(): value = fn(*args)
+        finally: self.active.pop()
+        self.values[name] = value
+        return value
+
+    def need(self, *names):
+        return tuple(self[n] for n in names)
+
+    def computed(self):
+        # 本次 rerun 實際算過的節點 (依完成順序)
+        return list(self.values)
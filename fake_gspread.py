@@ -0,0 +1,95 @@
+import json
+import os
+import random
+import threading
+from collections import Counter
+from gspread.exceptions import APIError
+from requests.models import Response
+from sheet_ops import TableBook
+
+# --- 假的 gspread 工作簿 (JSON 檔保存) ---
+# 離線開發 / 測試時取代 gspread.Spreadsheet：
+#   FINANCE_FAKE_WORKBOOK=fake_workbook.json streamlit run app.py
+# path 以 "memory:" 開頭時不落地，同名的實例共用同一份記憶體內容 (效能測試用)
+#   FINANCE_FAKE_WORKBOOK=memory:bench
+# fail_rate：每次 API 呼叫以此機率丟出 429 (在套用任何變更之前)，模擬配額壓力
+#   FINANCE_FAKE_429=0.3
+# calls：依方法統計的 API 呼叫次數 (記憶體工作簿為所有實例合計)
+MEMORY_BOOKS = {}
+
+def api_error(code=429, message="Quota exceeded for quota metric 'Write requests' (fake)"):
+    r = Response()
+    r.status_code = code
+    r._content = json.dumps({"error": {"code": code, "message": message, "status": "RESOURCE_EXHAUSTED"}}).encode()
+    return APIError(r)
+
+class FakeSpreadsheet(TableBook):
+    def __init__(self, path, title="宇毛的財務追蹤表_2026", fail_rate=0.0, seed=None):
+        self.path, self.title, self.mtime = path, title, None
+        self.fail_rate, self.rng, self.failures = fail_rate, random.Random(seed), 0
+        self.lock = threading.RLock()
+        self.memory = MEMORY_BOOKS.setdefault(path, {"tables": {}, "ids": {}, "calls": Counter()}) if path.startswith("memory:") else None
+        self.calls = self.memory["calls"] if self.memory else Counter()
+        super().__init__()
+        self.reload()
+
+    def api(self, method):
+        self.calls[method] += 1
+        if self.fail_rate and self.rng.random() < self.fail_rate:
+            self.failures += 1
+            raise api_error()
+
+    def worksheets(self):
+        self.api("worksheets")
+        return super().worksheets()
+
+    def values_batch_get(self, ranges, params=None):
+        self.api("values_batch_get")
+        return super().values_batch_get(ranges, params)
+
+    def add_worksheet(self, title, rows=1000, cols=26, index=None):
+        with self.lock:
+            self.api("add_worksheet")
+            return super().add_worksheet(title, rows, cols, index)
+
+    def batch_update(self, body):
+        # 同一實例可能被多個執行緒共用 (同步引擎 / 配額壓力測試)
+        with self.lock:
+            self.api("batch_update")
+            return super().batch_update(body)
+
+    def reload(self):
+        # 同一個檔案可能被其他實例 (另一個 session / 同步引擎) 寫過
+        if self.memory:
+            self.tables, self.ids = self.memory["tables"], self.memory["ids"]
+            return
+        mtime = os.stat(self.path).st_mtime_ns if os.path.exists(self.path) else None
+        if mtime is None or mtime == self.mtime: return
+        with open(self.path, encoding="utf-8") as f: data = json.load(f)
+        seed = TableBook({s["title"]: s["rows"] for s in data["sheets"]}, {s["title"]: s["id"] for s in data["sheets"]})
+        self.tables, self.ids, self.mtime = seed.tables, seed.ids, mtime
+
+    @classmethod
+    def create(cls, path, tables, title="宇毛的財務追蹤表_2026"):
+        book, seed = cls(path, title), TableBook(tables)
+        book.tables, book.ids = seed.tables, seed.ids
+        book.save()
+        return book
+
+    def save(self):
+        if self.memory:
+            self.memory["tables"], self.memory["ids"] = self.tables, self.ids
+            return
+        data = {"title": self.title, "sheets": [{"title": t, "id": self.ids[t], "rows": rows} for t, rows in self.tables.items()]}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self.mtime = os.stat(self.path).st_mtime_ns
+
+class FakeClient:
+    # 對應 gspread.authorize(...) 回傳的 Client，只支援 open()
+    def __init__(self, path, fail_rate=0.0):
+        self.path, self.fail_rate = path, fail_rate
+
+    def open(self, title):
+        return FakeSpreadsheet(self.path, title, self.fail_rate)
@@ -0,0 +1,94 @@
+import numpy as np
+from ledger import to_num, year_month
+
+# --- 現金流推估引擎 (NumPy 向量化；不依賴 Streamlit / gspread) ---
+# 月份一律用整數 ym = 年 * 12 + 月 - 1，推估期間是一段連續的 ym 陣列；
+# 固定收支 = 每月收支模型的各項 (搭配固定收支規則的起訖月份) + 模型沒有的規則，
+# 變動支出則以常態分布抽樣做 Monte Carlo，回傳各月餘額的百分位數
+PERCENTILES = (5, 25, 50, 75, 95)
+MODEL_SKIP = ("總計", "剩餘")
+SPEND_SPREAD = 0.25     # 沒有歷史資料時，變動支出標準差 = 平均 × SPEND_SPREAD
+SEED = 0                # 固定種子：同樣的輸入每次 rerun 得到同樣的百分位數
+
+def ym_of(year, month):
+    return year * 12 + month - 1
+
+def ym_label(ym):
+    return f"{ym // 12}/{ym % 12 + 1:02d}"
+
+def month_axis(year, month, n):
+    # (year, month) 起連續 n 個月
+    return np.arange(ym_of(year, month), ym_of(year, month) + n)
+
+def amount_of(v):
+    # 推估用的金額 (float)："12,000" → 12000.0；非數字當 0 (ledger.parse_amount 是整數、非數字回傳 None)
+    return to_num(str(v).replace(',', '').strip())
+
+def rule_amount(rule):
+    # 收入為正；支出與定存轉帳 (流動帳戶轉出) 為負
+    return rule.amount if rule.kind == "income" else -rule.amount
+
+def model_lines(items, amounts):
+    # 每月收支模型 (項目 (A) / 金額 (B)) → [{item, amount, start, end}]；略過小計列與空白金額
+    lines = []
+    for item, amount in zip(items, amounts):
+        item = str(item).strip()
+        if not item or any(k in item for k in MODEL_SKIP) or not str(amount).strip(): continue
+        lines.append({"item": item, "amount": amount_of(amount), "start": None, "end": None})
+    return lines
+
+def merge_rules(lines, rules):
+    # 模型裡對得到的規則 (關鍵字互相包含) 沿用模型金額、套上規則的起訖月份；模型沒有的規則另外加一項
+    out = [dict(l) for l in lines]
+    for r in rules:
+        hit = [l for l in out if r.matches(l["item"]) or l["item"].lower() in r.item.lower()]
+        for l in hit: l["start"], l["end"] = r.start, r.end
+        if not hit: out.append({"item": r.item, "amount": rule_amount(r), "start": r.start, "end": r.end})
+    return out
+
+def fixed_flows(lines, axis):
+    # 各月固定收支淨額：(項目 × 月份) 的有效矩陣一次算完
+    if not lines: return np.zeros(len(axis))
+    start = np.array([ym_of(*l["start"]) if l["start"] else axis[0] for l in lines])
+    end = np.array([ym_of(*l["end"]) if l["end"] else axis[-1] for l in lines])
+    amount = np.array([l["amount"] for l in lines], dtype=float)
+    active = (axis[None, :] >= start[:, None]) & (axis[None, :] <= end[:, None])
+    return amount @ active
+
+def purchase_flows(purchases, axis):
+    # purchases: [(金額, (年, 月) 或 None)]；早於推估起點 (或沒有月份) 的算在第一個月，超出期間的不計
+    flows = np.zeros(len(axis))
+    if not purchases: return flows
+    at = np.array([ym_of(*ym) if ym else axis[0] for _, ym in purchases]) - axis[0]
+    amount = np.array([a for a, _ in purchases], dtype=float)
+    keep = at < len(axis)
+    np.add.at(flows, np.clip(at[keep], 0, None), -amount[keep])
+    return flows
+
+def shop_purchases(items, prices, deadlines):
+    # 購物冷靜清單 → [(名稱, 金額, (年, 月))]；在冷靜期限那個月購買
+    out = []
+    for item, price, deadline in zip(items, prices, deadlines):
+        try: ym = year_month(deadline)
+        except ValueError: ym = None
+        out.append((str(item), amount_of(price), ym))
+    return out
+
+def spend_stats(values, fallback):
+    # 歷史各月變動支出 → (平均, 標準差)；不到兩個月時以 fallback 為平均、SPEND_SPREAD 推標準差
+    values = np.asarray(values, dtype=float)
+    mean = float(values.mean()) if len(values) else float(fallback)
+    if len(values) < 2: return mean, mean * SPEND_SPREAD
+    return mean, float(values.std(ddof=1))
+
+def project(balance, flows, spend):
+    # 固定變動支出下的各月月底餘額
+    return balance + np.cumsum(flows - spend)
+
+def simulate(balance, flows, mean, std, runs=5000, seed=SEED, percentiles=PERCENTILES):
+    # runs 組情境：每月變動支出 ~ N(mean, std) (不低於 0)，整個 (情境 × 月份) 矩陣一次累加
+    rng = np.random.default_rng(seed)
+    spend = np.maximum(rng.normal(mean, std, (runs, len(flows))), 0)
+    paths = balance + np.cumsum(flows - spend, axis=1)
+    return {"bands": dict(zip(percentiles, np.percentile(paths, percentiles, axis=0))),
+            "p_negative": (paths < 0).mean(axis=0), "ever_negative": float((paths.min(axis=1) < 0).mean())}
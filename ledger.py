@@ -0,0 +1,768 @@
+# --- 帳務引擎 (不依賴 Streamlit / gspread；pandas 只在需要時才載入) ---
+# python -c "import ledger" 只需幾毫秒，可獨立測試 / 量測 / 批次處理
+
+LOG_COLUMNS = ['日期', '項目', '金額', '是否報帳', '實際消耗', '已入帳']
+TWD = "台幣活存"
+LPM = "Line Pay Money"
+POST = "郵局"
+FIXED_DEPOSIT = "定存累計"
+LIQUID_ACCOUNTS = (TWD, LPM)     # 計入缺口的流動帳戶
+SELF_INSTALLMENT = "自我分期(還債)"
+ACCOUNT_SUFFIX = {LPM: " (LPM)", POST: " (郵局)"}
+
+def log_record(values):
+    # append 到日記帳的一列 → 以欄名存取的 dict
+    return dict(zip(LOG_COLUMNS, values))
+
+def account_of(item_name):
+    # 項目名稱的後綴決定帳戶
+    item_name = str(item_name)
+    if "(LPM)" in item_name: return LPM
+    if "(郵局)" in item_name: return POST
+    return TWD
+
+def item_with_account(name, account):
+    return name + ACCOUNT_SUFFIX.get(account, "")
+
+def to_num(v):
+    # 與 pd.to_numeric(errors='coerce').fillna(0) 相同
+    try: return float(v)
+    except (TypeError, ValueError): return 0.0
+
+def to_amount(v):
+    # 整數金額維持 int，寫回試算表時與原本相同
+    v = to_num(v)
+    return int(v) if v.is_integer() else v
+
+def category_of(kind):
+    # 是否報帳 → 顯示用類別
+    if kind == "是": return "報帳/代墊"
+    if kind == "收入": return "收入"
+    if kind in ("固定", "固定收入"): return "固定收支"
+    return "一般"
+
+# --- 交易 ---
+class Transaction:
+    # 日記帳的一列
+    __slots__ = ("date", "item", "amount", "kind", "spent", "status")
+
+    def __init__(self, date: str, item: str, amount, kind: str, spent=0, status: str = "已入帳"):
+        self.date, self.item, self.amount, self.kind, self.spent, self.status = date, item, amount, kind, spent, status
+
+    def __repr__(self): return f"Transaction({self.date!r}, {self.item!r}, {self.amount!r}, {self.kind!r}, {self.spent!r}, {self.status!r})"
+
+    @classmethod
+    def from_row(cls, rec):
+        # rec: 以欄名存取的一列 (dict / pandas Series)
+        status = str(rec.get('已入帳', '已入帳')).strip() or "已入帳"
+        return cls(str(rec['日期']), str(rec['項目']), to_amount(rec['金額']), str(rec['是否報帳']), to_amount(rec['實際消耗']), status)
+
+    @property
+    def account(self): return account_of(self.item)
+
+    @property
+    def category(self): return category_of(self.kind)
+
+    def values(self):
+        return [self.date, self.item, self.amount, self.kind, self.spent, self.status]
+
+    def record(self):
+        return log_record(self.values())
+
+    def settled(self, on):
+        # 切換入帳狀態後的新交易 (報帳 / 收入)
+        spent = {"報帳/代墊": 0 if on else self.amount, "收入": -self.amount if on else 0}.get(self.category, self.spent)
+        return Transaction(self.date, self.item, self.amount, self.kind, spent, "已入帳" if on else "未入帳")
+
+# --- 新增的列 ---
+# 只產生日記帳的列；對餘額的影響一律由 balance_effect 依列的內容推出
+def manual_entry(date_str, name, amount, is_expense=True, reimburse="否", account=TWD):
+    # 手動記帳：支出記已入帳 (代墊記未入帳，之後入帳再補回)；收入先記未入帳
+    item = item_with_account(name, account)
+    if is_expense: return Transaction(date_str, item, amount, reimburse, amount, "未入帳" if reimburse == "是" else "已入帳")
+    return Transaction(date_str, item, amount, "收入", 0, "未入帳")
+
+def auto_entry(date_str, name, amount, type_code="固定", account=TWD):
+    # 側邊欄待辦的固定收支；非台幣活存的帳戶照慣例加在項目後綴 (自我分期不加)
+    if name == SELF_INSTALLMENT: return Transaction(date_str, name, amount, "固定", 0, "固定扣款")
+    is_inc = type_code == "固定收入"
+    return Transaction(date_str, item_with_account(name, account), amount, "固定收入" if is_inc else "固定", 0, "已入帳" if is_inc else "固定扣款")
+
+# --- 餘額變動 ---
+# deltas: {"assets": [(帳戶, 增減)], "gap": 總透支缺口增減}
+def balance_deltas(account, change):
+    # 一般交易：帳戶增減，流動帳戶另計入缺口
+    return {"assets": [(account, change)] if change else [], "gap": change if account in LIQUID_ACCOUNTS else 0}
+
+NO_DELTAS = {"assets": [], "gap": 0}
+
+def merge_deltas(all_deltas):
+    # 多筆交易的餘額變動 → 每個帳戶一筆淨額
+    net, gap = {}, 0
+    for d in all_deltas:
+        for account, change in d["assets"]: net[account] = net.get(account, 0) + change
+        gap += d["gap"]
+    return {"assets": [(a, c) for a, c in net.items() if c], "gap": gap}
+
+# --- 餘額事件與檢查點 ---
+# 帳戶餘額 (與總透支缺口) 由日記帳推出：每一列依目前的內容 (是否報帳 / 已入帳) 對餘額有固定的影響，
+# 新增 / 切換 / 刪除就是這個影響的 +1 / 換掉 / -1，不必再由列內容反推回補金額。
+# 檢查點記下某個時間的餘額與當時各月份的影響合計；目前餘額 = 檢查點 + Σ (各月份目前的影響 - 檢查點時的影響)
+GAP = "總透支缺口"
+BALANCE_ACCOUNTS = (TWD, LPM, POST, FIXED_DEPOSIT)
+INCOME_KINDS = ("收入", "固定收入")
+
+def is_transfer(item, transfers=()):
+    # transfers：定存轉帳的規則 (RecurringRule)；轉帳列只能由項目比對出來
+    return any(r.matches(item) for r in transfers)
+
+def balance_effect(txn, transfers=()):
+    # 一列目前對餘額的影響 (deltas 格式)，手動記帳 / 側邊欄待辦 / 匯入 / 切換 / 刪除都以此為準：
+    # 收入已入帳才加；支出 (含代墊) 扣款，代墊已入帳補回；自我分期只記缺口；定存轉帳由帳戶移到定存
+    if txn.kind in INCOME_KINDS: return balance_deltas(txn.account, txn.amount) if txn.status == "已入帳" else NO_DELTAS
+    if txn.kind == "是" and txn.status == "已入帳": return NO_DELTAS
+    if txn.kind == "固定" and txn.item.strip() == SELF_INSTALLMENT: return {"assets": [], "gap": txn.amount}
+    if txn.kind == "固定" and is_transfer(txn.item, transfers): return {"assets": [(txn.account, -txn.amount), (FIXED_DEPOSIT, txn.amount)], "gap": 0}
+    return balance_deltas(txn.account, -txn.amount)
+
+def journal_deltas(changes, transfers=()):
+    # changes：[(年, 月, 交易, ±1)] (與每月彙總的增量更新相同) → 合併後的餘額變動
+    out = []
+    for _, _, txn, sign in changes:
+        d = balance_effect(txn, transfers)
+        out.append({"assets": [(a, sign * c) for a, c in d["assets"]], "gap": sign * d["gap"]})
+    return merge_deltas(out)
+
+def change_effects(changes, transfers=()):
+    # changes → 各月份影響的增減 {(年, 月): {帳戶 / GAP: 增減}} (與 month_effects 同格式)
+    out = {}
+    for y, m, txn, sign in changes:
+        d, e = balance_effect(txn, transfers), out.setdefault((int(y), int(m)), {})
+        for a, c in d["assets"]: e[a] = e.get(a, 0) + sign * c
+        if d["gap"]: e[GAP] = e.get(GAP, 0) + sign * d["gap"]
+    return {ym: {k: v for k, v in e.items() if v} for ym, e in out.items()}
+
+def merge_effects(a, b):
+    return {k: a.get(k, 0) + b.get(k, 0) for k in set(a) | set(b) if a.get(k, 0) + b.get(k, 0)}
+
+def month_effects(df_log, transfers=()):
+    # 日記帳 (含 Year / Month) 各列的影響依 (年, 月) 合計 → {(年, 月): {帳戶 / GAP: 合計}}；規則同 balance_effect，整欄計算
+    import numpy as np
+    import pandas as pd
+    if df_log.empty: return {}
+    amount = pd.to_numeric(df_log['金額'], errors='coerce').fillna(0).to_numpy()
+    kind = df_log['是否報帳'].astype(str)
+    item = df_log['項目'].astype(str)
+    status = df_log['已入帳'].astype(str).str.strip().replace('', '已入帳') if '已入帳' in df_log.columns else pd.Series('已入帳', index=df_log.index)
+    account = np.where(item.str.contains("(LPM)", regex=False), LPM, np.where(item.str.contains("(郵局)", regex=False), POST, TWD))
+    settled, fixed = (status == '已入帳').to_numpy(), (kind == '固定').to_numpy()
+    own = fixed & (item.str.strip() == SELF_INSTALLMENT).to_numpy()
+    low = item.str.lower()
+    moved = fixed & ~own & np.logical_or.reduce([low.str.contains(r.keyword, regex=False).to_numpy() for r in transfers] + [np.zeros(len(item), bool)])
+    change = np.where(kind.isin(INCOME_KINDS), np.where(settled, amount, 0), np.where((kind == '是').to_numpy() & settled, 0, -amount))
+    change = np.where(own, 0, change)
+    gap = np.where(own, amount, np.where(moved | ~np.isin(account, LIQUID_ACCOUNTS), 0, change))
+    y, m = pd.to_numeric(df_log['Year'], errors='coerce').to_numpy(), pd.to_numeric(df_log['Month'], errors='coerce').to_numpy()
+    ok = ~(np.isnan(y) | np.isnan(m))
+    keys, inv = np.unique((y[ok] * 100 + m[ok]).astype(int), return_inverse=True)
+    sums = {a: np.bincount(inv, np.where(account == a, change, 0)[ok], len(keys)) for a in (TWD, LPM, POST)}
+    sums.update({GAP: np.bincount(inv, gap[ok], len(keys)), FIXED_DEPOSIT: np.bincount(inv, np.where(moved, amount, 0)[ok], len(keys))})
+    return {(int(k) // 100, int(k) % 100): e for i, k in enumerate(keys) if (e := {a: to_amount(v[i]) for a, v in sums.items() if v[i]})}
+
+def month_key(ym): return f"{ym[0]}-{ym[1]:02d}"
+
+def parse_month_key(s):
+    y, m = s.split("-")
+    return int(y), int(m)
+
+class BalanceCheckpoint:
+    # balances：檢查點時的餘額 {帳戶 / GAP: 值}；effects：當時已載入的月份各自的影響合計；
+    # known：當時日記帳 (含封存) 已有的月份 —— 其中沒載入的月份第一次載入時以當下的影響為基準 (採用)，
+    # 之後才出現的月份基準為 0
+    __slots__ = ("at", "balances", "effects", "known")
+
+    def __init__(self, at=0.0, balances=None, effects=None, known=()):
+        self.at, self.balances, self.effects, self.known = at, dict(balances or {}), dict(effects or {}), set(known)
+
+    def __repr__(self): return f"BalanceCheckpoint({len(self.balances)} 項, {len(self.effects)} 個月)"
+
+    def replay(self, now, present):
+        # now：目前已載入的月份 → 影響合計 (沒有列的月份為 {})；present：日記帳 (含封存) 目前有的月份
+        # 不在 now 的月份視為沒有變動，但檢查點有、現在已經不存在的月份 (整月刪光) 要扣掉
+        # → (目前餘額, 這次採用的月份 {月份: 影響})
+        out, adopted = dict(self.balances), {}
+        for ym, e in now.items():
+            if ym in self.effects: base = self.effects[ym]
+            elif ym in self.known: base = adopted[ym] = e
+            else: base = {}
+            for k in set(e) | set(base): out[k] = out.get(k, 0) + e.get(k, 0) - base.get(k, 0)
+        for ym, base in self.effects.items():
+            if ym in now or ym in present: continue
+            for k, v in base.items(): out[k] = out.get(k, 0) - v
+        return out, adopted
+
+    def adopt(self, months):
+        self.effects.update(months)
+
+    def record(self, ym, change, before=None):
+        # 由 app 寫入日記帳的變動 (change：這個月影響的增減) 記進檢查點：餘額與該月的基準一起加上，
+        # 這個月之後沒載入 (重新整理 / TTL 重新載入) 時推算值也不會退回寫入前。基準還沒有這個月時：
+        # before 為寫入前該月的影響 (不知道就留到載入時採用)；檢查點之後才出現的月份，寫入前的影響也要計入餘額
+        if ym in self.effects: base, shift = self.effects[ym], change
+        elif before is None: base, shift = None, change
+        else: base, shift = before, change if ym in self.known else merge_effects(before, change)
+        for k, v in shift.items(): self.balances[k] = self.balances.get(k, 0) + v
+        if base is not None: self.effects[ym] = merge_effects(base, change)
+        self.known.add(ym)
+
+    def adjust(self, name, value, current):
+        # 餘額在日記帳之外被改成 value (手動修改 / 缺口同步)：檢查點跟著平移，之後的推算以此為準
+        self.balances[name] = self.balances.get(name, 0) + value - current
+
+    def rebase(self, balances, now, present, at):
+        # 以目前餘額與目前的影響合計產生新的檢查點 (沒載入的月份沿用原本的基準)
+        effects = {ym: e for ym, e in self.effects.items() if ym in present and ym not in now}
+        effects.update(now)
+        return BalanceCheckpoint(at, balances, effects, set(present) | set(now))
+
+    def to_dict(self):
+        return {"at": self.at, "balances": self.balances, "effects": {month_key(ym): e for ym, e in self.effects.items()},
+                "known": sorted(month_key(ym) for ym in self.known)}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["at"], d["balances"], {parse_month_key(k): e for k, e in d["effects"].items()}, {parse_month_key(k) for k in d["known"]})
+
+def balance_drift(sheet, derived, tolerance=0):
+    # 試算表上的值 vs 推算值 → {名稱: (試算表, 推算)}；sheet 為 None (不是數字) 的也列出
+    return {k: (sheet.get(k), v) for k, v in derived.items() if k in sheet and (sheet[k] is None or abs(sheet[k] - v) > tolerance)}
+
+# --- 對帳單 / CSV 匯入 ---
+# 欄位 → 常見的欄名 (信用卡 / Line Pay / 網銀匯出)；「支出」「存入」兩欄式的對帳單另外對應
+IMPORT_ALIASES = {
+    "日期": ("日期", "交易日期", "消費日期", "消費日", "入帳日期", "記帳日", "date"),
+    "項目": ("項目", "摘要", "說明", "交易說明", "消費明細", "商店名稱", "備註", "description", "memo"),
+    "金額": ("金額", "交易金額", "消費金額", "amount"),
+    "支出": ("支出", "支出金額", "提款", "debit"),
+    "存入": ("存入", "存入金額", "收入金額", "credit"),
+    "是否報帳": ("是否報帳", "類型"),
+    "實際消耗": ("實際消耗",),
+    "已入帳": ("已入帳", "狀態"),
+}
+IMPORT_KINDS = ("否", "是", "收入", "固定", "固定收入")
+
+def read_statement(raw):
+    # raw: 檔案內容 (bytes)；UTF-8 (可含 BOM) 解不開就當 Big5 (cp950，網銀匯出常見)
+    # 回傳 (欄名, 逐列讀取的 dict 迭代器)
+    import csv, io
+    for enc in ("utf-8-sig", "cp950"):
+        try: text = raw.decode(enc); break
+        except UnicodeDecodeError: continue
+    else: raise ValueError("檔案編碼不是 UTF-8 或 Big5")
+    reader = csv.DictReader(io.StringIO(text, newline=""))
+    return [h for h in (reader.fieldnames or []) if h], reader
+
+def guess_columns(header):
+    # 依欄名猜對應 (不分大小寫、去空白)；回傳 {欄位: 欄名}
+    names = {str(h).strip().lower(): h for h in header}
+    out = {}
+    for field, aliases in IMPORT_ALIASES.items():
+        hit = next((names[a.lower()] for a in aliases if a.lower() in names), None)
+        if hit is not None: out[field] = hit
+    return out
+
+def parse_statement_date(v, default_year):
+    # 2026/10/03、2026-10-03、20261003、民國 115/10/03、10/03 (不含年份) → (年, 月, 日)；無法解析回傳 None
+    s = str(v).strip().split(" ")[0].replace("-", "/").replace(".", "/")
+    if s.isdigit() and len(s) in (7, 8): s = f"{s[:-4]}/{s[-4:-2]}/{s[-2:]}"
+    parts = s.split("/")
+    try: nums = [int(p) for p in parts]
+    except ValueError: return None
+    if len(nums) == 2: y, m, d = default_year, nums[0], nums[1]
+    elif len(nums) == 3: y, m, d = nums
+    else: return None
+    if y < 1911: y += 1911
+    if not (1 <= m <= 12 and 1 <= d <= 31): return None
+    return y, m, d
+
+def parse_statement_amount(v):
+    # "1,234"、"NT$ 1,234"、"(500)"、"-500" → 數字；空白 / 非數字回傳 None
+    s = str(v).strip().replace(",", "").replace("NT$", "").replace("$", "").replace(" ", "")
+    if s.startswith("(") and s.endswith(")"): s = "-" + s[1:-1]
+    try: return to_amount(float(s)) if s else None
+    except ValueError: return None
+
+def import_key(year, month, day, item, amount):
+    # 判斷重複用：同一天、同項目 (含帳戶後綴)、同金額
+    return (int(year), int(month), int(day), str(item).strip(), to_num(amount))
+
+def journal_keys(df_log):
+    # 日記帳既有列的 import_key 計數 (需先有 Date 欄)
+    from collections import Counter
+    keys = Counter()
+    for d, item, amount in zip(df_log['Date'], df_log['項目'], df_log['金額']):
+        if d == d: keys[import_key(d.year, d.month, d.day, item, amount)] += 1
+    return keys
+
+def import_entry(date_str, item, amount, kind="否", spent=None, status=None):
+    # 匯入的一列 → 交易；預設的入帳狀態與手動記帳 / 側邊欄待辦相同 (餘額的影響由 balance_effect 推出)
+    if kind in ("固定", "固定收入"):
+        return Transaction(date_str, item, amount, kind, 0 if spent is None else spent, status or ("已入帳" if kind == "固定收入" else "固定扣款"))
+    status = status or ("已入帳" if kind == "否" else "未入帳")
+    txn = Transaction(date_str, item, amount, kind, amount if kind != "收入" else 0, "未入帳")
+    if status == "已入帳": txn = txn.settled(True)
+    txn.status = status
+    if spent is not None: txn.spent = spent
+    return txn
+
+def plan_import(rows, columns, existing=(), account=TWD, today=None):
+    # rows: 對帳單的資料列 (dict，欄名 → 值)；columns: guess_columns 的結果 (可手動修改)
+    # existing: journal_keys 的計數，與既有列重複的 (同一筆出現幾次就略過幾次) 不匯入
+    # 回傳 {"entries": [(年, 月, 交易)] 依日期排序, "duplicates": 筆數, "errors": [(第幾列, 原因)]}
+    from collections import Counter
+    from datetime import date
+    today = today or date.today()
+    seen = Counter(existing)
+    entries, errors, dups = [], [], 0
+    col = lambda rec, field: str(rec.get(columns[field], "") or "").strip() if columns.get(field) else ""
+    for line, rec in enumerate(rows, start=2):
+        ymd = parse_statement_date(col(rec, "日期"), today.year)
+        if ymd is None:
+            errors.append((line, f"日期無法解析：{col(rec, '日期')!r}")); continue
+        if columns.get("金額"): amount = parse_statement_amount(col(rec, "金額"))
+        else:
+            out, inc = parse_statement_amount(col(rec, "支出")), parse_statement_amount(col(rec, "存入"))
+            amount = None if out is None and inc is None else (inc or 0) - abs(out or 0)
+        if not amount:
+            errors.append((line, f"金額無法解析或為 0：{col(rec, '金額') or col(rec, '支出') or col(rec, '存入')!r}")); continue
+        name = col(rec, "項目")
+        if not name:
+            errors.append((line, "項目為空")); continue
+        # 項目已有 (LPM) / (郵局) 後綴就沿用，否則套上預設帳戶
+        item = name if account_of(name) != TWD else item_with_account(name, account)
+        kind = col(rec, "是否報帳")
+        if kind and kind not in IMPORT_KINDS:
+            errors.append((line, f"是否報帳不是 {'/'.join(IMPORT_KINDS)}：{kind!r}")); continue
+        # 沒有「是否報帳」欄時以正負號判斷：負數 = 支出，正數 = 已入帳的收入
+        if not kind: kind, status = ("否", None) if amount < 0 else ("收入", "已入帳")
+        else: status = None
+        status = col(rec, "已入帳") or status
+        spent = parse_statement_amount(col(rec, "實際消耗")) if col(rec, "實際消耗") else None
+        amount = abs(amount)
+        y, m, d = ymd
+        key = import_key(y, m, d, item, amount)
+        if seen[key] > 0:
+            seen[key] -= 1; dups += 1; continue
+        # 日記帳慣例為 MM/DD (年份由列順序推回)；匯入的多半是過去的帳，附加在尾端會讓推回的年份錯亂，
+        # 所以本月以外的列寫完整日期 (parse_log_dates 推年份時不看這些列)
+        date_str = f"{m:02d}/{d:02d}" if (y, m) == (today.year, today.month) else f"{y}/{m:02d}/{d:02d}"
+        entries.append((y, m, d, import_entry(date_str, item, amount, kind, spent, status)))
+    entries.sort(key=lambda e: e[:3])
+    return {"entries": [(y, m, txn) for y, m, _, txn in entries], "duplicates": dups, "errors": errors}
+
+# --- 固定收支規則 (側邊欄待辦) ---
+# 規則以資料定義 (recurring_rules.json)：每月 day 號起、在 start ~ end ("YYYY-MM"，含) 之間，
+# 本月日記帳還沒有含 keyword (預設同 item，不分大小寫) 的項目就列為待辦
+RULE_KINDS = {"income": "固定收入", "expense": "固定支出", "transfer": "定存轉帳"}
+
+def year_month(s):
+    # "2026-07" → (2026, 7)；None 表示不限
+    if not s: return None
+    y, m = str(s).replace("/", "-").split("-")[:2]
+    return int(y), int(m)
+
+class RecurringRule:
+    __slots__ = ("id", "name", "item", "amount", "day", "kind", "account", "keyword", "start", "end")
+
+    def __init__(self, id: str, name: str, item: str, amount, day: int = 1, kind: str = "expense", account: str = TWD,
+                 keyword: str = None, start: str = None, end: str = None):
+        if kind not in RULE_KINDS: raise ValueError(f"規則「{id}」的 kind 必須是 {'/'.join(RULE_KINDS)}：{kind!r}")
+        self.id, self.name, self.item, self.amount, self.day, self.kind, self.account = id, name, item, amount, int(day), kind, account
+        self.keyword = str(keyword or item).strip().lower()
+        if not self.keyword: raise ValueError(f"規則「{id}」缺少 item / keyword")
+        self.start, self.end = year_month(start), year_month(end)
+
+    def __repr__(self): return f"RecurringRule({self.id!r}, {self.item!r}, {self.amount!r}, day={self.day}, kind={self.kind!r})"
+
+    def active(self, year, month):
+        return (self.start is None or (year, month) >= self.start) and (self.end is None or (year, month) <= self.end)
+
+    def due(self, today):
+        return self.active(today.year, today.month) and today.day >= self.day
+
+    def matches(self, item):
+        return self.keyword in str(item).lower()
+
+    def label(self):
+        return f"{self.name} (${self.amount})"
+
+    def entry(self, date_str):
+        return auto_entry(date_str, self.item, self.amount, RULE_KINDS[self.kind], self.account)
+
+def load_rules(path):
+    # JSON 陣列，每個元素是 RecurringRule 的參數；id 不可重複
+    import json
+    with open(path, encoding="utf-8") as f: rules = [RecurringRule(**d) for d in json.load(f)]
+    ids = [r.id for r in rules]
+    if len(set(ids)) != len(ids): raise ValueError(f"規則 id 重複：{sorted({i for i in ids if ids.count(i) > 1})}")
+    return rules
+
+def logged_rule_index(rules, years, months, items):
+    # (年, 月) → 該月已記錄的規則 id；之後判斷待辦只是集合查詢
+    # 所有關鍵字先合成一個 regex 篩掉不可能命中的項目，命中的才逐條規則比對；每個不同的項目只比對一次
+    import re
+    index, hits = {}, {}
+    if not rules: return index
+    # Series 逐筆迭代很慢，先轉成 list
+    years, months, items = [list(v) if not hasattr(v, "tolist") else v.tolist() for v in (years, months, items)]
+    any_keyword = re.compile("|".join(re.escape(k) for k in sorted({r.keyword for r in rules}, key=len, reverse=True)))
+    for item in set(items):
+        s = str(item).lower()
+        if any_keyword.search(s): hits[item] = [r.id for r in rules if r.keyword in s]
+    for y, m, item in zip(years, months, items):
+        if item in hits: index.setdefault((int(y), int(m)), set()).update(hits[item])
+    return index
+
+def due_rules(rules, today, index):
+    logged = index.get((today.year, today.month), ())
+    return [r for r in rules if r.due(today) and r.id not in logged]
+
+# --- 缺口與本月預算 ---
+def liquid_gap(assets, target):
+    return sum(assets.value(a) for a in LIQUID_ACCOUNTS) - target
+
+def month_budget(month, gap, kpi):
+    base = 97 if month == 2 else 2207
+    remaining = base + max(0, gap) - kpi["variable"]
+    pending = kpi["pending_revenue"] + kpi["pending_reimburse"]
+    return {"base_budget": base, "remaining": remaining, "pending_debt": pending, "potential_available": remaining + pending}
+
+def asset_key(name):
+    return str(name).strip().lower()
+
+def parse_amount(v):
+    # "12,000" → 12000；非數字回傳 None
+    try: return int(str(v).replace(',', ''))
+    except ValueError: return None
+
+# --- 資產登錄表 ---
+class Asset:
+    __slots__ = ("name", "row", "value")
+
+    def __init__(self, name: str, row: int, value):
+        self.name, self.row, self.value = name, row, value
+
+    def __repr__(self): return f"Asset({self.name!r}, {self.row!r}, {self.value!r})"
+
+class AssetRegistry:
+    # 資產總覽表：正規化名稱 (去空白、不分大小寫) → Asset (列號, 數值)；同名取第一列
+    # 每份快照建一次，之後的餘額讀取與增減都查這張表，不再掃描分頁
+    def __init__(self, index=None):
+        self.index = index or {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        index = {}
+        for i, r in enumerate(rows[1:]):
+            key = asset_key(r[0]) if r else ""
+            if key and key not in index: index[key] = Asset(str(r[0]).strip(), i + 2, parse_amount(r[1] if len(r) > 1 else ""))
+        return cls(index)
+
+    def copy(self):
+        return AssetRegistry({k: Asset(a.name, a.row, a.value) for k, a in self.index.items()})
+
+    def __contains__(self, name): return asset_key(name) in self.index
+
+    def rows(self): return {a.row for a in self.index.values()}
+
+    def row(self, name):
+        # 1-based 列號，找不到回傳 -1
+        a = self.index.get(asset_key(name))
+        return a.row if a else -1
+
+    def value(self, name, default=0):
+        a = self.index.get(asset_key(name))
+        return default if a is None or a.value is None else a.value
+
+    def set(self, name, value):
+        self.index[asset_key(name)].value = value
+
+# 明細篩選類別 → (是否報帳, 已入帳) 條件；純量與 Series 皆可用
+FILTER_RULES = {
+    "一般消費": lambda t, s: t == '否',
+    "報帳(未入)": lambda t, s: (t == '是') & (s == '未入帳'),
+    "報帳(已入)": lambda t, s: (t == '是') & (s == '已入帳'),
+    "收入(未入)": lambda t, s: (t == '收入') & (s == '未入帳'),
+    "收入(已入)": lambda t, s: (t == '收入') & (s == '已入帳'),
+    "固定收支": lambda t, s: (t == '固定') | (t == '固定收入'),
+}
+
+# --- 購物冷靜清單 ---
+SHOP_SHEET = "購物冷靜清單"
+SHOP_NUMBERS = ("預估價格", "想要程度")
+SHOP_NEW = {"想要程度": 3, "冷靜期限": "2026/07/01", "最終決策": "延後"}    # 新增願望沒填的欄位
+
+def number_column(s):
+    # 去千分位後轉整數，非數字為 0 (整欄一次轉換)
+    import pandas as pd
+    return pd.to_numeric(s.astype(str).str.replace(',', '', regex=False), errors='coerce').fillna(0).astype(int)
+
+def grid_changes(before, after, key, columns, numeric=()):
+    # 表格編輯前後的儲存格層級差異；key 欄是試算表列號 (新增的列為空)，numeric 欄位比較整數值
+    # → {"cells": [(列號, 欄名, 新值)], "appends": [{欄名: 值}], "deletes": [列號 (由小到大)]}
+    import pandas as pd
+    def norm(df):
+        out = pd.DataFrame(index=df.index)
+        for c in columns:
+            s = df[c] if c in df.columns else pd.Series("", index=df.index)
+            out[c] = number_column(s) if c in numeric else s.where(s.notna(), "").astype(str)
+        return out.astype(object)
+    rows = pd.to_numeric(after[key], errors='coerce')
+    kept = after[rows.notna()]
+    old, new = norm(before.set_index(before[key].astype(int))), norm(kept.set_index(rows[rows.notna()].astype(int)))
+    common = new.index.intersection(old.index)
+    diff = (new.loc[common] != old.loc[common]).stack()
+    to_py = lambda v: v.item() if hasattr(v, "item") else v
+    return {"cells": [(int(r), c, to_py(new.at[r, c])) for r, c in diff[diff].index],
+            "appends": [{c: to_py(v) for c, v in rec.items()} for rec in norm(after[rows.isna()]).to_dict("records")],
+            "deletes": sorted(int(r) for r in old.index.difference(new.index))}
+
+# --- 每月彙總 ---
+class MonthRollup:
+    # key: (年, 月, 是否報帳, 已入帳, 帳戶) → [金額合計, 實際消耗合計, 正的實際消耗合計, 筆數]
+    # 由日記帳建一次，之後新增 / 切換 / 刪除只做增量更新；KPI 查詢只看該月的少數幾組
+    def __init__(self):
+        self.groups = {}
+        self.months = {}
+        self.rows = 0
+
+    @classmethod
+    def from_journal(cls, df_log):
+        import pandas as pd
+        r = cls()
+        if df_log.empty: return r
+        amount = pd.to_numeric(df_log['金額'], errors='coerce').fillna(0)
+        spent = pd.to_numeric(df_log['實際消耗'], errors='coerce').fillna(0)
+        keys = pd.DataFrame({
+            "y": df_log['Year'], "m": df_log['Month'],
+            "t": df_log['是否報帳'].astype(str), "s": df_log['已入帳'].astype(str).str.strip(),
+            "a": df_log['項目'].map(account_of),
+            "amount": amount, "spent": spent, "pos": spent.clip(lower=0), "n": 1,
+        })
+        agg = keys.groupby(["y", "m", "t", "s", "a"], sort=False)[["amount", "spent", "pos", "n"]].sum()
+        for key, vals in zip(agg.index, agg.itertuples(index=False)):
+            key = (int(key[0]), int(key[1])) + tuple(key[2:])
+            r.groups[key] = [float(vals.amount), float(vals.spent), float(vals.pos), int(vals.n)]
+            r.months.setdefault(key[:2], set()).add(key)
+        r.rows = len(df_log)
+        return r
+
+    def apply(self, year, month, rec, sign=1):
+        # rec: 含 項目 / 金額 / 是否報帳 / 實際消耗 / 已入帳 的一列 (或 Transaction)；sign=-1 表示移除
+        if isinstance(rec, Transaction): rec = rec.record()
+        key = (int(year), int(month), str(rec['是否報帳']), str(rec['已入帳']).strip(), account_of(rec['項目']))
+        spent = to_num(rec['實際消耗'])
+        g = self.groups.setdefault(key, [0.0, 0.0, 0.0, 0])
+        g[0] += sign * to_num(rec['金額']); g[1] += sign * spent; g[2] += sign * max(spent, 0); g[3] += sign
+        if g[3] <= 0: del self.groups[key]; self.months.get(key[:2], set()).discard(key)
+        else: self.months.setdefault(key[:2], set()).add(key)
+        self.rows += sign
+
+    def month_groups(self, year, month):
+        return [(k, self.groups[k]) for k in self.months.get((year, month), ())]
+
+    def month_kpis(self, year, month):
+        variable = pending_rev = pending_reim = reim_cost = 0.0
+        for (_, _, t, s, _), (amount, spent, pos, _) in self.month_groups(year, month):
+            if t != '固定': variable += pos
+            if t == '收入' and s == '未入帳': pending_rev += amount
+            if t == '是' and s == '未入帳': pending_reim += amount; reim_cost += spent
+        return {"variable": int(variable), "pending_revenue": int(pending_rev), "pending_reimburse": int(pending_reim),
+                "real_self": int(variable) - int(reim_cost)}
+
+    def net_spent(self, year, month, filters=()):
+        # 實際消耗合計 (含收入抵銷)；filters 為 FILTER_RULES 的類別名稱
+        return sum(spent for (_, _, t, s, _), (_, spent, _, _) in self.month_groups(year, month)
+                   if not filters or any(FILTER_RULES[f](t, s) for f in filters))
+
+# --- 日記帳列範圍索引 ---
+class JournalIndex:
+    # (年, 月) → 該月在日記帳分頁的列範圍 [[起, 迄], ...] (1-based、含頭尾；匯入的舊帳附加在尾端，同一個月可能分成好幾段)
+    # last_row / tail：最後一列的列號與內容雜湊，載入時只抓這一列比對，就能發現分頁在外部被增刪
+    __slots__ = ("spans", "last_row", "tail", "built_at")
+
+    def __init__(self, spans=None, last_row=0, tail=None, built_at=0.0):
+        self.spans, self.last_row, self.tail, self.built_at = spans or {}, last_row, tail, built_at
+
+    def __repr__(self): return f"JournalIndex({len(self.spans)} 個月, last_row={self.last_row})"
+
+    @classmethod
+    def build(cls, first_row, months, tail=None, built_at=0.0):
+        # months: 由 first_row 起每個資料列的 (年, 月)，依列順序
+        from itertools import groupby
+        r = cls(last_row=first_row - 1, tail=tail, built_at=built_at)
+        for (y, m), run in groupby(months): r.append(y, m, sum(1 for _ in run))
+        return r
+
+    def copy(self):
+        return JournalIndex({k: [list(s) for s in v] for k, v in self.spans.items()}, self.last_row, self.tail, self.built_at)
+
+    def months(self):
+        return sorted(self.spans)
+
+    def rows(self, months):
+        # 指定月份的列範圍，依列號排序
+        return sorted(tuple(s) for m in months for s in self.spans.get(m, ()))
+
+    def append(self, year, month, n=1):
+        spans = self.spans.setdefault((int(year), int(month)), [])
+        if spans and spans[-1][1] == self.last_row: spans[-1][1] += n
+        else: spans.append([self.last_row + 1, self.last_row + n])
+        self.last_row += n
+
+    def delete(self, row):
+        # 刪除一列：所在範圍縮短一列，之後的範圍往上移
+        for key in list(self.spans):
+            out = []
+            for s, e in self.spans[key]:
+                if e < row: out.append([s, e])
+                elif s > row: out.append([s - 1, e - 1])
+                elif s < e: out.append([s, e - 1])
+            if out: self.spans[key] = out
+            else: del self.spans[key]
+        self.last_row -= 1
+
+    def to_dict(self):
+        return {"spans": [[y, m, s, e] for (y, m), v in self.spans.items() for s, e in v],
+                "last_row": self.last_row, "tail": self.tail, "built_at": self.built_at}
+
+    @classmethod
+    def from_dict(cls, d):
+        spans = {}
+        for y, m, s, e in d["spans"]: spans.setdefault((y, m), []).append([s, e])
+        return cls(spans, d["last_row"], d["tail"], d.get("built_at", 0.0))
+
+# --- 列 ID 索引 ---
+# 日記帳與購物冷靜清單的每一列帶一個新增時產生、之後不再變動的 ID (表頭為 ID_COLUMN 的欄)；
+# 列操作以 ID 指定，列號只是目前的位置：刪除列後修補索引 (之後的列號往上移)，新增列時登記
+ID_COLUMN = "ID"
+
+def new_id():
+    # 字母開頭：讀回時不會被 numericise 當成數字 (去掉前導 0 / 科學記號)
+    import uuid
+    return "r" + uuid.uuid4().hex[:11]
+
+class RowIds:
+    # col：ID 欄 (1-based，0 表示分頁沒有 ID 欄)；rows：ID → 列號 (1-based)
+    __slots__ = ("col", "rows")
+
+    def __init__(self, col=0, rows=None):
+        self.col, self.rows = col, rows or {}
+
+    def __repr__(self): return f"RowIds(col={self.col}, {len(self.rows)} 列)"
+
+    @classmethod
+    def from_rows(cls, rows, head):
+        # rows：整張分頁 (未載入的列為 None)，head：表頭所在列
+        header = rows[head - 1] if len(rows) >= head and rows[head - 1] else []
+        if ID_COLUMN not in header: return cls()
+        col = header.index(ID_COLUMN) + 1
+        ids = {}
+        for i in range(head, len(rows)):
+            r = rows[i]
+            if r is not None and len(r) >= col and str(r[col - 1]).strip(): ids.setdefault(str(r[col - 1]).strip(), i + 1)
+        return cls(col, ids)
+
+    def copy(self):
+        return RowIds(self.col, dict(self.rows))
+
+    def row(self, row_id):
+        # 找不到回傳 -1
+        return self.rows.get(str(row_id).strip(), -1)
+
+    def add(self, row_id, row):
+        if str(row_id).strip(): self.rows[str(row_id).strip()] = row
+
+    def delete(self, row, n=1):
+        # 刪除 row 起 n 列：這些列的 ID 移除，之後的列號往上移
+        self.rows = {k: r - n if r >= row + n else r for k, r in self.rows.items() if not row <= r < row + n}
+
+# --- 日記帳冷資料 (依年份封存) ---
+# 超過保留期的月份搬到「日記帳 年份」分頁；封存清單每列是一組月彙總 (與 MonthRollup 相同分組) 加上所在分頁
+ARCHIVE_COLUMNS = ["年", "月", "分頁", "是否報帳", "已入帳", "帳戶", "金額", "實際消耗", "正的實際消耗", "筆數"]
+
+def archive_months(months, today, keep):
+    # 可封存的月份：保留本月在內的最近 keep 個月，其餘都封存 (keep <= 0 表示不封存)
+    if keep <= 0: return []
+    cutoff = today.year * 12 + today.month - keep
+    return sorted(m for m in months if m[0] * 12 + m[1] <= cutoff)
+
+def manifest_rows(rollup, partition):
+    # MonthRollup → 封存清單的列；partition(年) 為該年的分頁名稱
+    return [[y, m, partition(y), t, s, a, amount, spent, pos, n] for (y, m, t, s, a), (amount, spent, pos, n) in rollup.groups.items()]
+
+class ArchiveManifest:
+    # 封存清單：rollup 為封存月份預先算好的彙總 (不必讀分頁就能查月統計)，
+    # partitions：(年, 月) → 分頁，counts：分頁 → 筆數 (分頁只在封存時變動，筆數即為快取版本)
+    __slots__ = ("rollup", "partitions", "counts")
+
+    def __init__(self):
+        self.rollup, self.partitions, self.counts = MonthRollup(), {}, {}
+
+    def __repr__(self): return f"ArchiveManifest({len(self.partitions)} 個月, {self.rollup.rows} 筆)"
+
+    @classmethod
+    def from_rows(cls, rows):
+        # 第一列為表頭；同一組出現多次 (同月分次封存) 就累加
+        r = cls()
+        for row in rows[1:]:
+            row = (list(row) + [""] * len(ARCHIVE_COLUMNS))[:len(ARCHIVE_COLUMNS)]
+            try: y, m, n = int(row[0]), int(row[1]), int(to_num(row[9]))
+            except ValueError: continue
+            if n <= 0: continue
+            key = (y, m, str(row[3]), str(row[4]).strip(), str(row[5]))
+            g = r.rollup.groups.setdefault(key, [0.0, 0.0, 0.0, 0])
+            g[0] += to_num(row[6]); g[1] += to_num(row[7]); g[2] += to_num(row[8]); g[3] += n
+            r.rollup.months.setdefault((y, m), set()).add(key)
+            r.rollup.rows += n
+            r.partitions[(y, m)] = row[2]
+            r.counts[row[2]] = r.counts.get(row[2], 0) + n
+        return r
+
+    def months(self):
+        return sorted(self.partitions)
+
+def dates_in_months(dates, years, months):
+    # 年月已由索引決定時，只需從「日期」取出日 (MM/DD 或完整日期皆可)
+    import pandas as pd
+    s = dates.astype(str).str.strip()
+    day = pd.to_datetime("2000/" + s, format="%Y/%m/%d", errors="coerce").dt.day
+    rest = day.isna()
+    day[rest] = pd.to_datetime(s[rest], format="mixed", errors="coerce").dt.day
+    year, month = pd.Series(years, index=dates.index), pd.Series(months, index=dates.index)
+    date = pd.to_datetime(pd.DataFrame({"year": year, "month": month, "day": day}), errors="coerce")
+    return pd.DataFrame({"Date": date, "Year": year.astype(int), "Month": month.astype(int)}, index=dates.index)
+
+# --- 日期解析 (向量化 + 推回年份) ---
+def parse_log_dates(dates, today):
+    # 日記帳的「日期」多為 MM/DD (不含年份)：先以固定格式一次解析 (補閏年 2000 讓 02/29 也能過)，
+    # 失敗的列才用 mixed 格式再試；年份則由列順序推回：月份倒退超過半年視為跨年，從最後一列 (今年或去年) 往前數
+    # (寫了完整日期的列自帶年份，不參與推算，例如匯入時附加在尾端的舊帳)
+    import pandas as pd
+    s = dates.astype(str).str.strip()
+    md = pd.to_datetime("2000/" + s, format="%Y/%m/%d", errors="coerce")
+    month, day = md.dt.month.astype(float), md.dt.day.astype(float)
+    rest = month.isna()
+    full = pd.to_datetime(s[rest], format="mixed", errors="coerce")
+    month[rest] = full.dt.month
+
+    m = month.mask(rest).ffill().fillna(today.month)
+    wrap = (m.shift() - m > 6).astype(int)
+    end_year = today.year - 1 if len(m) and m.iloc[-1] - today.month > 6 else today.year
+    year = end_year - (wrap[::-1].cumsum()[::-1] - wrap)
+    year[rest] = full.dt.year
+
+    date = pd.to_datetime(pd.DataFrame({"year": year, "month": month, "day": day}), errors="coerce")
+    date[rest] = full
+    # 完全無法解析的列沿用舊行為：歸在本月
+    return pd.DataFrame({"Date": date, "Year": year.fillna(today.year).astype(int), "Month": month.fillna(today.month).astype(int)}, index=dates.index)
@@ -0,0 +1,170 @@
+import json
+import sqlite3
+import threading
+import time
+from gspread.utils import absolute_range_name
+from sheet_ops import TableBook, apply_request, check_request, request_sheet_id, row_hash, touched_rows
+
+# --- 本地 SQLite 鏡像 ---
+# rows   : 上次從 Sheets 拉下來的內容 (遠端基準)
+# outbox : 尚未推送的 batch_update 請求，連同被修改列當時的內容雜湊 (以列身分偵測衝突)
+# 本地讀到的資料 = 遠端基準 + 依序重播 outbox
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheets (title TEXT PRIMARY KEY, sheet_id INTEGER NOT NULL, pos INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS rows (title TEXT NOT NULL, idx INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (title, idx));
+CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, requests TEXT NOT NULL, bases TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS conflicts (seq INTEGER PRIMARY KEY, created REAL NOT NULL, requests TEXT NOT NULL, reason TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+def replay(tables, titles, requests):
+    # 在受影響分頁的副本上依序套用，回傳 (新 tables, 每個被改/刪列套用前的雜湊)
+    for req in requests: check_request(titles, req)
+    staged = dict(tables)
+    staged.update({titles[sid]: [list(r) for r in tables[titles[sid]]] for sid in {request_sheet_id(r) for r in requests}})
+    bases = []
+    for req in requests:
+        for sid, i in touched_rows(req):
+            rows = staged[titles[sid]]
+            bases.append(row_hash(rows[i] if i < len(rows) else []))
+        apply_request(staged, titles, req)
+    return staged, bases
+
+class LocalStore(TableBook):
+    # 提供與 gspread.Spreadsheet 相同的讀寫介面，讀取全在本地；寫入立即生效並排入 outbox
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.changed = threading.Event()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        ids = dict(self.db.execute("SELECT title, sheet_id FROM sheets ORDER BY pos"))
+        base = {t: [] for t in ids}
+        for title, data in self.db.execute("SELECT title, data FROM rows ORDER BY title, idx"):
+            base.setdefault(title, []).append(json.loads(data))
+        super().__init__(base, ids)
+        self.version = int(self._meta("version", 0))
+        self.tables = self._replay_pending(self.tables)
+        self.db.commit()
+
+    def _meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _bump(self):
+        self.version += 1
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(self.version),))
+
+    def pending(self):
+        with self.lock:
+            return [(seq, json.loads(reqs), json.loads(bases)) for seq, reqs, bases in
+                    self.db.execute("SELECT seq, requests, bases FROM outbox ORDER BY seq")]
+
+    def conflicts(self):
+        with self.lock:
+            return [{"seq": seq, "created": created, "requests": json.loads(reqs), "reason": reason} for seq, created, reqs, reason in
+                    self.db.execute("SELECT seq, created, requests, reason FROM conflicts ORDER BY seq")]
+
+    def _replay_pending(self, tables):
+        titles = self.titles()
+        for seq, reqs, _ in self.pending():
+            try: tables, _ = replay(tables, titles, reqs)
+            except (ValueError, KeyError, IndexError) as e: self._mark_conflict(seq, f"無法重播：{e}")
+        return tables
+
+    def _mark_conflict(self, seq, reason):
+        self.db.execute("INSERT OR REPLACE INTO conflicts SELECT seq, created, requests, ? FROM outbox WHERE seq = ?", (reason, seq))
+        self.db.execute("DELETE FROM outbox WHERE seq = ?", (seq,))
+
+    # --- Spreadsheet 介面：寫入 ---
+    def batch_update(self, body):
+        with self.lock, self.db:
+            self.tables, bases = replay(self.tables, self.titles(), body["requests"])
+            self.db.execute("INSERT INTO outbox (created, requests, bases) VALUES (?, ?, ?)",
+                            (time.time(), json.dumps(body["requests"], ensure_ascii=False), json.dumps(bases)))
+            self._bump()
+        self.changed.set()
+        return {"replies": [{} for _ in body["requests"]]}
+
+    # --- 同步引擎使用 ---
+    def rebase(self, remote, ids):
+        # 以遠端最新內容為基準，重新套用尚未推送的請求
+        with self.lock, self.db:
+            self.ids = dict(ids)
+            self.db.execute("DELETE FROM sheets")
+            self.db.executemany("INSERT INTO sheets VALUES (?, ?, ?)", [(t, sid, i) for i, (t, sid) in enumerate(ids.items())])
+            for title, rows in remote.items():
+                self.db.execute("DELETE FROM rows WHERE title = ?", (title,))
+                self.db.executemany("INSERT INTO rows VALUES (?, ?, ?)", [(title, i, json.dumps(r, ensure_ascii=False)) for i, r in enumerate(rows)])
+            self.tables = self._replay_pending({t: [list(r) for r in rows] for t, rows in remote.items()})
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('last_pull', ?)", (str(time.time()),))
+            self._bump()
+
+    def finish(self, pushed, conflicted):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM outbox WHERE seq = ?", [(seq,) for seq in pushed])
+            for seq in conflicted: self._mark_conflict(seq, "遠端資料已被其他來源修改")
+
+class SyncEngine:
+    # 背景雙向同步：推送 outbox (先以列雜湊檢查衝突)，再拉回遠端最新內容
+    def __init__(self, store, connect, sheets, interval=30):
+        self.store, self.connect, self.sheets, self.interval = store, connect, list(sheets), interval
+        self.sh = None
+        self.last_sync, self.last_error = 0, ""
+        self.thread = None
+
+    def remote(self):
+        if self.sh is None: self.sh = self.connect()
+        return self.sh
+
+    def fetch(self):
+        sh = self.remote()
+        ids = self.store.ids if all(t in self.store.ids for t in self.sheets) else {ws.title: ws.id for ws in sh.worksheets()}
+        titles = [t for t in self.sheets if t in ids]
+        value_ranges = sh.values_batch_get([absolute_range_name(t) for t in titles]).get("valueRanges", []) if titles else []
+        return {t: vr.get("values", []) for t, vr in zip(titles, value_ranges)}, ids
+
+    def pull(self):
+        remote, ids = self.fetch()
+        self.store.rebase(remote, ids)
+
+    def push(self):
+        pending = self.store.pending()
+        tables, ids = self.fetch()
+        titles = {sid: t for t, sid in ids.items()}
+        send, pushed, conflicted = [], [], []
+        for seq, reqs, bases in pending:
+            try: staged, now = replay(tables, titles, reqs)
+            except (ValueError, KeyError, IndexError): staged, now = None, None
+            if now == bases:
+                tables = staged; send += reqs; pushed.append(seq)
+            else: conflicted.append(seq)
+        if send: self.remote().batch_update({"requests": send})
+        self.store.finish(pushed, conflicted)
+        self.pull()
+        return len(pushed)
+
+    def sync(self):
+        try:
+            if self.store.pending(): self.push()
+            else: self.pull()
+            self.last_sync, self.last_error = time.time(), ""
+        except Exception as e:
+            # 離線或連線失效：保留 outbox，下次重試並重新連線
+            self.sh, self.last_error = None, str(e)
+
+    def run(self):
+        while True:
+            self.store.changed.wait(self.interval)
+            self.store.changed.clear()
+            self.sync()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="sheet-sync", daemon=True)
+            self.thread.start()
+        return self
+
+    def status(self):
+        return {"pending": len(self.store.pending()), "conflicts": len(self.store.conflicts()),
+                "last_sync": self.last_sync, "last_error": self.last_error}
@@ -0,0 +1,56 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# --- 單次 rerun 的效能紀錄 ---
+# mark(名稱)：依序切換的頂層階段 (連線 → 快照 → KPI → 頁面 ...)
+# phase(名稱)：包住一段程式的區段，可出現在頂層階段之內 (例如各頁裡的 get_data)
+# 未開啟時所有方法都是空操作
+class RerunProfile:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.phases = []
+        self.api = {}
+        self.frames = {}
+        self.current = None
+        self.total_ms = None
+        self.lock = threading.Lock()
+
+    def mark(self, name=None):
+        if not self.enabled: return
+        now = time.perf_counter()
+        if self.current: self.phases.append({"phase": self.current[0], "ms": round((now - self.current[1]) * 1000, 2), "nested": False})
+        self.current = (name, now) if name else None
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        t = time.perf_counter()
+        try: yield
+        finally:
+            self.phases.append({"phase": name, "ms": round((time.perf_counter() - t) * 1000, 2), "nested": self.current is not None})
+
+    def api_call(self, method, ms, ok=True):
+        # QuotaClient 的監聽器：背景執行緒 (對帳 / 同步) 發出的呼叫也會記到當下這次 rerun
+        with self.lock:
+            s = self.api.setdefault(method, {"calls": 0, "ms": 0.0, "max_ms": 0.0, "errors": 0})
+            s["calls"] += 1; s["ms"] = round(s["ms"] + ms, 2); s["max_ms"] = max(s["max_ms"], round(ms, 2))
+            if not ok: s["errors"] += 1
+
+    def frame(self, name, df):
+        if self.enabled: self.frames[name] = {"rows": int(len(df)), "cols": int(len(df.columns))}
+
+    def finish(self):
+        self.mark(None)
+        self.total_ms = round((time.perf_counter() - self.t0) * 1000, 2)
+
+    def record(self, **extra):
+        return {"ts": self.started, "total_ms": self.total_ms, **extra, "phases": self.phases, "api": self.api, "frames": self.frames}
+
+def to_jsonl(records):
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
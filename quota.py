@@ -0,0 +1,179 @@
+import random
+import threading
+import time
+from gspread.exceptions import APIError
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+# --- Sheets API 配額 ---
+# 每位使用者每分鐘 60 次讀取 / 60 次寫入；BURST 為瞬間可連發的次數
+READ_PER_MIN = 60
+WRITE_PER_MIN = 60
+BURST = 10
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 32.0
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+def is_retryable(e, write=False):
+    # 寫入只在 429 (配額拒絕，請求沒有被套用) 時重送：逾時 / 連線中斷 / 5xx 時第一次可能已經寫入，
+    # 重送 appendCells 會多出重複的列
+    if isinstance(e, APIError): return e.code == 429 if write else e.code in RETRYABLE_CODES
+    return not write and isinstance(e, (RequestsConnectionError, Timeout))
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # 指數退避 + full jitter：0 ~ min(cap, base * 2^attempt) 之間隨機
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class TokenBucket:
+    def __init__(self, per_min, burst=BURST, sleep=time.sleep):
+        self.rate, self.capacity, self.sleep = per_min / 60, burst, sleep
+        self.tokens, self.updated = float(burst), time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        # 取一個 token，不足時等待補充；回傳等待秒數
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+class QuotaClient:
+    # 包住 gspread.Spreadsheet (或假工作簿)：讀寫各自限流、讀取 429 / 5xx、寫入 429 退避重送、
+    # 同時發出的相同讀取只送一次、等配額時的 batch_update 合併成一次，並依呼叫類型計數
+    def __init__(self, sh, read_per_min=READ_PER_MIN, write_per_min=WRITE_PER_MIN, burst=BURST,
+                 max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, sleep=time.sleep):
+        self.sh = sh
+        self.buckets = {"read": TokenBucket(read_per_min, burst, sleep), "write": TokenBucket(write_per_min, burst, sleep)}
+        self.max_retries, self.backoff_base, self.sleep = max_retries, backoff_base, sleep
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.inflight = {}
+        self.pending = None
+        # 監聽器：{key: fn(呼叫類型, 毫秒, 是否成功)}，效能分析模式用
+        self.listeners = {}
+
+    def __getattr__(self, name):
+        # title / id 等屬性直接轉給原本的 Spreadsheet
+        return getattr(self.sh, name)
+
+    def count(self, op, key, n=1):
+        with self.lock:
+            s = self.stats.setdefault(op, {"calls": 0, "retries": 0, "errors": 0, "coalesced": 0, "throttled": 0.0})
+            s[key] += n
+
+    def totals(self):
+        with self.lock:
+            out = {"calls": 0, "retries": 0, "errors": 0, "coalesced": 0, "throttled": 0.0}
+            for s in self.stats.values():
+                for k in out: out[k] += s[k]
+            return out
+
+    def notify(self, op, started, ok):
+        ms = (time.perf_counter() - started) * 1000
+        for fn in list(self.listeners.values()): fn(op, ms, ok)
+
+    def call(self, kind, op, fn):
+        for attempt in range(self.max_retries + 1):
+            self.count(op, "throttled", self.buckets[kind].take())
+            self.count(op, "calls")
+            t = time.perf_counter()
+            try:
+                result = fn()
+                self.notify(op, t, True)
+                return result
+            except Exception as e:
+                self.notify(op, t, False)
+                if not is_retryable(e, kind == "write") or attempt == self.max_retries:
+                    self.count(op, "errors")
+                    raise
+                self.count(op, "retries")
+                self.sleep(backoff_delay(attempt, self.backoff_base))
+
+    def shared(self, op, key, fn):
+        # 相同的讀取正在進行中 → 等它的結果，不另外送
+        with self.lock:
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader: flight = self.inflight[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not leader:
+            self.count(op, "coalesced")
+            flight["done"].wait()
+        else:
+            try: flight["result"] = self.call("read", op, fn)
+            except Exception as e: flight["error"] = e
+            finally:
+                with self.lock: del self.inflight[key]
+                flight["done"].set()
+        if flight["error"] is not None: raise flight["error"]
+        return flight["result"]
+
+    # --- Spreadsheet 介面 ---
+    def worksheets(self):
+        return [QuotaWorksheet(self, ws) for ws in self.shared("worksheets", ("worksheets",), self.sh.worksheets)]
+
+    def worksheet(self, title):
+        return QuotaWorksheet(self, self.shared("worksheet", ("worksheet", title), lambda: self.sh.worksheet(title)))
+
+    def values_batch_get(self, ranges, params=None):
+        key = ("values_batch_get", tuple(ranges), repr(params))
+        return self.shared("values_batch_get", key, lambda: self.sh.values_batch_get(ranges, params=params))
+
+    def add_worksheet(self, title, rows=1000, cols=26, index=None):
+        return QuotaWorksheet(self, self.call("write", "add_worksheet", lambda: self.sh.add_worksheet(title, rows=rows, cols=cols, index=index)))
+
+    def batch_update(self, body):
+        # 排隊等寫入配額時，其他執行緒送來的 batch_update 依到達順序併入同一次請求 (整批一起成功或失敗)
+        reqs = body["requests"]
+        with self.lock:
+            group, leader = self.pending, self.pending is None
+            if leader: group = self.pending = {"requests": [], "callers": 0, "done": threading.Event(), "result": None, "error": None}
+            start = len(group["requests"])
+            group["requests"] += reqs
+            group["callers"] += 1
+
+        def send():
+            with self.lock:
+                if self.pending is group: self.pending = None
+            return self.sh.batch_update({"requests": group["requests"]})
+
+        if not leader:
+            self.count("batch_update", "coalesced")
+            group["done"].wait()
+        else:
+            try: group["result"] = self.call("write", "batch_update", send)
+            except Exception as e: group["error"] = e
+            finally:
+                with self.lock:
+                    if self.pending is group: self.pending = None
+                group["done"].set()
+        if group["error"] is not None:
+            # 合併的請求被拒 (400 等)：整批都沒有套用，可能只是其中一位呼叫端的請求有誤 → 各自重送自己的部分
+            if group["callers"] > 1 and isinstance(group["error"], APIError) and not is_retryable(group["error"], write=True):
+                return self.call("write", "batch_update", lambda: self.sh.batch_update({"requests": reqs}))
+            raise group["error"]
+        result = group["result"] or {}
+        return {**result, "replies": result.get("replies", [])[start:start + len(reqs)]}
+
+class QuotaWorksheet:
+    # Worksheet 的讀寫方法同樣走限流與重試
+    WRITES = {"update_cell", "update_cells", "update", "batch_update", "append_row", "append_rows", "delete_rows", "clear"}
+    READS = {"get_all_values", "get_all_records", "get_values", "get", "batch_get", "row_values", "col_values", "cell", "acell", "find", "findall"}
+
+    def __init__(self, client, ws):
+        self.client, self.ws = client, ws
+
+    def __repr__(self): return f"<QuotaWorksheet {self.ws!r}>"
+
+    def __getattr__(self, name):
+        attr = getattr(self.ws, name)
+        kind = "write" if name in self.WRITES else "read" if name in self.READS else None
+        if kind is None or not callable(attr): return attr
+        return lambda *args, **kwargs: self.client.call(kind, name, lambda: attr(*args, **kwargs))
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import re
+from gspread.cell import Cell
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, absolute_range_name, fill_gaps, numericise_all, rowcol_to_a1, to_records
+
+# --- Sheets batch_update 子集 (updateCells / appendCells / deleteDimension) ---
+# 寫入端 (SheetBatch) 產生請求，本地端 (fake / SQLite 鏡像) 用同一套規則套用
+
+def cell_data(v):
+    # 與 update_cell / append_row 相同：數字寫成數值，其他寫成字串
+    v = v.item() if hasattr(v, "item") else v
+    if isinstance(v, bool): return {"userEnteredValue": {"boolValue": v}}
+    if isinstance(v, (int, float)): return {"userEnteredValue": {"numberValue": v}}
+    return {"userEnteredValue": {"stringValue": "" if v is None else str(v)}}
+
+def cell_value(c):
+    # 反向：轉回 values_batch_get 會讀到的字串
+    (kind, v), = c.get("userEnteredValue", {"stringValue": ""}).items()
+    if kind == "boolValue": return "TRUE" if v else "FALSE"
+    if kind == "numberValue": return str(int(v)) if float(v).is_integer() else str(v)
+    return str(v)
+
+def update_cells(sheet_id, row, col, values):
+    return {"updateCells": {"rows": [{"values": [cell_data(v) for v in values]}], "fields": "userEnteredValue",
+                            "start": {"sheetId": sheet_id, "rowIndex": row - 1, "columnIndex": col - 1}}}
+
+def update_column(sheet_id, row, col, values):
+    # 由 (row, col) 往下寫一欄
+    return {"updateCells": {"rows": [{"values": [cell_data(v)]} for v in values], "fields": "userEnteredValue",
+                            "start": {"sheetId": sheet_id, "rowIndex": row - 1, "columnIndex": col - 1}}}
+
+def append_cells(sheet_id, rows):
+    return {"appendCells": {"sheetId": sheet_id, "rows": [{"values": [cell_data(v) for v in r]} for r in rows], "fields": "userEnteredValue"}}
+
+def delete_rows(sheet_id, start, end=None):
+    return {"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": start - 1, "endIndex": end or start}}}
+
+def _set(rows, r, c, v):
+    while len(rows) <= r: rows.append([])
+    while len(rows[r]) <= c: rows[r].append("")
+    rows[r][c] = v
+
+def touched_rows(request):
+    # 回傳 (sheetId, 0-based 列號) 清單：用於以列身分偵測衝突
+    kind, body = next(iter(request.items()))
+    if kind == "updateCells":
+        s = body["start"]
+        return [(s["sheetId"], s["rowIndex"] + i) for i in range(len(body["rows"]))]
+    if kind == "deleteDimension":
+        g = body["range"]
+        return [(g["sheetId"], i) for i in range(g["startIndex"], g["endIndex"])]
+    return []
+
+def request_sheet_id(request):
+    kind, body = next(iter(request.items()))
+    if kind == "updateCells": return body["start"]["sheetId"]
+    if kind == "appendCells": return body["sheetId"]
+    if kind == "deleteDimension" and body["range"].get("dimension") == "ROWS": return body["range"]["sheetId"]
+    return None
+
+def check_request(titles, request):
+    if request_sheet_id(request) not in titles: raise ValueError(f"不支援的請求：{next(iter(request))}")
+
+def apply_request(tables, titles, request):
+    # tables: {title: rows}，titles: {sheetId: title}
+    kind, body = next(iter(request.items()))
+    if kind == "updateCells":
+        s = body["start"]; rows = tables[titles[s["sheetId"]]]
+        for i, r in enumerate(body["rows"]):
+            for j, c in enumerate(r.get("values", [])):
+                _set(rows, s["rowIndex"] + i, s["columnIndex"] + j, cell_value(c))
+    elif kind == "appendCells":
+        tables[titles[body["sheetId"]]].extend([cell_value(c) for c in r.get("values", [])] for r in body["rows"])
+    elif kind == "deleteDimension" and body["range"].get("dimension") == "ROWS":
+        g = body["range"]
+        del tables[titles[g["sheetId"]]][g["startIndex"]:g["endIndex"]]
+    else:
+        raise ValueError(f"不支援的請求：{kind}")
+
+def shift_rows(request, sheet_id, moved):
+    # 把請求中 sheet_id 分頁的列號依 moved {舊列號: 新列號} (1-based) 改寫；SheetBatch 的請求每個只涉及一列
+    kind, body = next(iter(request.items()))
+    if kind == "updateCells" and body["start"]["sheetId"] == sheet_id and body["start"]["rowIndex"] + 1 in moved:
+        return {kind: {**body, "start": {**body["start"], "rowIndex": moved[body["start"]["rowIndex"] + 1] - 1}}}
+    if kind == "deleteDimension" and body["range"]["sheetId"] == sheet_id and body["range"]["startIndex"] + 1 in moved:
+        new, g = moved[body["range"]["startIndex"] + 1], body["range"]
+        return {kind: {**body, "range": {**g, "startIndex": new - 1, "endIndex": new - 1 + g["endIndex"] - g["startIndex"]}}}
+    return request
+
+# --- 以 ID 核對列位置 ---
+# checks: [(分頁, 列號, ID 欄, ID)]；先一次讀回這幾格，對不上的分頁再讀整欄 ID 找新列號
+def read_ids(sh, columns):
+    # columns: {分頁: ID 欄} → {分頁: {ID: 列號}}
+    titles = sorted(columns)
+    letter = lambda col: rowcol_to_a1(1, col).rstrip("0123456789")
+    got = sh.values_batch_get([absolute_range_name(t, f"{letter(columns[t])}:{letter(columns[t])}") for t in titles]).get("valueRanges", [])
+    return {t: {str(v[0]).strip(): i + 1 for i, v in enumerate(vr.get("values", [])) if v and str(v[0]).strip()} for t, vr in zip(titles, got)}
+
+def locate_ids(sh, checks):
+    # 回傳 (moved {(分頁, 舊列號): 新列號}, missing [(分頁, 列號)])
+    if not checks: return {}, []
+    got = sh.values_batch_get([absolute_range_name(t, rowcol_to_a1(r, c)) for t, r, c, _ in checks]).get("valueRanges", [])
+    stale = [(t, r, c, i) for (t, r, c, i), vr in zip(checks, got) if str((vr.get("values") or [[""]])[0][0]).strip() != i]
+    if not stale: return {}, []
+    now = read_ids(sh, {t: c for t, _, c, _ in stale})
+    moved, missing = {}, []
+    for t, r, _, i in stale:
+        if i in now[t]: moved[(t, r)] = now[t][i]
+        else: missing.append((t, r))
+    return moved, missing
+
+def row_hash(row):
+    # 正規化後 (去千分位、去尾端空白格) 的列內容雜湊
+    norm = [str(v).replace(',', '').strip() for v in row]
+    while norm and not norm[-1]: norm.pop()
+    return hashlib.sha1(json.dumps(norm, ensure_ascii=False).encode()).hexdigest()[:16]
+
+def split_range(name):
+    # "'分頁'!A1:B2" → ("分頁", "A1:B2")
+    m = re.match(r"^'((?:[^']|'')*)'(?:!(.*))?$", name) or re.match(r"^([^!]*)(?:!(.*))?$", name)
+    return m.group(1).replace("''", "'"), m.group(2)
+
+def slice_range(rows, a1=None):
+    # 與 values.get 相同：去掉尾端空白列/欄
+    g = a1_range_to_grid_range(a1) if a1 else {}
+    r0, r1 = g.get("startRowIndex", 0), g.get("endRowIndex", len(rows))
+    c0, c1 = g.get("startColumnIndex", 0), g.get("endColumnIndex")
+    out = [list(r[c0:c1]) for r in rows[r0:r1]]
+    for r in out:
+        while r and r[-1] == "": r.pop()
+    while out and not out[-1]: out.pop()
+    return out
+
+# --- 記憶體工作簿：實作 app 用到的 gspread Spreadsheet / Worksheet 介面 ---
+class TableWorksheet:
+    def __init__(self, book, title, sheet_id):
+        self.book, self.title, self.id = book, title, sheet_id
+
+    def __repr__(self): return f"<TableWorksheet {self.title!r} id:{self.id}>"
+
+    @property
+    def rows(self):
+        self.book.reload()
+        return self.book.tables[self.title]
+
+    def get_all_values(self):
+        return fill_gaps([list(r) for r in self.rows]) if self.rows else [[]]
+
+    def get_all_records(self, head=1):
+        grid = self.get_all_values()
+        if grid == [[]]: return []
+        return to_records(grid[head - 1], [numericise_all(r) for r in grid[head:]])
+
+    def row_values(self, row):
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def cell(self, row, col):
+        try: value = self.rows[row - 1][col - 1]
+        except IndexError: value = None
+        return Cell(row, col, value)
+
+    def update_cell(self, row, col, value):
+        return self.book.batch_update({"requests": [update_cells(self.id, row, col, [value])]})
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values])
+
+    def append_rows(self, values, **kwargs):
+        return self.book.batch_update({"requests": [append_cells(self.id, values)]})
+
+    def delete_rows(self, start_index, end_index=None):
+        return self.book.batch_update({"requests": [delete_rows(self.id, start_index, end_index)]})
+
+class TableBook:
+    def __init__(self, tables=None, ids=None):
+        self.tables = {t: [list(map(str, r)) for r in rows] for t, rows in (tables or {}).items()}
+        self.ids = dict(ids or {})
+        for t in self.tables:
+            if t not in self.ids: self.ids[t] = max(self.ids.values(), default=0) + 1
+
+    def titles(self): return {sid: t for t, sid in self.ids.items()}
+
+    def worksheets(self):
+        self.reload()
+        return [TableWorksheet(self, t, self.ids[t]) for t in self.tables]
+
+    def worksheet(self, title):
+        self.reload()
+        if title not in self.tables: raise WorksheetNotFound(title)
+        return TableWorksheet(self, title, self.ids[title])
+
+    def add_worksheet(self, title, rows=1000, cols=26, index=None):
+        self.reload()
+        self.tables.setdefault(title, [])
+        self.ids.setdefault(title, max(self.ids.values(), default=0) + 1)
+        self.save()
+        return self.worksheet(title)
+
+    def values_batch_get(self, ranges, params=None):
+        self.reload()
+        out = []
+        for name in ranges:
+            title, a1 = split_range(name)
+            if title not in self.tables: raise WorksheetNotFound(title)
+            vr = {"range": absolute_range_name(title, a1), "majorDimension": "ROWS"}
+            values = slice_range(self.tables[title], a1)
+            if values: vr["values"] = values
+            out.append(vr)
+        return {"valueRanges": out}
+
+    def batch_update(self, body):
+        self.reload()
+        titles = self.titles()
+        # 先整批檢查再套用，與 Sheets 一樣不會只寫入一半
+        for req in body["requests"]: check_request(titles, req)
+        for req in body["requests"]: apply_request(self.tables, titles, req)
+        self.save()
+        return {"replies": [{} for _ in body["requests"]]}
+
+    # 子類別的持久化掛勾：讀寫前載入最新內容、寫入後保存
+    def reload(self): pass
+
+    def save(self): pass
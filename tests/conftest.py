@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 模組都在專案根目錄
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,129 @@
+import os
+import time
+from datetime import date
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+import workbook
+from fake_gspread import MEMORY_BOOKS, FakeSpreadsheet
+import pandas as pd
+from ledger import SELF_INSTALLMENT, TWD, BalanceCheckpoint, RecurringRule, Transaction, change_effects, merge_effects, month_effects
+from sheet_ops import update_cells
+from bench.synthetic import make_workbook
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BOOK = "memory:test-balances"
+
+@pytest.fixture(params=["direct", "queue"])
+def app(request, tmp_path, monkeypatch):
+    # 記憶體假工作簿 + 暫存的索引 / 快照 / 檢查點檔；直接寫入與經寫入佇列各跑一次
+    MEMORY_BOOKS.pop(BOOK, None)
+    FakeSpreadsheet.create(BOOK, make_workbook(90, date.today(), months=3))
+    monkeypatch.setenv("FINANCE_FAKE_WORKBOOK", BOOK)
+    for name, file in (("JOURNAL_INDEX_PATH", "index.json"), ("SNAPSHOT_FILE", "snapshot.parquet"), ("BALANCE_CHECKPOINT_PATH", "checkpoint.json")):
+        monkeypatch.setattr(workbook, name, str(tmp_path / file))
+    monkeypatch.setattr(workbook, "WRITE_JOURNAL", str(tmp_path / "write_journal.jsonl") if request.param == "queue" else "")
+    st.cache_data.clear(); st.cache_resource.clear()
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    at.run()
+    assert not at.exception
+    return at
+
+def sheet(cell):
+    # 寫入佇列送完才讀
+    end = time.time() + 10
+    while workbook.WRITE_JOURNAL and not workbook.write_queue(workbook.WRITE_JOURNAL).idle() and time.time() < end: time.sleep(0.01)
+    tables = FakeSpreadsheet(BOOK).tables
+    if cell == "B6": return int(tables["現況資金檢核"][5][1].replace(",", ""))
+    return int(next(r[1] for r in tables["資產總覽表"] if r[0] == cell).replace(",", ""))
+
+def page(at, name):
+    at.sidebar.radio[0].set_value(name).run()
+
+def button(at, key):
+    return next(b for b in at.button if b.key == key)
+
+def test_older_month_delete_survives_reload(app):
+    at = app
+    today = date.today()
+    page(at, "🗓️ 歷史帳本回顧")
+    older = [m for m in at.selectbox[0].options if m != f"{today.year}/{today.month:02d}"][-1]
+    at.selectbox[0].select_index(at.selectbox[0].options.index(older)).run()
+    # 上個月一筆台幣活存的一般支出
+    sel = at.selectbox(key="hist_sel")
+    i = next(i for i, o in enumerate(sel.options) if "(" not in o.split("  ")[1])
+    sel.select_index(i).run()
+    amount = int(sel.options[i].rsplit("$", 1)[1])
+    before = sheet(TWD)
+    next(b for b in at.button if b.key.startswith("hist_del_")).click().run()
+    assert not at.exception and sheet(TWD) == before + amount
+
+    # 重新整理後上個月不再載入；新的一筆支出要以刪除後的餘額為基準
+    page(at, "💸 隨手記帳 (本月)")
+    next(b for b in at.sidebar.button if "重新整理" in b.label).click().run()
+    at.text_input[0].input("測試"); at.number_input[0].set_value(10)
+    button(at, "FormSubmitter:add_txn-確認記帳").click().run()
+    assert not at.exception
+    assert sheet(TWD) == before + amount - 10 and sheet("B6") == sheet(TWD)
+
+# --- BalanceCheckpoint：寫入記進檢查點後，月份沒載入也不會退回 ---
+SEP, OCT, NOV = (2026, 9), (2026, 10), (2026, 11)
+
+def checkpoint():
+    return BalanceCheckpoint(0, {TWD: 100}, {OCT: {TWD: -30}}, {SEP, OCT})
+
+def test_record_in_baseline_month():
+    cp = checkpoint()
+    cp.record(OCT, {TWD: 5})
+    assert cp.replay({OCT: {TWD: -25}}, {SEP, OCT})[0] == {TWD: 105}
+    assert cp.replay({}, {SEP, OCT})[0] == {TWD: 105}
+
+def test_record_in_unadopted_month():
+    cp = checkpoint()
+    cp.record(SEP, {TWD: 5}, before={TWD: -7})
+    assert cp.effects[SEP] == {TWD: -2}
+    assert cp.replay({SEP: {TWD: -2}}, {SEP, OCT})[0] == cp.replay({}, {SEP, OCT})[0] == {TWD: 105}
+
+def test_record_without_before_is_adopted_on_load():
+    cp = checkpoint()
+    cp.record(SEP, {TWD: 5})
+    out, adopted = cp.replay({SEP: {TWD: -2}}, {SEP, OCT})
+    assert out == {TWD: 105} and adopted == {SEP: {TWD: -2}}
+
+def test_record_in_month_after_checkpoint():
+    cp = checkpoint()
+    cp.record(NOV, {TWD: 5}, before={TWD: -7})
+    assert cp.replay({NOV: {TWD: -2}}, {SEP, OCT, NOV})[0] == cp.replay({}, {SEP, OCT, NOV})[0] == {TWD: 98}
+
+def test_month_effects_match_balance_effect():
+    # 整欄計算的月份影響與逐筆 balance_effect 加總相同 (含自付分期、轉存定存、未入帳、報帳)
+    transfers = [RecurringRule("fd", "定存", "轉存定存", 1000, kind="transfer")]
+    rows = [(2026, 9, "午餐", 120, "否", "已入帳"), (2026, 9, "咖啡 (LPM)", 80, "否", "已入帳"), (2026, 9, "代墊", 300, "是", "未入帳"),
+            (2026, 9, "代墊", 200, "是", "已入帳"), (2026, 10, "薪水", 40000, "收入", "已入帳"), (2026, 10, "獎金 (郵局)", 500, "收入", "未入帳"),
+            (2026, 10, SELF_INSTALLMENT, 2110, "固定", "已入帳"), (2026, 10, "轉存定存 (LPM)", 1000, "固定", "已入帳"), (2026, 10, "電信費", 499, "固定", "")]
+    df = pd.DataFrame(rows, columns=["Year", "Month", "項目", "金額", "是否報帳", "已入帳"])
+    expected = {}
+    for (y, m, item, amount, kind, status) in rows:
+        txn = Transaction("", item, amount, kind, 0, status or "已入帳")
+        expected[(y, m)] = merge_effects(expected.get((y, m), {}), change_effects([(y, m, txn, 1)], transfers)[(y, m)])
+    assert month_effects(df, transfers) == expected
+
+def test_write_refused_when_sheet_balance_was_edited(app):
+    at = app
+    # 試算表上直接把台幣活存改掉
+    book = FakeSpreadsheet(BOOK)
+    row = next(i for i, r in enumerate(book.tables["資產總覽表"]) if r[0] == TWD)
+    book.batch_update({"requests": [update_cells(book.ids["資產總覽表"], row + 1, 2, [20000])]})
+    next(b for b in at.sidebar.button if "重新整理" in b.label).click().run()
+    at.text_input[0].input("測試"); at.number_input[0].set_value(10)
+    button(at, "FormSubmitter:add_txn-確認記帳").click().run()
+    assert not at.exception and any("與日記帳推算不一致" in e.value for e in at.error)
+    assert sheet(TWD) == 20000 and "測試" not in [r[1] for r in FakeSpreadsheet(BOOK).tables["流動支出日記帳"] if len(r) > 1]
+
+    # 以試算表為準之後可以寫入
+    page(at, "📊 資產與收支")
+    next(b for b in at.button if "以試算表為準" in b.label).click().run()
+    page(at, "💸 隨手記帳 (本月)")
+    at.text_input[0].input("測試"); at.number_input[0].set_value(10)
+    button(at, "FormSubmitter:add_txn-確認記帳").click().run()
+    assert not at.exception and sheet(TWD) == 19990
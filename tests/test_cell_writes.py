@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+import pytest
+import streamlit as st
+import workbook
+from sheet_ops import TableBook
+from workbook import cell_write_state, pending_cell, write_cell_if_changed
+
+STATUS = "現況資金檢核"
+
+@pytest.fixture
+def cell(monkeypatch):
+    # 資金檢核 B9 = 100 的工作簿 + 與它相同的快照；時間由 clock[0] 控制
+    st.cache_resource.clear()
+    clock = [1000.0]
+    monkeypatch.setattr(workbook, "time", SimpleNamespace(time=lambda: clock[0]))
+    book = TableBook({STATUS: [[""] * 2 for _ in range(8)] + [["缺口", "100"]]})
+    snapshot = {"version": 1, "values": {STATUS: [list(r) for r in book.tables[STATUS]]}}
+    return SimpleNamespace(ws=book.worksheet(STATUS), book=book, snapshot=snapshot, clock=clock,
+                           sheet=lambda: book.tables[STATUS][8][1], write=lambda v: write_cell_if_changed(book.worksheet(STATUS), snapshot, 9, 2, v, debounce=10))
+
+def test_deferred_write_reaches_sheet_after_window(cell):
+    assert cell.write(150) and cell.sheet() == "150"
+    cell.clock[0] += 3
+    # 視窗內：不寫，快照 (跨 session 共用) 仍是試算表上的值，待寫的值另外記著
+    assert not cell.write(170)
+    assert cell.sheet() == "150" and cell.snapshot["values"][STATUS][8][1] == 150 and pending_cell(STATUS, 9, 2) == 170
+    cell.clock[0] += 10
+    assert cell.write(170) and cell.sheet() == "170"
+    assert pending_cell(STATUS, 9, 2) is None and cell_write_state()["written"] == 2
+
+def test_unchanged_value_is_skipped(cell):
+    assert not cell.write(100)
+    assert cell.sheet() == "100" and cell_write_state()["skipped"] == 1 and pending_cell(STATUS, 9, 2) is None
+    # 寫過之後快照同步為新值 → 同一個值不再送出
+    assert cell.write(120) and not cell.write(120) and cell_write_state()["written"] == 1
+
+def test_write_inside_window_is_deferred(cell):
+    assert cell.write(150)
+    cell.clock[0] += 9.9
+    assert not cell.write(170) and cell.sheet() == "150" and pending_cell(STATUS, 9, 2) == 170
+    # 視窗內改回試算表上的值：待寫的值作廢
+    assert not cell.write(150) and pending_cell(STATUS, 9, 2) is None
+    cell.clock[0] += 1
+    assert not cell.write(150) and cell.sheet() == "150"
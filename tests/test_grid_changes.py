@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+from ledger import SHOP_NUMBERS, grid_changes
+
+HEADER = ["日期", "物品名稱", "預估價格", "想要程度", "備註"]
+
+def view():
+    # 快照轉出的表格：'列' 為試算表列號；numericise 會把純數字的備註讀成 int
+    return pd.DataFrame([[2, "10/01", "耳機", 1200, 3, "藍色"], [3, "10/02", "椅子", 3500, 4, 2024], [4, "10/03", "書", 450, 2, ""]],
+                        columns=["列"] + HEADER)
+
+def changes(edited):
+    return grid_changes(view(), edited, "列", HEADER, SHOP_NUMBERS)
+
+def test_unchanged_grid_has_no_changes():
+    edited = view()
+    # 編輯器回傳的值型別不同 (數字欄是字串 / 浮點、備註是字串) 也不算變動
+    edited["預估價格"] = ["1,200", 3500.0, "450"]
+    edited["備註"] = ["藍色", "2024", ""]
+    assert changes(edited) == {"cells": [], "appends": [], "deletes": []}
+
+def test_edited_cells_are_listed_by_row():
+    edited = view()
+    edited.loc[0, "預估價格"] = 999.0
+    edited.loc[2, "備註"] = "二手"
+    edited.loc[1, "想要程度"] = 5
+    out = changes(edited)
+    assert sorted(out["cells"]) == [(2, "預估價格", 999), (3, "想要程度", 5), (4, "備註", "二手")]
+    assert all(type(v) in (int, str) for _, _, v in out["cells"])
+
+def test_added_rows_get_defaults_and_deleted_rows_map_to_row_numbers():
+    edited = view().drop(index=[0, 2])
+    edited = pd.concat([edited, pd.DataFrame([{"列": None, "物品名稱": "檯燈", "預估價格": 800}])], ignore_index=True)
+    out = changes(edited)
+    # 沒填的數字欄為 0、文字欄為空字串 (之後由呼叫端套上新增願望的預設值)
+    assert out["appends"] == [{"日期": "", "物品名稱": "檯燈", "預估價格": 800, "想要程度": 0, "備註": ""}]
+    assert out["deletes"] == [2, 4] and out["cells"] == []
+
+def test_missing_values_are_coerced():
+    edited = view()
+    edited.loc[0, "預估價格"] = np.nan
+    edited.loc[1, "備註"] = None
+    out = changes(edited)
+    assert sorted(out["cells"]) == [(2, "預估價格", 0), (3, "備註", "")]
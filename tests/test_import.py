@@ -0,0 +1,47 @@
+from datetime import date
+import pandas as pd
+import pytest
+from ledger import LPM, guess_columns, import_entry, journal_keys, plan_import
+
+TODAY = date(2026, 10, 17)
+
+def plan(rows, header=("交易日期", "摘要", "金額"), **kw):
+    return plan_import([dict(zip(header, r)) for r in rows], guess_columns(header), today=TODAY, **kw)
+
+def test_guess_columns_matches_aliases():
+    assert guess_columns(["交易日期", " 摘要 ", "Amount", "備註"]) == {"日期": "交易日期", "項目": " 摘要 ", "金額": "Amount"}
+    # 兩欄式對帳單：沒有金額欄，支出 / 存入分開
+    assert guess_columns(["日期", "說明", "提款", "存入金額", "餘額"]) == {"日期": "日期", "項目": "說明", "支出": "提款", "存入": "存入金額"}
+
+def test_year_inferred_for_dates_without_year():
+    out = plan([["10/03", "午餐", "-120"], ["2025/12/30", "年貨", "-800"], ["09/28", "晚餐", "-200"], ["115/10/05", "早餐", "-60"]])
+    assert not out["errors"]
+    # 不含年份的以今年計；本月寫 MM/DD，其他月份寫完整日期，依日期排序
+    assert [(y, m, t.date) for y, m, t in out["entries"]] == [(2025, 12, "2025/12/30"), (2026, 9, "2026/09/28"), (2026, 10, "10/03"), (2026, 10, "10/05")]
+
+def test_existing_rows_are_skipped_once_per_copy():
+    log = pd.DataFrame({"Date": pd.to_datetime(["2026-10-03", "2026-10-03"]), "項目": ["午餐", "午餐"], "金額": [120, 120]})
+    existing = journal_keys(log)
+    # 日記帳已有兩筆、對帳單三筆：略過兩筆，第三筆照樣匯入
+    out = plan([["10/03", "午餐", "-120"]] * 3 + [["10/03", "午餐", "-130"]], existing=existing)
+    assert out["duplicates"] == 2 and [t.amount for _, _, t in out["entries"]] == [120, 130]
+    # 帳戶後綴也算在項目裡
+    assert plan([["10/03", "午餐", "-120"]], existing=existing, account=LPM)["duplicates"] == 0
+
+@pytest.mark.parametrize("kind, status, values", [
+    ("否", None, [120, "否", 120, "已入帳"]),
+    ("是", None, [120, "是", 120, "未入帳"]),
+    ("收入", None, [120, "收入", 0, "未入帳"]),
+    ("收入", "已入帳", [120, "收入", -120, "已入帳"]),
+    ("固定", None, [120, "固定", 0, "固定扣款"]),
+    ("固定收入", None, [120, "固定收入", 0, "已入帳"]),
+])
+def test_import_entry_status(kind, status, values):
+    assert import_entry("10/03", "薪水", 120, kind, status=status).values()[2:] == values
+
+def test_sign_decides_kind_without_kind_column():
+    out = plan([["10/03", "午餐", "-120"], ["10/05", "薪水", "30,000"]])
+    assert [t.values()[2:] for _, _, t in out["entries"]] == [[120, "否", 120, "已入帳"], [30000, "收入", -30000, "已入帳"]]
+    out = plan([["10/03", "午餐", "120", "是"], ["10/04", "房租", "100", "不明"], ["13/01", "x", "1", "否"]], header=("日期", "項目", "金額", "是否報帳"))
+    assert [t.values()[1:] for _, _, t in out["entries"]] == [["午餐", 120, "是", 120, "未入帳"]]
+    assert [line for line, _ in out["errors"]] == [3, 4]
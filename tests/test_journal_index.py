@@ -0,0 +1,54 @@
+import pytest
+import workbook
+from ledger import JournalIndex
+from sheet_ops import TableBook
+from workbook import JOURNAL, fetch_snapshot
+
+HEAD = [["宇毛的日記帳"], [], [], ["日期", "項目", "金額", "是否報帳", "實際消耗", "已入帳"]]
+
+def journal(*dates):
+    return HEAD + [[d, f"品項{i}", "100", "否", "100", "已入帳"] for i, d in enumerate(dates)]
+
+def test_build_splits_months_into_spans():
+    # 第 5 列起：9 月 2 列、10 月 2 列，之後附加匯入的 9 月舊帳 1 列
+    index = JournalIndex.build(5, [(2025, 9), (2025, 9), (2025, 10), (2025, 10), (2025, 9)])
+    assert index.spans == {(2025, 9): [[5, 6], [9, 9]], (2025, 10): [[7, 8]]}
+    assert index.last_row == 9 and index.months() == [(2025, 9), (2025, 10)]
+    assert index.rows([(2025, 10), (2025, 9)]) == [(5, 6), (7, 8), (9, 9)]
+    assert index.rows([(2024, 1)]) == []
+
+def test_append_and_delete_keep_spans_aligned():
+    index = JournalIndex.build(5, [(2025, 9), (2025, 9), (2025, 10)])
+    index.append(2025, 10)
+    index.append(2025, 9, 2)
+    assert index.spans == {(2025, 9): [[5, 6], [9, 10]], (2025, 10): [[7, 8]]} and index.last_row == 10
+    # 刪除第 6 列：9 月第一段縮短，之後的範圍往上移；刪光的月份移除
+    index.delete(6)
+    assert index.spans == {(2025, 9): [[5, 5], [8, 9]], (2025, 10): [[6, 7]]} and index.last_row == 9
+    for row in (7, 6): index.delete(row)
+    assert (2025, 10) not in index.spans and index.last_row == 7
+    assert JournalIndex.from_dict(index.to_dict()).to_dict() == index.to_dict()
+
+@pytest.fixture
+def book(tmp_path, monkeypatch):
+    monkeypatch.setattr(workbook, "JOURNAL_INDEX_PATH", str(tmp_path / "index.json"))
+    return TableBook({JOURNAL: journal("2025/09/01", "2025/09/15", "2025/10/02", "2025/10/20")})
+
+def test_indexed_fetch_reads_only_requested_months(book):
+    values, index, loaded = fetch_snapshot(book, [JOURNAL], None, [(2025, 10)])
+    assert index.spans == {(2025, 9): [[5, 6]], (2025, 10): [[7, 8]]} and loaded == {(2025, 10)}
+    values, again, loaded = fetch_snapshot(book, [JOURNAL], index, [(2025, 10)])
+    assert again is index and loaded == {(2025, 10)}
+    rows = values[JOURNAL]
+    assert rows[4] is None and rows[5] is None and [r[1] for r in rows[6:8]] == ["品項2", "品項3"]
+
+@pytest.mark.parametrize("change", ["append", "edit_last"])
+def test_index_rebuilt_when_tail_changed_elsewhere(book, change):
+    _, index, _ = fetch_snapshot(book, [JOURNAL], None, [(2025, 10)])
+    # 另一個寫入者在分頁尾端加了一列 / 改了最後一列：比對列對不上，整張重讀並重建索引
+    if change == "append": book.tables[JOURNAL].append(["2025/11/01", "新的", "50", "否", "50", "已入帳"])
+    else: book.tables[JOURNAL][-1][2] = "999"
+    values, rebuilt, _ = fetch_snapshot(book, [JOURNAL], index, [(2025, 10)])
+    assert rebuilt is not index and None not in values[JOURNAL]
+    assert rebuilt.last_row == len(book.tables[JOURNAL])
+    assert ((2025, 11) in rebuilt.spans) == (change == "append")
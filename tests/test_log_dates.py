@@ -0,0 +1,27 @@
+from datetime import date
+import pandas as pd
+from ledger import parse_log_dates
+
+def parse(dates, today):
+    out = parse_log_dates(pd.Series(dates), today)
+    return [d.strftime("%Y/%m/%d") if d == d else None for d in out["Date"]], out
+
+def test_year_inferred_across_year_boundary():
+    got, out = parse(["11/20", "12/31", "01/02", "02/14"], date(2026, 2, 20))
+    assert got == ["2025/11/20", "2025/12/31", "2026/01/02", "2026/02/14"]
+    assert list(out["Year"]) == [2025, 2025, 2026, 2026] and list(out["Month"]) == [11, 12, 1, 2]
+
+def test_last_row_after_today_belongs_to_last_year():
+    # 一月初還沒記帳：最後一列是 12 月，整段都是去年
+    got, _ = parse(["11/20", "12/05"], date(2026, 1, 10))
+    assert got == ["2025/11/20", "2025/12/05"]
+
+def test_full_dates_keep_their_year_and_skip_inference():
+    # 附加在尾端的舊帳 (完整日期) 不影響 MM/DD 列推回的年份
+    got, out = parse(["12/30", "01/05", "2024/06/01", "01/10", "2023-03-04"], date(2026, 1, 15))
+    assert got == ["2025/12/30", "2026/01/05", "2024/06/01", "2026/01/10", "2023/03/04"]
+    assert list(out["Year"]) == [2025, 2026, 2024, 2026, 2023]
+
+def test_unparseable_and_leap_day_rows():
+    got, out = parse(["02/29", "abc"], date(2028, 3, 1))
+    assert got == ["2028/02/29", None] and list(out["Year"]) == [2028, 2028] and list(out["Month"]) == [2, 3]
@@ -0,0 +1,170 @@
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from requests.exceptions import Timeout
+import quota
+from fake_gspread import api_error
+from quota import QuotaClient, TokenBucket, backoff_delay
+
+# --- 假的 Spreadsheet：依序丟出 errors 裡的例外，之後成功 ---
+class Book:
+    def __init__(self, errors=(), bad=None, gate=None):
+        self.errors, self.bad, self.gate = list(errors), bad, gate
+        self.sent, self.reads = [], 0
+
+    def values_batch_get(self, ranges, params=None):
+        self.reads += 1
+        if self.gate: self.gate.wait(5)
+        if self.errors: raise self.errors.pop(0)
+        return {"valueRanges": [{"range": r} for r in ranges]}
+
+    def batch_update(self, body):
+        self.sent.append(list(body["requests"]))
+        if self.errors: raise self.errors.pop(0)
+        if self.bad and self.bad in body["requests"]: raise api_error(400, "Invalid requests")
+        return {"replies": [{"n": r} for r in body["requests"]]}
+
+class Clock:
+    # time.monotonic / sleep 的替身：sleep 直接把時間往前推
+    def __init__(self): self.now, self.slept = 0.0, []
+    def monotonic(self): return self.now
+    def sleep(self, s):
+        self.slept.append(s)
+        self.now += s
+
+def client(book, **kw):
+    slept = []
+    return QuotaClient(book, sleep=slept.append, **kw), slept
+
+def wait_for(cond):
+    end = time.time() + 5
+    while not cond():
+        assert time.time() < end
+        time.sleep(0.005)
+
+# --- 退避重試 ---
+def test_backoff_delay_is_capped():
+    for attempt in range(12):
+        assert 0 <= backoff_delay(attempt, 1.0, 32.0) <= min(32.0, 2 ** attempt)
+
+def test_retries_429_then_succeeds():
+    book = Book([api_error(429), api_error(429)])
+    qc, slept = client(book)
+    assert qc.values_batch_get(["A!A1"])["valueRanges"] == [{"range": "A!A1"}]
+    assert book.reads == 3 and len(slept) == 2
+    assert qc.stats["values_batch_get"]["retries"] == 2 and qc.stats["values_batch_get"]["errors"] == 0
+
+def test_retry_cap():
+    book = Book([api_error(429)] * 10)
+    qc, slept = client(book, max_retries=3)
+    with pytest.raises(quota.APIError):
+        qc.batch_update({"requests": [{"x": 1}]})
+    assert len(book.sent) == 4 and len(slept) == 3
+    assert qc.stats["batch_update"]["errors"] == 1
+
+@pytest.mark.parametrize("code", [400, 403, 404])
+def test_non_retryable_passes_through(code):
+    book = Book([api_error(code, "bad")])
+    qc, slept = client(book)
+    with pytest.raises(quota.APIError) as e:
+        qc.values_batch_get(["A!A1"])
+    assert e.value.code == code and book.reads == 1 and slept == []
+
+def test_reads_retry_on_timeout_and_5xx():
+    book = Book([Timeout(), api_error(503, "unavailable")])
+    qc, slept = client(book)
+    qc.values_batch_get(["A!A1"])
+    assert book.reads == 3
+
+@pytest.mark.parametrize("error", [Timeout(), api_error(503, "unavailable")])
+def test_writes_do_not_retry_when_first_attempt_may_have_landed(error):
+    book = Book([error])
+    qc, slept = client(book)
+    with pytest.raises(type(error)):
+        qc.batch_update({"requests": [{"appendCells": {}}]})
+    assert len(book.sent) == 1 and slept == []
+
+# --- 合併 ---
+def test_identical_reads_are_sent_once():
+    gate = threading.Event()
+    book = Book(gate=gate)
+    qc, _ = client(book)
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(qc.values_batch_get(["A!A1"]))) for _ in range(3)]
+    threads[0].start()
+    wait_for(lambda: qc.inflight)
+    for t in threads[1:]: t.start()
+    wait_for(lambda: qc.stats.get("values_batch_get", {}).get("coalesced") == 2)
+    gate.set()
+    for t in threads: t.join()
+    assert book.reads == 1 and len(out) == 3 and all(o == out[0] for o in out)
+
+def hold_writes(qc):
+    # 寫入配額用完：第一個呼叫端在 take() 等，直到 gate 打開
+    gate, bucket = threading.Event(), qc.buckets["write"]
+    def sleep(s):
+        gate.wait(5)
+        bucket.tokens = 1.0
+    bucket.tokens, bucket.sleep = 0.0, sleep
+    return gate
+
+def coalesced_writes(qc, bodies):
+    gate, out = hold_writes(qc), {}
+    def write(i):
+        try: out[i] = qc.batch_update({"requests": bodies[i]})
+        except Exception as e: out[i] = e
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(len(bodies))]
+    threads[0].start()
+    wait_for(lambda: qc.pending is not None)
+    for t in threads[1:]: t.start()
+    wait_for(lambda: qc.pending is not None and qc.pending["callers"] == len(bodies))
+    gate.set()
+    for t in threads: t.join()
+    return out
+
+def test_batch_updates_are_coalesced_and_replies_sliced():
+    book = Book()
+    qc, _ = client(book)
+    out = coalesced_writes(qc, [[{"a": 1}], [{"b": 1}, {"b": 2}], [{"c": 1}]])
+    assert book.sent == [[{"a": 1}, {"b": 1}, {"b": 2}, {"c": 1}]]
+    assert out[0]["replies"] == [{"n": {"a": 1}}]
+    assert out[1]["replies"] == [{"n": {"b": 1}}, {"n": {"b": 2}}]
+    assert out[2]["replies"] == [{"n": {"c": 1}}]
+    assert qc.stats["batch_update"]["coalesced"] == 2
+
+def test_rejected_batch_is_split_per_caller():
+    book = Book(bad={"bad": 1})
+    qc, _ = client(book)
+    out = coalesced_writes(qc, [[{"a": 1}], [{"bad": 1}], [{"c": 1}]])
+    assert book.sent[0] == [{"a": 1}, {"bad": 1}, {"c": 1}]
+    assert sorted(map(str, book.sent[1:])) == sorted(map(str, [[{"a": 1}], [{"bad": 1}], [{"c": 1}]]))
+    assert out[0]["replies"] == [{"n": {"a": 1}}] and out[2]["replies"] == [{"n": {"c": 1}}]
+    assert isinstance(out[1], quota.APIError) and out[1].code == 400
+
+def test_single_caller_rejection_is_not_resent():
+    book = Book(bad={"bad": 1})
+    qc, _ = client(book)
+    with pytest.raises(quota.APIError):
+        qc.batch_update({"requests": [{"bad": 1}]})
+    assert len(book.sent) == 1
+
+# --- 限流 ---
+def test_token_bucket_pacing(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(quota, "time", SimpleNamespace(monotonic=clock.monotonic, perf_counter=time.perf_counter, sleep=clock.sleep))
+    bucket = TokenBucket(60, burst=3, sleep=clock.sleep)
+    waits = [bucket.take() for _ in range(6)]
+    # 先連發 burst 次，之後每秒一次
+    assert waits[:3] == [0, 0, 0]
+    assert all(w == pytest.approx(1.0) for w in waits[3:])
+    assert clock.now == pytest.approx(3.0)
+    clock.sleep(10)
+    assert [bucket.take() for _ in range(4)][:3] == [0, 0, 0]
+
+def test_client_counts_throttled_time(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(quota, "time", SimpleNamespace(monotonic=clock.monotonic, perf_counter=time.perf_counter, sleep=clock.sleep))
+    qc = QuotaClient(Book(), read_per_min=30, burst=1, sleep=clock.sleep)
+    for i in range(3): qc.values_batch_get([f"A!A{i}"])
+    assert qc.stats["values_batch_get"]["throttled"] == pytest.approx(4.0)
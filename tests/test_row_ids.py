@@ -0,0 +1,36 @@
+from ledger import RowIds
+from sheet_ops import TableBook, locate_ids
+
+SHOP = "購物冷靜清單"
+
+def shop():
+    return [["日期", "物品名稱", "ID"], ["10/01", "耳機", "r1"], ["10/02", "椅子", "r2"], ["10/03", "書", "r3"]]
+
+def test_from_rows_maps_ids_to_rows():
+    rows = shop()
+    rows[2] = None     # 未載入的列
+    ids = RowIds.from_rows(rows + [["10/04", "燈", " "]], 1)
+    assert ids.col == 3 and ids.rows == {"r1": 2, "r3": 4}
+    assert ids.row("r3") == 4 and ids.row("r2") == -1
+    assert RowIds.from_rows([["日期", "物品名稱"], ["10/01", "耳機"]], 1).col == 0
+
+def test_add_and_delete_shift_rows():
+    ids = RowIds.from_rows(shop(), 1)
+    ids.add("r4", 5)
+    copy = ids.copy()
+    ids.delete(2, 2)
+    assert ids.rows == {"r3": 2, "r4": 3} and copy.rows == {"r1": 2, "r2": 3, "r3": 4, "r4": 5}
+
+def test_locate_ids_follows_rows_moved_by_another_writer():
+    book = TableBook({SHOP: shop()})
+    checks = [(SHOP, 2, 3, "r1"), (SHOP, 4, 3, "r3")]
+    assert locate_ids(book, checks) == ({}, [])
+    # 另一個寫入者在表頭下插入兩列：列號整批往下移
+    book.tables[SHOP][1:1] = [["09/30", "雨傘", "r8"], ["09/29", "杯子", "r9"]]
+    assert locate_ids(book, checks) == ({(SHOP, 2): 4, (SHOP, 4): 6}, [])
+
+def test_locate_ids_reports_deleted_rows():
+    book = TableBook({SHOP: shop()})
+    del book.tables[SHOP][1]
+    moved, missing = locate_ids(book, [(SHOP, 2, 3, "r1"), (SHOP, 3, 3, "r2")])
+    assert moved == {(SHOP, 3): 2} and missing == [(SHOP, 2)]
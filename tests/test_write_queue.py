@@ -0,0 +1,67 @@
+from requests.exceptions import Timeout
+from sheet_ops import TableBook, append_cells, delete_rows, update_cells
+from write_queue import WriteQueue, next_group
+
+JOURNAL = "流動支出日記帳"
+
+class Flaky:
+    # 第一次 batch_update 已經寫入後才逾時
+    def __init__(self, book): self.book, self.sent = book, 0
+    def values_batch_get(self, ranges, params=None): return self.book.values_batch_get(ranges, params)
+    def batch_update(self, body):
+        self.sent += 1
+        out = self.book.batch_update(body)
+        if self.sent == 1: raise Timeout()
+        return out
+
+def test_append_is_not_duplicated_after_ambiguous_timeout(tmp_path):
+    book = TableBook({JOURNAL: [["日期", "ID"]]})
+    q, sh = WriteQueue(str(tmp_path / "wj.jsonl")), Flaky(book)
+    q.put([append_cells(book.ids[JOURNAL], [["10/01", "r1"]])], appended=[(JOURNAL, 2, "r1")])
+    try: q.drain(sh)
+    except Timeout: pass
+    assert q.depth() == 1
+    sent, failed, _ = q.drain(sh)
+    assert len(sent) == 1 and not failed and q.depth() == 0
+    assert book.tables[JOURNAL] == [["日期", "ID"], ["10/01", "r1"]] and sh.sent == 1
+
+def test_unfinished_commands_are_replayed_on_restart(tmp_path):
+    # 第一筆已送出 (done)、第二筆記入日誌後程序就中斷：重啟時只重送第二筆
+    book, path = TableBook({JOURNAL: [["日期", "ID"]]}), str(tmp_path / "wj.jsonl")
+    q = WriteQueue(path)
+    q.put([append_cells(book.ids[JOURNAL], [["10/01", "r1"]])], appended=[(JOURNAL, 2, "r1")])
+    q.drain(book)
+    q.put([append_cells(book.ids[JOURNAL], [["10/02", "r2"]])], appended=[(JOURNAL, 2, "r2")])
+    again = WriteQueue(path)
+    assert again.depth() == 1 and again.items[0]["replayed"] and again.seq == 2
+    sent, failed, _ = again.drain(book)
+    assert [it["seq"] for it in sent] == [2] and not failed and again.depth() == 0
+    assert book.tables[JOURNAL] == [["日期", "ID"], ["10/01", "r1"], ["10/02", "r2"]]
+    assert WriteQueue(path).depth() == 0
+
+def test_command_dropped_when_row_id_is_gone(tmp_path):
+    book = TableBook({JOURNAL: [["日期", "ID"], ["10/01", "r1"], ["10/02", "r2"]]})
+    sid, q = book.ids[JOURNAL], WriteQueue(str(tmp_path / "wj.jsonl"))
+    q.put([update_cells(sid, 2, 1, ["10/05"])], checks=[(JOURNAL, sid, 2, 2, "r1")])
+    q.put([update_cells(sid, 3, 1, ["10/06"])], checks=[(JOURNAL, sid, 3, 2, "r2")])
+    # 另一個寫入者刪掉 r1：r1 的命令放棄，r2 的命令改寫到上移後的列
+    del book.tables[JOURNAL][1]
+    sent, failed, moved = q.drain(book)
+    assert [it["seq"] for it in sent] == [2] and [it["seq"] for it in failed] == [1] and moved == {JOURNAL}
+    assert "第 2 列已在其他地方被刪除" in failed[0]["reason"] and q.status()["failed"][0]["seq"] == 1
+    assert book.tables[JOURNAL] == [["日期", "ID"], ["10/06", "r2"]]
+
+def test_next_group_stops_before_checks_that_depend_on_earlier_commands():
+    item = lambda seq, requests=(), checks=(), appended=(): {"seq": seq, "requests": list(requests), "checks": list(checks), "appended": list(appended)}
+    items = [item(1, [update_cells(7, 2, 1, ["a"])], [(JOURNAL, 7, 2, 2, "r1")]),
+             item(2, [append_cells(7, [["b", "r9"]])], appended=[(JOURNAL, 2, "r9")]),
+             item(3, [delete_rows(7, 3)], [(JOURNAL, 7, 3, 2, "r2")]),
+             item(4, [update_cells(8, 2, 1, ["c"])], [("其他", 8, 2, 2, "x1")]),
+             item(5, [update_cells(7, 4, 1, ["d"])], [(JOURNAL, 7, 4, 2, "r3")])]
+    # 同一分頁的刪除之後還要以 ID 核對的命令 (seq 5) 留到下一批；其他分頁的命令照樣合併
+    assert [it["seq"] for it in next_group(items)] == [1, 2, 3, 4]
+    assert [it["seq"] for it in next_group(items[4:])] == [5]
+    # 核對同一批前面才新增的列 → 分開送
+    later = items[:2] + [item(6, [update_cells(7, 5, 1, ["e"])], [(JOURNAL, 7, 5, 2, "r9")])]
+    assert [it["seq"] for it in next_group(later)] == [1, 2]
+    assert [it["seq"] for it in next_group(items, 1)] == [1]
@@ -0,0 +1,964 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+import pandas as pd
+import streamlit as st
+from gspread.utils import absolute_range_name, fill_gaps, numericise_all, to_records
+from ledger import ARCHIVE_COLUMNS, BALANCE_ACCOUNTS, GAP, ID_COLUMN, SHOP_SHEET, ArchiveManifest, AssetRegistry, BalanceCheckpoint, JournalIndex, MonthRollup, RowIds, archive_months, change_effects, dates_in_months, load_rules, logged_rule_index, manifest_rows, merge_effects, month_effects, new_id, parse_amount, parse_log_dates
+from sheet_ops import update_cells, update_column, append_cells, delete_rows, apply_request, cell_value, locate_ids, request_sheet_id, row_hash, touched_rows
+from write_queue import WriteQueue
+
+# --- 快照設定 ---
+# 一次 values_batch_get 把所有頁面會用到的分頁抓下來，rerun 時直接讀記憶體中的快照
+SNAPSHOT_TTL = 300
+CELL_WRITE_DEBOUNCE = 10
+SNAPSHOT_SHEETS = ["流動支出日記帳", "資產總覽表", "現況資金檢核", "未來四個月推估", "購物冷靜清單", "每月收支模型", "日記帳封存"]
+# FINANCE_DATA_DIR: 本地狀態檔 (日記帳索引、快照檔、餘額檢查點、寫入日誌) 的預設目錄；個別檔案仍可用各自的環境變數指定
+DATA_DIR = os.environ.get("FINANCE_DATA_DIR", tempfile.gettempdir())
+
+@st.cache_resource(ttl=SNAPSHOT_TTL)
+def get_worksheets(_sh):
+    # 一次 metadata 呼叫取得所有分頁，寫入時直接用，不必再 sh.worksheet()
+    return {ws.title: ws for ws in _sh.worksheets()}
+
+# --- 分頁讀取排程 ---
+# 平常所有分頁合併成一次 values_batch_get (一次往返、只算一次讀取配額)；整批失敗時 (例如某個分頁被刪除 / 改名，
+# Sheets 會讓整批 400) 改為各分頁個別讀取，在 FETCH_WORKERS 條執行緒上同時送出 (共用同一個連線與配額限流)，
+# 單一分頁失敗只影響該分頁。各分頁最近一次的讀取耗時 / 列數 / 錯誤記在 fetch_stats
+FETCH_WORKERS = 4
+SNAPSHOT_RETRY = 30
+
+@st.cache_resource
+def fetch_pool():
+    return ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="sheet-fetch")
+
+@st.cache_resource
+def fetch_stats():
+    return {"lock": threading.Lock(), "sheets": {}}
+
+def record_fetch(title, ms, rows, mode, error=""):
+    stats = fetch_stats()
+    with stats["lock"]:
+        stats["sheets"][title] = {"ms": round(ms, 2), "rows": rows, "mode": mode, "error": error, "at": time.time()}
+
+def fetch_report():
+    # {分頁: {ms, rows, mode (合併 / 個別), error, at}}
+    stats = fetch_stats()
+    with stats["lock"]: return {t: dict(v) for t, v in stats["sheets"].items()}
+
+def fetch_one(sh, title):
+    t = time.perf_counter()
+    value_ranges = sh.values_batch_get([absolute_range_name(title)]).get("valueRanges", [])
+    return (value_ranges[0].get("values", []) if value_ranges else []), (time.perf_counter() - t) * 1000
+
+def fetch_each(sh, titles):
+    # 各分頁同時讀取；失敗的分頁不放進結果 (畫面上視為空白分頁)，全部失敗才丟出第一個錯誤
+    futures = {t: fetch_pool().submit(fetch_one, sh, t) for t in titles}
+    values, first = {}, None
+    for t, future in futures.items():
+        try:
+            values[t], ms = future.result()
+            record_fetch(t, ms, len(values[t]), "個別")
+        except Exception as e:
+            first = first or e
+            record_fetch(t, 0, 0, "個別", str(e))
+    if not values and first is not None: raise first
+    return values
+
+def fetch_values(sh, titles):
+    if not titles: return {}
+    t = time.perf_counter()
+    try: value_ranges = sh.values_batch_get([absolute_range_name(t) for t in titles]).get("valueRanges", [])
+    except Exception:
+        if len(titles) == 1: raise
+        return fetch_each(sh, titles)
+    ms = (time.perf_counter() - t) * 1000
+    values = {t: vr.get("values", []) for t, vr in zip(titles, value_ranges)}
+    for title, rows in values.items(): record_fetch(title, ms, len(rows), "合併")
+    return values
+
+@st.cache_resource
+def snapshot_state():
+    # 跨 session 共用的快照：寫入成功後直接在記憶體套用 (樂觀更新)，再由背景執行緒與試算表對帳
+    # writes：本程序的寫入次數，對帳期間若又有寫入，抓回來的內容已過時就丟掉重抓
+    # rebuild：手動重新整理後，日記帳索引不沿用，整張重讀
+    return {"lock": threading.Lock(), "snapshot": None, "source": None, "loaded_at": 0,
+            "writes": 0, "reconciling": False, "rebuild": False, "book": None}
+
+# --- 日記帳：只讀需要的月份 ---
+# 日記帳是唯一會一直長大的分頁：快照只抓表頭與需要的月份 (預設本月)，其他列以 None 佔位、列號不變。
+# 列範圍索引 (ledger.JournalIndex) 在整張讀取時建立，之後隨寫入增量更新，並存到 JOURNAL_INDEX_PATH 跨程序沿用；
+# 每次載入順便抓索引的最後一列比對，對不上 (外部增刪列) 或超過 JOURNAL_INDEX_TTL 才整張重讀重建
+# FINANCE_JOURNAL_INDEX: 索引檔路徑
+JOURNAL = "流動支出日記帳"
+JOURNAL_HEAD = 4
+# 推算餘額用到的日記帳欄位 (balance_effect)
+EFFECT_COLUMNS = ('項目', '金額', '是否報帳', '已入帳')
+JOURNAL_INDEX_PATH = os.environ.get("FINANCE_JOURNAL_INDEX", os.path.join(DATA_DIR, "finance_journal_index.json"))
+JOURNAL_INDEX_TTL = 86400
+
+def journal_index_key(sh):
+    return f"{getattr(sh, 'title', '')}/{JOURNAL}"
+
+def read_journal_index(sh):
+    try:
+        with open(JOURNAL_INDEX_PATH, encoding="utf-8") as f: d = json.load(f).get(journal_index_key(sh))
+        return JournalIndex.from_dict(d) if d else None
+    except (OSError, ValueError, KeyError, TypeError): return None
+
+def save_journal_index(sh, index):
+    # index=None 表示作廢；寫不進去 (唯讀環境) 就只留在記憶體
+    try:
+        try:
+            with open(JOURNAL_INDEX_PATH, encoding="utf-8") as f: data = json.load(f)
+        except (OSError, ValueError): data = {}
+        if index is None: data.pop(journal_index_key(sh), None)
+        else: data[journal_index_key(sh)] = index.to_dict()
+        tmp = f"{JOURNAL_INDEX_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, JOURNAL_INDEX_PATH)
+    except OSError: pass
+
+def build_journal_index(rows):
+    # 整張讀取後建索引：年月沿用 parse_log_dates 依列順序推回的結果；表頭不完整 / 沒有「日期」欄就不建
+    if len(rows) < JOURNAL_HEAD: return None
+    df = records_frame(rows, JOURNAL_HEAD)
+    if not df.empty and '日期' not in df.columns: return None
+    dates = parse_log_dates(df['日期'], date.today()) if not df.empty else pd.DataFrame({"Year": [], "Month": []})
+    months = zip(dates['Year'].tolist(), dates['Month'].tolist())
+    return JournalIndex.build(JOURNAL_HEAD + 1, months, row_hash(rows[-1]), time.time())
+
+def fetch_snapshot(sh, titles, index=None, months=()):
+    # 回傳 (values, 日記帳索引, 已載入的月份)；日記帳有可用的索引就只抓表頭 / 比對列 / 指定月份，
+    # 否則整張讀取並重建索引 (表頭不完整等無法建索引時維持整張讀取)
+    if JOURNAL not in titles: return fetch_values(sh, titles), None, set()
+    others = [t for t in titles if t != JOURNAL]
+    if index is not None and index.last_row >= JOURNAL_HEAD and time.time() - index.built_at < JOURNAL_INDEX_TTL:
+        months = {m for m in months if m in index.spans}
+        spans = index.rows(months)
+        extra = [f"1:{JOURNAL_HEAD}", f"{index.last_row}:{index.last_row + 1}"] + [f"{s}:{e}" for s, e in spans]
+        ranges = [absolute_range_name(t) for t in others] + [absolute_range_name(JOURNAL, a1) for a1 in extra]
+        t = time.perf_counter()
+        try: got = [vr.get("values", []) for vr in sh.values_batch_get(ranges).get("valueRanges", [])]
+        except Exception:
+            # 整批失敗：改走整張讀取 (逐分頁隔離錯誤)
+            return fetch_snapshot(sh, titles, None, months)
+        ms = (time.perf_counter() - t) * 1000
+        values = dict(zip(others, got))
+        for title, rows in values.items(): record_fetch(title, ms, len(rows), "合併")
+        head, tail, parts = got[len(others)], got[len(others) + 1], got[len(others) + 2:]
+        if len(tail) == 1 and row_hash(tail[0]) == index.tail:
+            rows = (head + [[]] * JOURNAL_HEAD)[:JOURNAL_HEAD] + [None] * (index.last_row - JOURNAL_HEAD)
+            # 回應會省略尾端的空白列，補回成空列
+            for (s, e), part in zip(spans, parts): rows[s - 1:e] = (part + [[]] * (e - s + 1))[:e - s + 1]
+            values[JOURNAL] = rows
+            record_fetch(JOURNAL, ms, sum(e - s + 1 for s, e in spans), "合併")
+            return values, index, months
+        values.update(fetch_values(sh, [JOURNAL]))
+    else:
+        values = fetch_values(sh, titles)
+    if JOURNAL not in values: return values, None, set()
+    index = build_journal_index(values[JOURNAL])
+    save_journal_index(sh, index)
+    return values, index, {m for m in months if index and m in index.spans}
+
+def load_snapshot(sh, version=0, months=()):
+    # version：本地鏡像的資料版本，背景同步拉到新資料時重新讀取
+    # months：日記帳至少要載入的 (年, 月)
+    # 程序剛啟動時先用本地快照檔 (不等 API)，背景再對帳；寫入佇列還有命令時先等送完 (TTL 到期則延後重新載入)
+    state = snapshot_state()
+    from_disk = fetched = None
+    if state["snapshot"] is None or state["source"] != version: settle_writes()
+    with state["lock"]:
+        snap = state["snapshot"]
+        if snap is None and state["source"] is None and not state["rebuild"]:
+            snap = read_snapshot_file(sh, version)
+            if snap is not None:
+                state["snapshot"], state["source"], state["loaded_at"], state["book"], from_disk = snap, version, time.time(), sh, True
+        if snap is None or state["source"] != version or (time.time() - state["loaded_at"] > SNAPSHOT_TTL and not writes_pending()):
+            titles = [t for t in SNAPSHOT_SHEETS if t in get_worksheets(sh)]
+            index = None if state["rebuild"] else snap.get("journal") if snap else read_journal_index(sh)
+            values, index, loaded = fetch_snapshot(sh, titles, index, months)
+            state["snapshot"] = {"version": time.time_ns(), "values": values, "journal": index, "months": loaded}
+            state["source"], state["loaded_at"], state["rebuild"], state["book"] = version, time.time(), False, sh
+            # 有分頁讀取失敗：SNAPSHOT_RETRY 秒後就重新載入，不等 TTL
+            if len(values) < len(titles): state["loaded_at"] -= SNAPSHOT_TTL - SNAPSHOT_RETRY
+            fetched = state["snapshot"]
+    if fetched: save_snapshot_file(sh, fetched, version)
+    if from_disk: reconcile_snapshot(sh, [t for t in SNAPSHOT_SHEETS if t in snap["values"]])
+    return load_journal_months(sh, months)
+
+def load_journal_months(sh, months):
+    # 補抓快照還沒有的月份 (歷史 / 匯入頁)，成為新版本快照；之後重新載入時只保留 load_snapshot 指定的月份
+    state = snapshot_state()
+    with state["lock"]:
+        snap = state["snapshot"]
+        index = snap.get("journal") if snap else None
+        need = {m for m in months if m in index.spans} - snap["months"] if index else set()
+        if not need: return snap
+        rows = snap["values"][JOURNAL]
+        missing = [(s, e) for s, e in index.rows(need) if any(r is None for r in rows[s - 1:e])]
+        if missing:
+            rows = list(rows)
+            got = sh.values_batch_get([absolute_range_name(JOURNAL, f"{s}:{e}") for s, e in missing]).get("valueRanges", [])
+            for (s, e), vr in zip(missing, got): rows[s - 1:e] = (vr.get("values", []) + [[]] * (e - s + 1))[:e - s + 1]
+        # 日記帳的列 ID 索引只涵蓋原本載入的列，交給 row_ids 依新內容重建
+        ids = {t: v for t, v in snap.get("ids", {}).items() if t != JOURNAL}
+        state["snapshot"] = {**snap, "version": time.time_ns(), "values": {**snap["values"], JOURNAL: rows}, "months": snap["months"] | need, "ids": ids}
+        return state["snapshot"]
+
+def journal_months(snapshot):
+    # 日記帳有資料的所有 (年, 月) (含已封存的月份)，不必載入內容
+    index = snapshot.get("journal")
+    if index is not None: hot = index.months()
+    else:
+        df = journal_frame(snapshot)
+        hot = list(zip(df['Year'], df['Month'])) if not df.empty else []
+    return sorted(set(hot) | set(archive_manifest(snapshot).months()))
+
+def journal_frame(snapshot, months=None):
+    # 已載入月份的日記帳 → DataFrame (含 Date / Year / Month；index = 列號 - 5，與整張讀取時相同)
+    # 沒有索引時 (表頭不完整) 退回整張轉換 + 依列順序推回年份
+    rows, index = snapshot["values"].get(JOURNAL), snapshot.get("journal")
+    if not rows: return pd.DataFrame()
+    if index is None:
+        df = records_frame(rows, JOURNAL_HEAD)
+        if not df.empty and '日期' in df.columns: df[['Date', 'Year', 'Month']] = parse_log_dates(df['日期'], date.today())
+        return df
+    picked, years, mons = journal_picks(snapshot, months)
+    df = records_frame(rows[:JOURNAL_HEAD] + [rows[r - 1] or [] for r in picked], JOURNAL_HEAD)
+    if df.empty: return df
+    df.index = [r - JOURNAL_HEAD - 1 for r in picked]
+    df[['Date', 'Year', 'Month']] = dates_in_months(df['日期'], years, mons)
+    return df
+
+def journal_picks(snapshot, months=None):
+    # 已載入月份 (或其中的 months) 的列號，與各列的年、月 (依列順序)
+    picked, years, mons = [], [], []
+    for (y, m), s, e in sorted(((k, s, e) for k in (snapshot["months"] if months is None else months) for s, e in snapshot["journal"].spans.get(k, ())), key=lambda x: x[1]):
+        picked += range(s, e + 1); years += [y] * (e - s + 1); mons += [m] * (e - s + 1)
+    return picked, years, mons
+
+def effect_frame(snapshot):
+    # 算餘額只用到的欄位 (年月來自索引)：不轉整張表、不解析日期；沒有索引時同 journal_frame
+    rows = snapshot["values"].get(JOURNAL)
+    if not rows or snapshot.get("journal") is None: return journal_frame(snapshot)
+    picked, years, mons = journal_picks(snapshot)
+    pos = {k: i for i, k in enumerate(fill_gaps(rows[:JOURNAL_HEAD])[JOURNAL_HEAD - 1])}
+    picked = [rows[r - 1] or [] for r in picked]
+    if not picked: return pd.DataFrame()
+    cols = {c: [r[pos[c]] if pos[c] < len(r) else "" for r in picked] for c in EFFECT_COLUMNS if c in pos}
+    # 金額與 records_frame 一樣數字化 ("1,000" → 1000)；其他欄只當文字比對
+    if '金額' in cols: cols['金額'] = numericise_all(cols['金額'])
+    return pd.DataFrame({**cols, 'Year': years, 'Month': mons})
+
+def drop_snapshot(rebuild=False):
+    # 快照的列號已過時 (其他地方增刪過列)：作廢，下一次 rerun 重新載入；rebuild：日記帳的列有位移，索引整張重建
+    state = snapshot_state()
+    with state["lock"]: state.update(snapshot=None, writes=state["writes"] + 1, rebuild=state["rebuild"] or rebuild)
+
+def invalidate_snapshot():
+    # 手動重新整理：下一次 rerun 重新抓取，日記帳索引也整張重建
+    with snapshot_state()["lock"]: snapshot_state().update(snapshot=None, rebuild=True)
+
+def journal_after(snap, values, requests, titles, months):
+    # 寫入後的日記帳索引：依請求順序套用新增 / 刪除列；months 為新增列的 (年, 月)，數量不符就回傳 None (改為重新載入)
+    index = snap.get("journal")
+    if index is None: return None, snap["months"]
+    index, loaded, months = index.copy(), set(snap["months"]), list(months or ())
+    for req in requests:
+        kind, body = next(iter(req.items()))
+        if kind == "appendCells" and titles.get(body["sheetId"]) == JOURNAL:
+            for _ in body["rows"]:
+                ym = months.pop(0) if months else None
+                if ym is None: return None, loaded
+                if ym not in index.spans: loaded.add(ym)
+                index.append(*ym)
+        elif kind == "deleteDimension" and titles.get(body["range"]["sheetId"]) == JOURNAL:
+            for _ in range(body["range"]["startIndex"], body["range"]["endIndex"]): index.delete(body["range"]["startIndex"] + 1)
+    rows = values[JOURNAL]
+    if len(rows) != index.last_row or rows[-1] is None: return None, loaded
+    index.tail = row_hash(rows[-1])
+    return index, loaded
+
+def ids_after(snap, requests, titles):
+    # 寫入後的列 ID 索引：依請求順序登記新增列 / 補上的 ID、刪除列後修補列號；
+    # 還沒有 ID 欄的分頁不沿用 (補上表頭後由 row_ids 重建)
+    ids = {t: v.copy() for t, v in snap.get("ids", {}).items() if v.col}
+    lengths = {t: len(snap["values"].get(t, [])) for t in ids}
+    for req in requests:
+        kind, body = next(iter(req.items()))
+        t = titles.get(request_sheet_id(req))
+        if t not in ids: continue
+        if kind == "updateCells":
+            j = ids[t].col - 1 - body["start"]["columnIndex"]
+            for i, r in enumerate(body["rows"]):
+                cells = r.get("values", [])
+                if 0 <= j < len(cells): ids[t].add(cell_value(cells[j]), body["start"]["rowIndex"] + i + 1)
+        elif kind == "appendCells":
+            for r in body["rows"]:
+                lengths[t] += 1
+                cells = r.get("values", [])
+                if ids[t].col and len(cells) >= ids[t].col: ids[t].add(cell_value(cells[ids[t].col - 1]), lengths[t])
+        elif kind == "deleteDimension":
+            g = body["range"]
+            ids[t].delete(g["startIndex"] + 1, g["endIndex"] - g["startIndex"])
+            lengths[t] -= g["endIndex"] - g["startIndex"]
+    return ids
+
+def apply_to_snapshot(requests, titles, assets=None, journal_months=None):
+    # 把剛送出的 batch_update 套用到快照副本 (titles: {sheetId: 分頁名})，rerun 不必重抓；
+    # assets：批次內已增量更新好的資產登錄表，直接沿用不重建
+    # journal_months：新增到日記帳的每一列的 (年, 月)，用來增量更新列範圍索引；回傳新的索引
+    state = snapshot_state()
+    with state["lock"]:
+        snap = state["snapshot"]
+        state["writes"] += 1
+        if snap is None: return None
+        values = dict(snap["values"])
+        for sid in {request_sheet_id(r) for r in requests}:
+            t = titles.get(sid)
+            # 日記帳很長：只複製會改到的列，其他列與舊快照共用
+            if t == JOURNAL: values[t] = list(values[t])
+            elif t in values: values[t] = [list(r) for r in values[t]]
+        journal = values.get(JOURNAL)
+        for req in requests:
+            for sid, i in touched_rows(req):
+                if titles.get(sid) == JOURNAL and i < len(journal) and journal[i] is not None: journal[i] = list(journal[i])
+        try:
+            for req in requests: apply_request(values, titles, req)
+        except (KeyError, ValueError, IndexError, TypeError):
+            state["snapshot"] = None
+            return None
+        index, loaded = journal_after(snap, values, requests, titles, journal_months)
+        if index is None and snap.get("journal") is not None:
+            # 索引跟不上 (例如不知道新增列的月份)：重新載入
+            state["snapshot"] = None
+            return None
+        state["snapshot"] = {"version": time.time_ns(), "values": values, "journal": index, "months": loaded,
+                             "ids": ids_after(snap, requests, titles)}
+        if assets is not None: state["snapshot"]["assets"] = assets
+        return index
+
+def reconcile_snapshot(sh, titles):
+    # 背景重新抓取 (日記帳同樣只抓已載入的月份) 並取代樂觀快照；內容相同就保留原版本，衍生快取 (月彙總等) 不必重算
+    state = snapshot_state()
+    with state["lock"]:
+        if state["reconciling"]: return
+        state["reconciling"] = True
+
+    def run():
+        try:
+            while True:
+                # 佇列還有命令：讀回的內容會少了這些寫入，交給佇列送空後再對帳
+                if writes_pending(): return
+                with state["lock"]:
+                    writes, snap = state["writes"], state["snapshot"]
+                index, months = (snap.get("journal"), snap["months"]) if snap else (read_journal_index(sh), set())
+                values, index, loaded = fetch_snapshot(sh, titles, index, months)
+                with state["lock"]:
+                    if writes != state["writes"]: continue
+                    snap = state["snapshot"]
+                    if snap is None or snap["values"] != values:
+                        state["snapshot"] = {"version": time.time_ns(), "values": values, "journal": index, "months": loaded}
+                    state["loaded_at"] = time.time()
+                    snap, source = state["snapshot"], state["source"]
+                save_snapshot_file(sh, snap, source)
+                return
+        except Exception:
+            # 對帳失敗 (離線 / 配額)：保留樂觀快照，TTL 到期或下一次寫入再試
+            pass
+        finally:
+            with state["lock"]: state["reconciling"] = False
+
+    threading.Thread(target=run, name="snapshot-reconcile", daemon=True).start()
+
+# --- 本地快照檔 (Parquet) ---
+# 程序重啟 / 快取清空後，第一次渲染直接用上次存下的快照 (不等 API)，背景對帳後有變動再重跑；
+# 所有分頁存成一個長表 (分頁, 列號, c0..cN)，日記帳只存表頭與已載入的月份，其餘列還原成 None 佔位。
+# 欄位維持 API 讀回的字串 (與 values_batch_get 相同)，轉型仍交給 records_frame；
+# 中繼資料：工作簿名稱、資料來源版本、快照版本、日記帳索引、已載入月份、各分頁列數
+# FINANCE_SNAPSHOT_FILE: 快照檔路徑 (空字串表示停用)
+SNAPSHOT_FILE = os.environ.get("FINANCE_SNAPSHOT_FILE", os.path.join(DATA_DIR, "finance_snapshot.parquet"))
+SNAPSHOT_FILE_TTL = 7 * 86400
+SNAPSHOT_SETTLE_TIMEOUT = 30
+
+def save_snapshot_file(sh, snap, source):
+    # 寫不進去 (唯讀環境) 就略過，下次啟動照常從 API 讀取
+    if not SNAPSHOT_FILE or snap is None: return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    index = snap.get("journal")
+    keep = set(range(JOURNAL_HEAD)) | {r - 1 for s, e in index.rows(snap["months"]) for r in range(s, e + 1)} if index else None
+    sheets, nums, cells = [], [], []
+    for title, rows in snap["values"].items():
+        for i, row in enumerate(rows):
+            if row is None or (title == JOURNAL and keep is not None and i not in keep): continue
+            sheets.append(title); nums.append(i); cells.append(row)
+    width = max((len(r) for r in cells), default=0)
+    cols = {"sheet": pa.array(sheets, pa.string()).dictionary_encode(), "row": pa.array(nums, pa.int32())}
+    for j in range(width): cols[f"c{j}"] = pa.array([str(r[j]) if j < len(r) else None for r in cells], pa.string())
+    meta = {"book": getattr(sh, "title", ""), "source": source, "version": snap["version"], "saved_at": time.time(),
+            "lengths": {t: len(rows) for t, rows in snap["values"].items()},
+            "journal": index.to_dict() if index else None, "months": sorted(snap["months"])}
+    table = pa.table(cols).replace_schema_metadata({"finance": json.dumps(meta, ensure_ascii=False)})
+    tmp = f"{SNAPSHOT_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        pq.write_table(table, tmp)
+        os.replace(tmp, SNAPSHOT_FILE)
+    except OSError: pass
+
+def read_snapshot_file(sh, source):
+    # 工作簿 / 資料來源版本不符、超過 SNAPSHOT_FILE_TTL 或讀取失敗就回傳 None
+    if not SNAPSHOT_FILE or not os.path.exists(SNAPSHOT_FILE): return None
+    import pyarrow.parquet as pq
+    try:
+        table = pq.read_table(SNAPSHOT_FILE, memory_map=True)
+        meta = json.loads(table.schema.metadata[b"finance"])
+    except (OSError, ValueError, KeyError, TypeError): return None
+    if meta["book"] != getattr(sh, "title", "") or meta["source"] != source or time.time() - meta["saved_at"] > SNAPSHOT_FILE_TTL: return None
+    values = {t: [None] * n for t, n in meta["lengths"].items()}
+    cols = [table.column(f"c{j}").to_pylist() for j in range(table.num_columns - 2)]
+    for k, (title, i) in enumerate(zip(table.column("sheet").to_pylist(), table.column("row").to_pylist())):
+        row = [c[k] for c in cols]
+        while row and row[-1] is None: row.pop()
+        values[title][i] = row
+    index = JournalIndex.from_dict(meta["journal"]) if meta["journal"] else None
+    return {"version": meta["version"], "values": values, "journal": index, "months": {tuple(m) for m in meta["months"]}, "origin": "disk"}
+
+def persist_snapshot():
+    # 直接寫入儲存格 (不經對帳) 後，背景把目前的快照存回快照檔，重啟時不會先顯示舊值
+    state = snapshot_state()
+    with state["lock"]: snap, sh, source = state["snapshot"], state["book"], state["source"]
+    if sh is not None: threading.Thread(target=save_snapshot_file, args=(sh, snap, source), name="snapshot-save", daemon=True).start()
+
+def settle_snapshot(snapshot, timeout=SNAPSHOT_SETTLE_TIMEOUT):
+    # 以本地快照檔渲染的畫面：等背景對帳結束，回傳試算表是否有新資料 (需要重跑)
+    if snapshot.get("origin") != "disk": return False
+    state = snapshot_state()
+    end = time.time() + timeout
+    while state["reconciling"] and time.time() < end: time.sleep(0.05)
+    with state["lock"]:
+        return state["snapshot"] is not None and state["snapshot"]["version"] != snapshot["version"]
+
+def records_frame(values, head=1):
+    # 與 ws.get_all_records(head=head) 相同的轉換 (補齊欄位 + 數字化)
+    if len(values) < head: return pd.DataFrame()
+    grid = fill_gaps(values)
+    keys = grid[head - 1]
+    return pd.DataFrame(to_records(keys, [numericise_all(r) for r in grid[head:]]))
+
+def snapshot_cell(snapshot, ws_name, row, col, default=""):
+    # 對應 ws.cell(row, col).value，從快照讀取不發出請求
+    try: return snapshot["values"][ws_name][row - 1][col - 1]
+    except (KeyError, IndexError): return default
+
+@st.cache_resource
+def cell_write_state():
+    # 跨 session 共用：每個儲存格最後寫入的 (快照版本, 值, 時間, 延後待寫的值) 與寫入/略過次數
+    return {"lock": threading.Lock(), "cells": {}, "written": 0, "skipped": 0}
+
+def write_cell_if_changed(ws, snapshot, row, col, value, debounce=CELL_WRITE_DEBOUNCE, queue=None):
+    # 值與快照相同、或同一版本快照已寫過相同值 → 略過；
+    # 距上次寫入未滿 debounce 秒 → 記成待寫 (pending_cell)，之後的 rerun 再呼叫時送出
+    # queue：寫入佇列，有的話排在佇列中的批次寫入之後送出 (直接寫入會被之後才送出的舊值蓋掉)
+    state = cell_write_state()
+    key = (ws.title, row, col)
+    with state["lock"]:
+        last_version, last_value, last_at, _ = state["cells"].get(key, (None, None, 0, None))
+        try: cached = to_int(snapshot_cell(snapshot, ws.title, row, col))
+        except ValueError: cached = None
+        if value == cached or (last_version == snapshot["version"] and last_value == value):
+            if key in state["cells"]: state["cells"][key] = (last_version, last_value, last_at, None)
+            state["skipped"] += 1
+            written = False
+        elif time.time() - last_at < debounce:
+            state["cells"][key] = (last_version, last_value, last_at, value)
+            state["skipped"] += 1
+            written = False
+        else:
+            if queue is not None: queue.put([update_cells(ws.id, row, col, [value])], label=f"{ws.title}!R{row}C{col}", kind="cell")
+            else: ws.update_cell(row, col, value)
+            state["cells"][key] = (snapshot["version"], value, time.time(), None)
+            state["written"] += 1
+            written = True
+    # 快照是跨 session 共用的那份：真的送出才改，延後的值只留在 cell_write_state (否則下次會當成已寫過)
+    if written:
+        try: snapshot["values"][ws.title][row - 1][col - 1] = value
+        except (KeyError, IndexError): pass
+        if queue is None: persist_snapshot()
+    return written
+
+def pending_cell(ws_title, row, col):
+    # 延後待寫的值 (沒有則 None)：呼叫端在之後的 rerun 重算並再呼叫 write_cell_if_changed
+    c = cell_write_state()["cells"].get((ws_title, row, col))
+    return c[3] if c else None
+
+ASSET_SHEET = "資產總覽表"
+
+def asset_registry(snapshot):
+    # 每份快照建一次，存在快照本身 (快照換版本就跟著換)
+    if "assets" not in snapshot: snapshot["assets"] = AssetRegistry.from_rows(snapshot["values"].get(ASSET_SHEET, []))
+    return snapshot["assets"]
+
+def to_int(v):
+    return int(str(v).replace(',', ''))
+
+# --- 列 ID ---
+# 日記帳與購物冷靜清單的列以 ID 指定 (ledger.RowIds)；索引每份快照建一次 (日記帳只含已載入的列)，
+# 寫入後由 apply_to_snapshot 修補。分頁還沒有 ID 欄時 (舊表) 啟動時一次補上，補好之前維持以列號操作
+ID_HEADS = {JOURNAL: JOURNAL_HEAD, SHOP_SHEET: 1}
+ID_CHUNK = 5000
+
+def row_ids(snapshot, ws_name):
+    ids = snapshot.setdefault("ids", {})
+    if ws_name not in ids: ids[ws_name] = RowIds.from_rows(snapshot["values"].get(ws_name) or [], ID_HEADS.get(ws_name, 1))
+    return ids[ws_name]
+
+def missing_ids(snapshot):
+    # {分頁: 缺 ID 的列號}；沒有 ID 欄的分頁是全部資料列 (日記帳含未載入的列)，否則只看已載入、非空白的列
+    out = {}
+    for ws_name, head in ID_HEADS.items():
+        rows = snapshot["values"].get(ws_name)
+        if not rows or len(rows) < head or not rows[head - 1]: continue
+        col = row_ids(snapshot, ws_name).col
+        if not col: need = list(range(head + 1, len(rows) + 1))
+        else: need = [i + 1 for i in range(head, len(rows)) if rows[i] and any(str(v).strip() for v in rows[i]) and not (len(rows[i]) >= col and str(rows[i][col - 1]).strip())]
+        if need: out[ws_name] = need
+    return out
+
+def assign_row_ids(sh, snapshot):
+    # 補上缺少的 ID (沒有 ID 欄就在表頭最後加一欄)：一次 batch_update，之後重新載入快照；回傳補上的列數
+    need = missing_ids(snapshot)
+    if not need: return 0
+    worksheets, reqs = get_worksheets(sh), []
+    for ws_name, rows in need.items():
+        sid, head = worksheets[ws_name].id, ID_HEADS[ws_name]
+        col = row_ids(snapshot, ws_name).col
+        if not col:
+            col = len(snapshot["values"][ws_name][head - 1]) + 1
+            reqs.append(update_cells(sid, head, col, [ID_COLUMN]))
+        # 連續的列合併成一段往下寫
+        runs = []
+        for r in rows:
+            if runs and runs[-1][1] == r - 1 and r - runs[-1][0] < ID_CHUNK: runs[-1][1] = r
+            else: runs.append([r, r])
+        reqs += [update_column(sid, s, col, [new_id() for _ in range(s, e + 1)]) for s, e in runs]
+    sh.batch_update({"requests": reqs})
+    # 套用到快照；日記帳未載入的列套用不了時快照作廢，重新載入時比對不到最後一列就整張重讀
+    titles = {ws.id: t for t, ws in worksheets.items()}
+    index = apply_to_snapshot(reqs, titles)
+    if JOURNAL in need: save_journal_index(sh, index)
+    persist_snapshot()
+    return sum(len(r) for r in need.values())
+
+# --- 餘額 (日記帳事件 + 檢查點) ---
+# 帳戶餘額 (BALANCE_ACCOUNTS) 與資金檢核 B9 (總透支缺口) 由檢查點 + 日記帳推出 (ledger.BalanceCheckpoint)：
+# 試算表上的值是寫出的結果，寫入時以「推算值 + 這次的事件」寫絕對值，不再讀現值加減，少寫或寫錯一次也不會一直錯下去。
+# 檢查點存在 BALANCE_CHECKPOINT_PATH (以工作簿區分)；沒有時以試算表目前的值建立，之後每 CHECKPOINT_INTERVAL 秒換新
+# FINANCE_BALANCE_CHECKPOINT: 檢查點檔路徑
+STATUS_SHEET = "現況資金檢核"
+BALANCE_CHECKPOINT_PATH = os.environ.get("FINANCE_BALANCE_CHECKPOINT", os.path.join(DATA_DIR, "finance_balance_checkpoint.json"))
+CHECKPOINT_INTERVAL = 86400
+
+@st.cache_resource
+def balance_state():
+    # 跨 session 共用的檢查點 (工作簿換了就重讀檔案)
+    return {"lock": threading.Lock(), "key": None, "checkpoint": None}
+
+def balance_key(sh):
+    return f"{getattr(sh, 'title', '')}/balances"
+
+def read_checkpoint(sh):
+    try:
+        with open(BALANCE_CHECKPOINT_PATH, encoding="utf-8") as f: d = json.load(f).get(balance_key(sh))
+        return BalanceCheckpoint.from_dict(d) if d else None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError): return None
+
+def save_checkpoint(sh, cp):
+    # 寫不進去 (唯讀環境) 就只留在記憶體
+    state = balance_state()
+    state["key"], state["checkpoint"] = balance_key(sh), cp
+    try:
+        try:
+            with open(BALANCE_CHECKPOINT_PATH, encoding="utf-8") as f: data = json.load(f)
+        except (OSError, ValueError): data = {}
+        data[balance_key(sh)] = cp.to_dict()
+        tmp = f"{BALANCE_CHECKPOINT_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, BALANCE_CHECKPOINT_PATH)
+    except OSError: pass
+
+def load_checkpoint(sh):
+    state = balance_state()
+    if state["key"] != balance_key(sh): state["key"], state["checkpoint"] = balance_key(sh), read_checkpoint(sh)
+    return state["checkpoint"]
+
+def sheet_balances(snapshot):
+    # 試算表上目前的值 {帳戶 / GAP: 值}；不是數字為 None，分頁 / 帳戶不存在就不列
+    assets, out = asset_registry(snapshot), {}
+    for name in BALANCE_ACCOUNTS:
+        if name in assets: out[name] = assets.value(name, None)
+    if STATUS_SHEET in snapshot["values"]: out[GAP] = parse_amount(snapshot_cell(snapshot, STATUS_SHEET, 9, 2))
+    return out
+
+@st.cache_data(ttl=SNAPSHOT_TTL, show_spinner=False)
+def journal_effects(_snapshot, version, rules_key, _transfers):
+    # 每份快照 (與規則檔版本) 算一次：已載入的月份 → 影響合計 (沒有列的月份為 {})
+    effects = month_effects(effect_frame(_snapshot), _transfers)
+    loaded = _snapshot.get("months", set()) if _snapshot.get("journal") is not None else set(effects)
+    return {ym: effects.get(ym, {}) for ym in loaded}
+
+def derived_balances(sh, snapshot, rules_key=None, transfers=()):
+    # 目前的推算值 {帳戶 / GAP: 值}；沒有檢查點 (或資產總覽表多了帳戶) 就以試算表目前的值為起點
+    if "values" not in snapshot or not snapshot["values"]: return {}
+    now = journal_effects(snapshot, snapshot["version"], rules_key, transfers)
+    present = set(journal_months(snapshot))
+    sheet = {k: v for k, v in sheet_balances(snapshot).items() if v is not None}
+    with balance_state()["lock"]:
+        cp = load_checkpoint(sh)
+        changed = cp is None
+        if cp is None: cp = BalanceCheckpoint(time.time(), sheet, now, present)
+        derived, adopted = cp.replay(now, present)
+        for k, v in sheet.items():
+            if k not in cp.balances:
+                cp.adjust(k, v, derived.get(k, 0)); derived[k] = v; changed = True
+        if adopted: cp.adopt(adopted); changed = True
+        if time.time() - cp.at > CHECKPOINT_INTERVAL: cp, changed = cp.rebase(derived, now, present, time.time()), True
+        if changed: save_checkpoint(sh, cp)
+    return derived
+
+def record_balances(sh, changes, rules_key=None, transfers=()):
+    # commit 成功 (或已記入寫入佇列) 的日記帳變動 [(年, 月, 交易, ±1)] 記進檢查點 (BalanceCheckpoint.record)；
+    # 基準還沒有的月份，由寫入後的快照 (已套用這次的變動) 推回寫入前的影響
+    months = change_effects(changes, transfers)
+    cp = load_checkpoint(sh)
+    if not months or cp is None: return
+    after, snap = {}, snapshot_state()["snapshot"]
+    if snap is not None and snap.get("values") and any(ym not in cp.effects for ym in months):
+        after = journal_effects(snap, snap["version"], rules_key, transfers)
+    with balance_state()["lock"]:
+        cp = load_checkpoint(sh)
+        for ym, change in months.items():
+            cp.record(ym, change, merge_effects(after[ym], {k: -v for k, v in change.items()}) if ym in after else None)
+        save_checkpoint(sh, cp)
+
+def adjust_balance(sh, name, value, current):
+    # 餘額在日記帳之外改成 value (手動修改 / 缺口同步)；current 為修改前的推算值
+    with balance_state()["lock"]:
+        cp = load_checkpoint(sh)
+        if cp is None: return
+        cp.adjust(name, value, current)
+        save_checkpoint(sh, cp)
+
+def reset_balances(sh, snapshot, rules_key=None, transfers=()):
+    # 以試算表目前的值重設檢查點 (試算表上手動改過餘額時)
+    now = journal_effects(snapshot, snapshot["version"], rules_key, transfers)
+    sheet = {k: v for k, v in sheet_balances(snapshot).items() if v is not None}
+    with balance_state()["lock"]: save_checkpoint(sh, BalanceCheckpoint(time.time(), sheet, now, set(journal_months(snapshot))))
+
+def rebuild_balances(sh, snapshot, rules_key=None, transfers=()):
+    # 完整重算：補抓日記帳所有月份 (一次讀取) 與檢查點逐月比對，之後以全部月份換新檢查點；
+    # 回傳 (載入全部月份的快照, 推算值)，寫回試算表由呼叫端以 SheetBatch 進行
+    index = snapshot.get("journal")
+    if index is not None: snapshot = load_journal_months(sh, set(index.months()))
+    derived = derived_balances(sh, snapshot, rules_key, transfers)
+    now = journal_effects(snapshot, snapshot["version"], rules_key, transfers)
+    with balance_state()["lock"]:
+        cp = load_checkpoint(sh)
+        if cp is not None: save_checkpoint(sh, cp.rebase(derived, now, set(journal_months(snapshot)), time.time()))
+    return snapshot, derived
+
+# --- 寫入佇列 (write_queue.WriteQueue) ---
+# SheetBatch 的請求先記入本地寫入日誌 (fsync 後才回傳) 並套用到樂觀快照，由背景執行緒合併送出；
+# 程序中斷後重啟時先把日誌中沒送完的命令送完，才從 API 載入快照。本地鏡像模式本身就是非同步寫入，不經佇列
+# FINANCE_WRITE_JOURNAL: 寫入日誌檔路徑 (空字串表示停用，SheetBatch 直接同步寫入)
+WRITE_JOURNAL = os.environ.get("FINANCE_WRITE_JOURNAL", os.path.join(DATA_DIR, "finance_write_journal.jsonl"))
+WRITE_SETTLE_TIMEOUT = 30
+
+@st.cache_resource
+def write_queue(path):
+    # 跨 session 共用一個佇列與背景執行緒
+    return WriteQueue(path)
+
+def start_write_queue(sh):
+    # 停用時回傳 None；佇列送空後對帳快照
+    if not WRITE_JOURNAL: return None
+    titles = lambda: [t for t in SNAPSHOT_SHEETS if t in get_worksheets(sh)]
+    return write_queue(WRITE_JOURNAL).start(sh, lambda sent, failed, moved: writes_drained(sh, titles(), sent, failed, moved))
+
+def writes_pending():
+    if not WRITE_JOURNAL: return 0
+    q = write_queue(WRITE_JOURNAL)
+    return q.depth() if q.thread is not None else 0
+
+def settle_writes(timeout=WRITE_SETTLE_TIMEOUT):
+    # 重新載入快照前等佇列送空 (否則讀回的內容少了還沒送出的寫入)；回傳是否已送空
+    end = time.time() + timeout
+    while writes_pending() and time.time() < end: time.sleep(0.05)
+    return not writes_pending()
+
+def writes_drained(sh, titles, sent, failed, moved):
+    # 有列位移或放棄的命令：樂觀快照與試算表不一致 → 作廢重新載入 (放棄的命令可能新增 / 刪除過日記帳的列，索引一併重建)；
+    # 送出的命令都以 ID 核對過 (或是單一儲存格寫入) → 只存回快照檔；其餘背景對帳
+    if moved or failed: drop_snapshot(bool(failed) or JOURNAL in moved)
+    elif all(it["checks"] or it.get("kind") == "cell" for it in sent): persist_snapshot()
+    else: reconcile_snapshot(sh, titles)
+
+# --- 批次寫入 (Unit of Work) ---
+APPEND_CHUNK = 500
+class SheetBatch:
+    # 收集一次操作的所有寫入 (新增列 / 儲存格 / 刪除列)，commit 時合併成單一 batch_update，
+    # 資產的列號來自快照的資產登錄表 (餘額寫絕對值，不讀現值加減)；任何一步失敗都不會寫入半套
+    # checks：以 ID 指定的列 {(分頁, 列號): ID}，commit 前一次讀回這幾格核對，列被移動就改寫到新列號 (moved：有位移的分頁)
+    # queue：寫入佇列 (WriteQueue)；有的話 commit 只記入佇列，核對與送出都在背景進行
+    def __init__(self, sh, worksheets, snapshot, queue=None):
+        self.sh, self.worksheets, self.snapshot, self.queue = sh, worksheets, snapshot, queue
+        self.cells = {}
+        self.appends = []
+        self.appended = []
+        self.deletes = []
+        self.errors = []
+        self.journal_months = []
+        self.checks = {}
+        self.moved = set()
+        self.assets = asset_registry(snapshot).copy()
+
+    def set(self, ws_name, row, col, value):
+        self.cells[(ws_name, row, col)] = value
+
+    def set_asset(self, name, value):
+        row = self.assets.row(name)
+        if row == -1: return False
+        self.assets.set(name, value)
+        self.set(ASSET_SHEET, row, 2, value)
+        return True
+
+    def append(self, ws_name, values, month=None):
+        # month：新增到日記帳時該列的 (年, 月)，用來更新列範圍索引；分頁有 ID 欄就帶上新的 ID
+        col = row_ids(self.snapshot, ws_name).col if ws_name in ID_HEADS else 0
+        if col:
+            values = (list(values) + [""] * col)[:max(col, len(values))]
+            values[col - 1] = new_id()
+            self.appended.append((ws_name, col, values[col - 1]))
+        self.appends.append((ws_name, values))
+        if ws_name == JOURNAL: self.journal_months.append(month)
+
+    def append_rows(self, ws_name, rows, months=None):
+        for values, month in zip(rows, months or [None] * len(rows)): self.append(ws_name, values, month)
+
+    def delete_row(self, ws_name, row):
+        self.deletes.append((ws_name, row))
+
+    def locate(self, ws_name, row_id, row):
+        # 以 ID 查目前的列號並登記 commit 前核對；分頁沒有 ID 欄 / 這列沒有 ID 時沿用 row (快照中的列號)
+        ids = row_ids(self.snapshot, ws_name)
+        row_id = str(row_id or "").strip()
+        if not ids.col or not row_id: return row
+        found = ids.row(row_id)
+        if found == -1:
+            self.errors.append(f"{ws_name} 找不到 ID {row_id}，請重新整理")
+            return row
+        self.checks[(ws_name, found)] = row_id
+        return found
+
+    def verify(self):
+        # 一次讀回所有以 ID 指定的儲存格；ID 不符 (其他地方增刪過列) 就依 ID 欄找出新列號改寫，
+        # 找不到表示已被刪除 → 整批放棄
+        moved, missing = locate_ids(self.sh, self.check_list())
+        self.errors += [f"{w} 第 {r} 列已在其他地方被刪除" for w, r in missing]
+        self.moved = {w for w, _ in list(moved) + missing}
+        if self.errors: return
+        self.cells = {(w, moved.get((w, r), r), c): v for (w, r, c), v in self.cells.items()}
+        self.deletes = [(w, moved.get((w, r), r)) for w, r in self.deletes]
+
+    def check_list(self):
+        return [(w, r, row_ids(self.snapshot, w).col, i) for (w, r), i in self.checks.items()]
+
+    def requests(self):
+        sid = lambda ws_name: self.worksheets[ws_name].id
+        reqs = [update_cells(sid(w), r, c, [v]) for (w, r, c), v in self.cells.items()]
+        # 連續附加到同一分頁的列合併成 appendCells，每個最多 APPEND_CHUNK 列
+        chunks = []
+        for w, vals in self.appends:
+            if chunks and chunks[-1][0] == w and len(chunks[-1][1]) < APPEND_CHUNK: chunks[-1][1].append(vals)
+            else: chunks.append((w, [vals]))
+        reqs += [append_cells(sid(w), rows) for w, rows in chunks]
+        # 由下往上刪，避免列號位移
+        reqs += [delete_rows(sid(w), r) for w, r in sorted(self.deletes, key=lambda d: -d[1])]
+        return reqs
+
+    def summary(self):
+        # 佇列中顯示的命令說明，例如「流動支出日記帳：新增 1 列；資產總覽表：修改 2 格」
+        parts = {}
+        for w, n in [(w, "新增") for w, _ in self.appends] + [(w, "刪除") for w, _ in self.deletes]:
+            parts.setdefault(w, {}).setdefault(n, 0); parts[w][n] += 1
+        for w, _, _ in self.cells: parts.setdefault(w, {}).setdefault("修改", 0); parts[w]["修改"] += 1
+        return "；".join(f"{w}：" + "、".join(f"{n} {k} {'格' if n == '修改' else '列'}" for n, k in d.items()) for w, d in parts.items())
+
+    def commit(self):
+        if self.errors: raise ValueError("；".join(self.errors))
+        if not (self.cells or self.appends or self.deletes): return
+        if self.queue is not None: return self.enqueue()
+        self.verify()
+        if self.errors:
+            drop_snapshot(JOURNAL in self.moved)
+            raise ValueError("；".join(self.errors))
+        reqs = self.requests()
+        self.sh.batch_update({"requests": reqs})
+        if self.moved:
+            drop_snapshot(JOURNAL in self.moved)
+            return
+        self.apply(reqs)
+        # 目標列剛以 ID 核對過：不必再背景重抓，只把快照存回快照檔
+        if self.checks: persist_snapshot()
+        else: reconcile_snapshot(self.sh, [t for t in SNAPSHOT_SHEETS if t in self.worksheets])
+
+    def enqueue(self):
+        # 先記入寫入日誌再套用到快照 (記不進去就丟出例外，快照不變)；以 ID 指定的列隨命令帶著，送出前才核對
+        reqs = self.requests()
+        sid = lambda ws_name: self.worksheets[ws_name].id
+        self.queue.put(reqs, [(w, sid(w), r, c, i) for w, r, c, i in self.check_list()], self.appended, self.summary())
+        self.apply(reqs)
+
+    def apply(self, reqs):
+        titles = {ws.id: t for t, ws in self.worksheets.items()}
+        # 資產分頁只經由 add_asset / set_asset 修改時，登錄表已是最新
+        rows = self.assets.rows()
+        assets_ok = all(c == 2 and r in rows for (w, r, c) in self.cells if w == ASSET_SHEET) and \
+            ASSET_SHEET not in [w for w, _ in self.appends + self.deletes]
+        index = apply_to_snapshot(reqs, titles, self.assets if assets_ok else None, self.journal_months)
+        if any(titles.get(request_sheet_id(r)) == JOURNAL for r in reqs): save_journal_index(self.sh, index)
+
+@st.cache_data(show_spinner=False)
+def recurring_rules(path, mtime):
+    # 規則檔修改時間變了才重讀
+    return load_rules(path)
+
+@st.cache_data(ttl=SNAPSHOT_TTL, show_spinner=False)
+def rule_index(_snapshot, version, rules_key, _rules, months=None):
+    # 每份快照 (與規則檔版本) 建一次；命中快取時不必把日記帳轉成 DataFrame。months：只看這些月份 (預設為已載入的月份)
+    df = journal_frame(_snapshot, months)
+    if df.empty: return {}
+    return logged_rule_index(_rules, df['Year'], df['Month'], df['項目'])
+
+# --- 每月彙總 (增量更新) ---
+@st.cache_resource
+def rollup_state():
+    return {"lock": threading.Lock(), "version": None, "rollup": None, "carry": None}
+
+def journal_rollup(df_log, version):
+    # 每份快照建一次；若上一份彙總已套用本程序的寫入且筆數相符，直接沿用不重建
+    state = rollup_state()
+    with state["lock"]:
+        if state["version"] != version:
+            carry = state["carry"]
+            state["rollup"] = carry if carry is not None and carry.rows == len(df_log) else MonthRollup.from_journal(df_log)
+            state["version"], state["carry"] = version, None
+        return state["rollup"]
+
+def carry_rollup(changes):
+    # changes: [(年, 月, 列, ±1)]；寫入成功後呼叫，下一份快照沿用
+    state = rollup_state()
+    with state["lock"]:
+        if state["rollup"] is None: return
+        for year, month, rec, sign in changes: state["rollup"].apply(year, month, rec, sign)
+        state["carry"] = state["rollup"]
+
+# --- 日記帳冷資料分區 (依年份封存) ---
+# 保留期 (本月在內 ARCHIVE_KEEP 個月) 以外的月份搬到「流動支出日記帳 年份」分頁，日記帳本身只留最近幾個月；
+# 封存清單 (ARCHIVE_SHEET) 記錄各月所在分頁與預先算好的彙總。封存分頁唯讀，查詢時整張讀一次後快取
+# FINANCE_ARCHIVE_KEEP: 保留月數 (0 表示不封存)
+ARCHIVE_SHEET = "日記帳封存"
+ARCHIVE_KEEP = int(os.environ.get("FINANCE_ARCHIVE_KEEP", 3))
+
+def partition_title(year):
+    return f"{JOURNAL} {year}"
+
+def archive_manifest(snapshot):
+    # 每份快照建一次，存在快照本身
+    if "archive" not in snapshot: snapshot["archive"] = ArchiveManifest.from_rows(snapshot["values"].get(ARCHIVE_SHEET, []))
+    return snapshot["archive"]
+
+def archive_due(snapshot, today, keep=ARCHIVE_KEEP):
+    # 日記帳中超過保留期、應封存的月份
+    index = snapshot.get("journal")
+    return archive_months(index.months(), today, keep) if index is not None else []
+
+@st.cache_data(show_spinner=False)
+def partition_frame(_sh, title, rows):
+    # rows：封存清單記錄的筆數，分頁有新的封存才重讀
+    df = records_frame(fetch_values(_sh, [title])[title], JOURNAL_HEAD)
+    if not df.empty and '日期' in df.columns: df[['Date', 'Year', 'Month']] = parse_log_dates(df['日期'], date.today())
+    return df
+
+def archived_frame(sh, snapshot, months):
+    # 指定月份中已封存的列 (唯讀，index 與日記帳列號無關)
+    manifest = archive_manifest(snapshot)
+    months = {m for m in months if m in manifest.partitions}
+    frames = []
+    for title in sorted({manifest.partitions[m] for m in months}):
+        df = partition_frame(sh, title, manifest.counts[title])
+        if not df.empty: frames.append(df[[ym in months for ym in zip(df['Year'].tolist(), df['Month'].tolist())]])
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def month_spend(sh, snapshot, months):
+    # 各月變動支出 (每月彙總的 variable)：未封存的月份補抓後現算，已封存的直接查封存清單的彙總；
+    # 結果記在快照上 (補抓月份後的快照共用同一份，寫入後的新快照才重算)
+    spend = snapshot.setdefault("spend", {})
+    manifest = archive_manifest(snapshot)
+    hot = [m for m in months if m not in spend and m not in manifest.partitions]
+    if hot:
+        rollup = MonthRollup.from_journal(journal_frame(load_journal_months(sh, hot), hot))
+        spend.update((m, rollup.month_kpis(*m)["variable"]) for m in hot)
+    return {m: spend[m] if m in spend else manifest.rollup.month_kpis(*m)["variable"] for m in months}
+
+@st.cache_resource
+def archive_state():
+    return {"lock": threading.Lock()}
+
+def archive_journal(sh, today, keep=ARCHIVE_KEEP):
+    # 把超過保留期的月份搬到年份分頁並記入封存清單：新增分頁以外只有一次 batch_update
+    # (附加到年份分頁 + 封存清單、刪除日記帳的列)，之後重新載入快照與索引；回傳搬移筆數
+    with archive_state()["lock"]:
+        snap = load_snapshot(sh, getattr(sh, "version", 0))
+        months, index = archive_due(snap, today, keep), snap.get("journal")
+        if not months: return 0
+        snap = load_journal_months(sh, months)
+        df, rows = journal_frame(snap, months), snap["values"][JOURNAL]
+        if df.empty or '日期' not in df.columns: return 0
+        col = rows[JOURNAL_HEAD - 1].index('日期')
+        # 封存的列改寫成完整日期，年份不再依賴列順序
+        full = dict(zip(df.index.tolist(), df['Date'].dt.strftime("%Y/%m/%d").tolist()))
+        parts = {}
+        for (y, m), s, e in sorted(((k, s, e) for k in months for s, e in index.spans[k]), key=lambda x: x[1]):
+            for r in range(s, e + 1):
+                row, d = list(rows[r - 1]), full[r - JOURNAL_HEAD - 1]
+                if d == d and col < len(row): row[col] = d
+                parts.setdefault(y, []).append(row)
+
+        worksheets, added = get_worksheets(sh), set()
+        for title in [partition_title(y) for y in parts] + [ARCHIVE_SHEET]:
+            if title not in worksheets:
+                sh.add_worksheet(title, rows=1000, cols=max(len(rows[JOURNAL_HEAD - 1]), len(ARCHIVE_COLUMNS)))
+                added.add(title)
+        if added:
+            get_worksheets.clear()
+            worksheets = get_worksheets(sh)
+        sid = lambda title: worksheets[title].id
+        reqs = []
+        for y, part in sorted(parts.items()):
+            if partition_title(y) in added: part = [list(r) for r in rows[:JOURNAL_HEAD]] + part
+            reqs += [append_cells(sid(partition_title(y)), part[i:i + APPEND_CHUNK]) for i in range(0, len(part), APPEND_CHUNK)]
+        manifest = manifest_rows(MonthRollup.from_journal(df), partition_title)
+        reqs.append(append_cells(sid(ARCHIVE_SHEET), ([ARCHIVE_COLUMNS] if ARCHIVE_SHEET in added or not snap["values"].get(ARCHIVE_SHEET) else []) + manifest))
+        # 由下往上刪
+        reqs += [delete_rows(sid(JOURNAL), s, e) for s, e in sorted(index.rows(months), reverse=True)]
+        sh.batch_update({"requests": reqs})
+        save_journal_index(sh, None)
+        invalidate_snapshot()
+        return len(df)
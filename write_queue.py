@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+import time
+from gspread.exceptions import APIError
+from quota import is_retryable
+from sheet_ops import locate_ids, read_ids, request_sheet_id, shift_rows
+
+# --- 寫入佇列 (write-behind) ---
+# 一次操作 (新增交易 / 餘額增減 / 切換入帳 / 刪除 ...) 的 batch_update 請求是一筆命令：先附加到本地日誌檔
+# (JSONL，寫入後 fsync) 就算完成，畫面以樂觀快照繼續；背景執行緒依序把佇列開頭的命令合併成一次 batch_update 送出。
+# 日誌每列一筆紀錄：
+#   {"op": "put", "seq", "at", "kind", "label", "requests", "checks", "appended"}   命令 (kind：batch / cell)
+#   {"op": "done", "seq"} / {"op": "fail", "seq", "reason"}                 已送出 / 放棄
+# 程序重啟時讀回日誌，沒有 done / fail 的命令照順序重送；佇列清空後日誌只留最近 FAILED_KEEP 筆放棄的命令
+# checks：[分頁, sheetId, 列號, ID 欄, ID]，送出前核對 (列被移動就改寫列號，找不到就放棄這筆)
+# appended：[分頁, ID 欄, ID]，重送前先查這些 ID 是否已在分頁上 (送出後、記下 done 前中斷)，有就不再送
+QUEUE_RETRY = 5
+QUEUE_RETRY_CAP = 120
+FAILED_KEEP = 50
+
+def next_group(items, limit=None):
+    # 佇列開頭可以合併送出的命令：以 ID 核對的列不能排在同一批、同一分頁的刪除之後 (核對時列號還沒位移)，
+    # 也不能是同一批前面才新增的列 (核對時還不在分頁上)
+    group, deleted, appended = [], set(), set()
+    for it in items[:limit]:
+        if group and any(c[1] in deleted or c[4] in appended for c in it["checks"]): break
+        group.append(it)
+        deleted |= {request_sheet_id(r) for r in it["requests"] if "deleteDimension" in r}
+        appended |= {a[2] for a in it["appended"]}
+    return group
+
+def already_sent(sh, items):
+    # 重送的命令中，新增的列 (以 ID) 已經在分頁上的 seq
+    cols = {t: c for it in items for t, c, _ in it["appended"]}
+    if not cols: return set()
+    now = read_ids(sh, cols)
+    return {it["seq"] for it in items if any(i in now[t] for t, _, i in it["appended"])}
+
+class WriteQueue:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.changed = threading.Event()
+        self.items, self.failed = [], []
+        self.seq, self.sent, self.solo, self.busy = 0, 0, False, False
+        self.last_error, self.last_sent = "", 0
+        self.sh, self.after, self.thread = None, None, None
+        self._load()
+
+    # --- 日誌檔 ---
+    def _load(self):
+        puts, ends = {}, {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try: rec = json.loads(line)
+                    except ValueError: continue     # 寫到一半就中斷的最後一列
+                    if rec.get("op") == "put": puts[rec["seq"]] = rec
+                    elif rec.get("op") in ("done", "fail"): ends[rec["seq"]] = rec
+        except OSError: pass
+        for seq in sorted(puts):
+            end = ends.get(seq)
+            if end is None: self.items.append({**puts[seq], "replayed": True})
+            elif end["op"] == "fail": self.failed.append({**puts[seq], "reason": end.get("reason", "")})
+        self.seq = max(list(puts) + list(ends), default=0)
+        self._compact()
+
+    def _write(self, records):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self):
+        # 只留尚未送出的命令與最近放棄的命令
+        self.failed = self.failed[-FAILED_KEEP:]
+        records = []
+        for it in self.failed:
+            records += [{k: v for k, v in it.items() if k != "reason"}, {"op": "fail", "seq": it["seq"], "reason": it["reason"]}]
+        records += [{k: v for k, v in it.items() if k != "replayed"} for it in self.items]
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f: f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+            os.replace(tmp, self.path)
+        except OSError: pass
+
+    # --- 寫入端 ---
+    def put(self, requests, checks=(), appended=(), label="", kind="batch"):
+        # 記入日誌後才回傳 (寫不進去就丟出 OSError，呼叫端不套用快照)；kind="cell"：單一儲存格直接寫入
+        with self.lock:
+            item = {"op": "put", "seq": self.seq + 1, "at": time.time(), "kind": kind, "label": label,
+                    "requests": requests, "checks": [list(c) for c in checks], "appended": [list(a) for a in appended]}
+            self._write([item])
+            self.seq += 1
+            self.items.append(item)
+        self.changed.set()
+        return item["seq"]
+
+    def depth(self):
+        with self.lock: return len(self.items)
+
+    def status(self):
+        with self.lock:
+            return {"depth": len(self.items), "lag": time.time() - self.items[0]["at"] if self.items else 0.0,
+                    "sent": self.sent, "failed": [dict(it) for it in self.failed], "last_error": self.last_error, "last_sent": self.last_sent}
+
+    def clear_failed(self):
+        with self.lock:
+            self.failed = []
+            if not self.items: self._compact()
+
+    # --- 背景送出 ---
+    def drain(self, sh):
+        # 送出佇列開頭可合併的一批命令 → (送出 / 已在分頁上的命令, 放棄的命令, 列有位移的分頁)；
+        # 可重試的錯誤照樣丟出，命令留在佇列
+        with self.lock: group = next_group(self.items, 1 if self.solo else None)
+        if not group: return [], [], set()
+        skip = already_sent(sh, [it for it in group if it.get("replayed")])
+        todo = [it for it in group if it["seq"] not in skip]
+        moved, missing = locate_ids(sh, [(t, r, c, i) for it in todo for t, _, r, c, i in it["checks"]])
+        send, failed = [], []
+        for it in todo:
+            lost = [f"{t} 第 {r} 列" for t, _, r, _, _ in it["checks"] if (t, r) in missing]
+            if lost:
+                failed.append({**it, "reason": f"{'、'.join(lost)}已在其他地方被刪除"})
+                continue
+            shifts = {}
+            for t, sid, r, _, _ in it["checks"]:
+                if (t, r) in moved: shifts.setdefault(sid, {})[r] = moved[(t, r)]
+            reqs = it["requests"]
+            for sid, m in shifts.items(): reqs = [shift_rows(q, sid, m) for q in reqs]
+            send.append((it, reqs))
+        if send:
+            try: sh.batch_update({"requests": [q for _, reqs in send for q in reqs]})
+            except Exception as e:
+                # 離線 / 配額等：照樣丟出，命令留在佇列。API 回報請求本身有誤：多筆合併時改成一次一筆找出是哪一筆，只有一筆就放棄
+                # 逾時 / 連線中斷 / 5xx 時這批可能已經寫入：下次送出前與重啟時一樣，先以 ID 查新增的列是否已在分頁上
+                if not is_retryable(e, write=True):
+                    for it, _ in send: it["replayed"] = True
+                if not isinstance(e, APIError) or is_retryable(e): raise
+                if len(send) > 1:
+                    self.solo = True
+                    raise
+                failed.append({**send[0][0], "reason": str(e)})
+                send = []
+        self.solo = False
+        sent = [it for it, _ in send] + [it for it in group if it["seq"] in skip]
+        with self.lock:
+            self._write([{"op": "done", "seq": it["seq"]} for it in sent] + [{"op": "fail", "seq": it["seq"], "reason": it["reason"]} for it in failed])
+            finished = {it["seq"] for it in sent + failed}
+            self.items = [it for it in self.items if it["seq"] not in finished]
+            self.failed += [{k: v for k, v in it.items() if k != "replayed"} for it in failed]
+            self.sent += len(sent)
+            self.last_sent = time.time()
+            if not self.items: self._compact()
+        return sent, failed, {t for t, _ in list(moved) + missing}
+
+    def flush(self, sh, out):
+        # 送到佇列清空；out 為彙總的 [送出, 放棄, 位移的分頁] (中途丟出例外時保留已送出的部分)
+        while True:
+            s, f, m = self.drain(sh)
+            if not s and not f: return out
+            out[0] += s; out[1] += f; out[2] |= m
+
+    def idle(self):
+        # 佇列已空、也沒有正在送出或對帳回呼
+        return not self.busy and not self.depth()
+
+    def run(self):
+        delay, out = QUEUE_RETRY, [[], [], set()]
+        while True:
+            self.changed.wait(delay if self.last_error else None)
+            self.changed.clear()
+            self.busy = True
+            try:
+                self.flush(self.sh, out)
+                self.last_error, delay = "", QUEUE_RETRY
+                if self.after and (out[0] or out[1]): self.after(*out)
+                out = [[], [], set()]
+            except Exception as e:
+                # 離線 / 配額：命令留在佇列，逐次拉長間隔再試
+                self.last_error, delay = str(e), min(delay * 2, QUEUE_RETRY_CAP)
+            finally:
+                self.busy = False
+
+    def start(self, sh, after=None):
+        # after(送出, 放棄, 位移的分頁)：每次把佇列送空後呼叫 (快照對帳)；重啟時留在日誌的命令立刻開始重送
+        self.sh, self.after = sh, after
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+            self.thread.start()
+        if self.items: self.changed.set()
+        return self